@@ -1,13 +1,31 @@
 import os
+import logging
 from dotenv import load_dotenv
 from flask import Flask, render_template, redirect, request, url_for, session, flash, jsonify, abort
 from flask_pymongo import PyMongo
 import stripe
 from datetime import datetime, timedelta
 from bson import ObjectId
+import metrics
+import profiling
+import tracing
+import log_config
+import db_indexes
+import rollups
+import lesson_series
+import static_assets
+import storage
+import photos
+import page_cache
+import availability
+import live
+import compression
+import templating
 
 # Load environment variables
 load_dotenv()
+log_config.configure_logging()
+log = logging.getLogger(__name__)
 
 app = Flask(__name__)
 
@@ -16,11 +34,29 @@ app.config['SECRET_KEY'] = os.getenv('SECRET_KEY', 'RYxsY:K#IPqI+dMr&MojdYLU7H]v
 app.config['MONGO_URI'] = os.getenv('MONGO_URI', 'mongodb://localhost:27017/primecourt')
 
 # Initialize extensions
+# The command listener must be registered before PyMongo creates its client
+metrics.install_mongo_listener()
+tracing.install_mongo_listener()
 mongo = PyMongo(app)
+db_indexes.init_app(app, mongo)
+rollups.init_app(app, mongo)
+lesson_series.init_app(app, mongo)
+metrics.init_app(app)
+profiling.init_app(app)
+tracing.init_app(app)
+static_assets.init_app(app)
+storage.init_app(app)
+photos.init_app(app, mongo)
+page_cache.init_app(app, mongo)
+live.init_app(app, mongo)
+compression.init_app(app)
+templating.init_app(app)
 
 # Configure Stripe
 stripe.api_key = os.getenv('STRIPE_SECRET_KEY')
 stripe_public_key = os.getenv('STRIPE_PUBLIC_KEY')
+metrics.install_stripe_client(stripe)
+tracing.install_stripe_client(stripe)
 
 # Membership plans configuration (in cents)
 MEMBERSHIP_PLANS = {
@@ -61,7 +97,12 @@ MEMBERSHIP_PLANS = {
 # Import routes after app is created to avoid circular imports
 import routes
 
+# Compile every template up front, now that routes has registered its filters
+if templating.production_mode():
+    templating.preload(app)
+
 @app.route('/')
+@page_cache.page(['coaches'])
 def index():
     # Load active coaches to show on the homepage
     try:
@@ -117,6 +158,8 @@ def court_booking_success():
         
         # Save to database
         mongo.db.court_bookings.insert_one(court_booking)
+        rollups.record_court_booking(mongo.db, court_booking)
+        availability.bump(mongo.db, 'courts', court_booking['date'])
 
         # Send confirmation email
         details = f"<p><strong>Court:</strong> {court_id}</p>"
@@ -126,7 +169,7 @@ def court_booking_success():
         return redirect(url_for('courts', date=date))
         
     except Exception as e:
-        print(f"Error processing court booking success: {str(e)}")
+        log.exception('Error processing court booking success')
         flash('Your payment was successful, but there was an error completing your booking. Please contact support.', 'warning')
         return redirect(url_for('courts'))
 
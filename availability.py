@@ -0,0 +1,53 @@
+"""Per-date availability versions, for cheap conditional GETs on the availability APIs.
+
+One small document per calendar day counts the writes that can change what
+is bookable that day:
+
+    {'_id': '2025-03-04', 'courts': 7, 'lessons': 12}
+
+Court and lesson booking writes, cancellations, lesson series changes and
+schedule edits call `bump()` for the days they touch. /api/courts/availability
+and /api/lessons/availability derive a strong ETag from these counters (plus
+the current day/hour where past slots matter), so a poll whose If-None-Match
+still matches costs one `_id` lookup and returns 304 without reading any
+bookings. live.py watches the same counters to push changes over SSE.
+"""
+import hashlib
+import logging
+
+from pymongo import UpdateOne
+
+from dates import day_key
+
+log = logging.getLogger(__name__)
+
+COLLECTION = 'availability_versions'
+
+_listeners = []
+
+
+def on_change(fn):
+    """Call `fn(kind, days)` after every bump in this process (live.py pushes the change to open pages)."""
+    _listeners.append(fn)
+
+
+def bump(db, kind, *days):
+    """Record a change to `kind` ('courts' or 'lessons') availability on each of `days`."""
+    keys = sorted({day_key(d) for d in days} - {None})
+    if not keys:
+        return
+    try:
+        db[COLLECTION].bulk_write([UpdateOne({'_id': k}, {'$inc': {kind: 1}}, upsert=True) for k in keys],
+                                  ordered=False)
+    except Exception as e:
+        # Clients then keep a stale grid until the next change; never fail the write over it
+        log.warning('availability version bump failed for %s: %s', keys, e)
+    for fn in _listeners:
+        fn(kind, keys)
+
+
+def etag(db, kind, days, *extra):
+    """Strong ETag for `kind` availability over `days`; `extra` adds inputs such as the current hour."""
+    versions = {d['_id']: d.get(kind, 0) for d in db[COLLECTION].find({'_id': {'$in': list(days)}}, {kind: 1})}
+    parts = [kind] + [f'{d}={versions.get(d, 0)}' for d in days] + [str(x) for x in extra]
+    return hashlib.sha1('|'.join(parts).encode('utf-8')).hexdigest()[:32]
@@ -0,0 +1 @@
+"""Reproducible load tests and benchmarks for PrimeCourt Arena (see bench/README.md)."""
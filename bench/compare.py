@@ -0,0 +1,50 @@
+"""Compare two benchmark result files scenario by scenario.
+
+    python -m bench.compare bench/results/v1.3.json bench/results/v1.4.json
+"""
+import argparse
+import json
+import sys
+
+METRICS = ('throughput_rps', 'p50_ms', 'p95_ms', 'p99_ms', 'errors')
+
+
+def _delta(old, new):
+    if not old:
+        return '   n/a'
+    return f'{100.0 * (new - old) / old:+6.1f}%'
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Diff two bench/run.py result files.')
+    parser.add_argument('baseline')
+    parser.add_argument('candidate')
+    args = parser.parse_args(argv)
+    with open(args.baseline) as fh:
+        base = json.load(fh)
+    with open(args.candidate) as fh:
+        cand = json.load(fh)
+
+    print(f"baseline:  {base['meta'].get('label')} ({base['meta'].get('git_revision')})")
+    print(f"candidate: {cand['meta'].get('label')} ({cand['meta'].get('git_revision')})")
+    if base['meta'].get('dataset') != cand['meta'].get('dataset'):
+        print('warning: datasets differ; numbers are not directly comparable')
+    for key in ('concurrency', 'requests_per_scenario', 'server'):
+        if base['meta'].get(key) != cand['meta'].get(key):
+            print(f"warning: {key} differs ({base['meta'].get(key)} vs {cand['meta'].get(key)})")
+    print()
+    print(f"{'scenario':<24}" + ''.join(f'{m:>22}' for m in METRICS))
+    for name in sorted(set(base['scenarios']) | set(cand['scenarios'])):
+        b = base['scenarios'].get(name)
+        c = cand['scenarios'].get(name)
+        if not b or not c:
+            print(f'{name:<24}  only in {"baseline" if b else "candidate"}')
+            continue
+        cells = [f'{b[m]:>8} -> {c[m]:<5}{_delta(b[m], c[m])}' if m != 'errors' else f'{b[m]:>8} -> {c[m]:<11}'
+                 for m in METRICS]
+        print(f'{name:<24}' + ''.join(f'{cell:>22}' for cell in cells))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,297 @@
+"""Double-booking contention benchmark.
+
+Fires `--contenders` simultaneous booking completions at one court hour and at
+one group-lesson slot, then checks the capacity invariants:
+
+- court:  at most one `court_bookings` document per court, date and hour
+- lesson: at most 5 (GROUP_CAPACITY) group bookings per date and slot, and no
+          group booking next to a private one
+
+Three paths are raced: the Stripe success handlers (`/court-booking-success`,
+`/lesson-booking-success`, each contender with its own paid Checkout Session)
+and the legacy `/lessons` POST. A request that fails with a connection error or
+a 5xx is retried like a browser refresh (up to `--max-retries`), and the retry
+rate is reported next to throughput and latency, so a locking or atomic
+reservation change can be judged on correctness and on speed.
+
+    python -m bench.contention --mongo-uri mongodb://localhost:27017/primecourt_bench \
+        --contenders 50 --rounds 5 --label my-branch
+
+Each round targets a fresh slot far in the future (`--days-ahead`), clearing
+anything already booked there, so the rest of the dataset is untouched. Exits
+non-zero if any round violates an invariant.
+"""
+import argparse
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from datetime import datetime, timedelta
+
+from bench import datagen, stubs
+from bench.run import RESULTS_DIR, Client, _git_revision, percentile, start_server
+
+LESSON_SLOT_COUNT = len(datagen.lesson_slot_labels())
+
+
+def _target(round_idx, days_ahead):
+    """Date and slot indexes for one round; consecutive rounds use consecutive days."""
+    day = datetime.now() + timedelta(days=days_ahead + round_idx)
+    return day, round_idx % LESSON_SLOT_COUNT
+
+
+def _clear_slot(db, date_str, lesson_time=None, court_id=None, court_time=None):
+    """Free a slot on a reused bench database: bookings, series occurrences, rollups and caches."""
+    import availability
+    import lesson_series
+    import rollups
+
+    if court_id:
+        db.court_bookings.delete_many({'date': date_str, 'court_id': court_id, 'time': court_time})
+    if lesson_time:
+        db.bookings.delete_many({'date': date_str, 'time': lesson_time})
+        # Pending occurrences of earlier runs' series would still hold the slot
+        db[lesson_series.COLLECTION].update_many(
+            {'status': 'active', 'time': lesson_time, 'start_date': {'$lte': date_str}, 'end_date': {'$gte': date_str}},
+            {'$set': {f'exceptions.{date_str}': 'bench_cleared'}})
+    # A no_classes override or custom slot list would make every contender lose for the wrong reason
+    db.schedule_settings.delete_many({'date': date_str})
+    # The booking flows and the month grid read the day's rollup, not the bookings
+    rollups.rebuild(db, date_str, date_str)
+    availability.bump(db, 'courts' if court_id else 'lessons', date_str)
+
+
+def _court_requests(ctx, day, slot_idx, contenders):
+    court_id = datagen.COURT_IDS[0]
+    court_time = datagen.court_slot_labels()[slot_idx % len(datagen.court_slot_labels())]
+    date_str = day.strftime('%Y-%m-%d')
+    _clear_slot(ctx['db'], date_str, court_id=court_id, court_time=court_time)
+    reqs = []
+    for i in range(contenders):
+        member = ctx['members'][i % len(ctx['members'])]
+        session_id = stubs.register_session({
+            'court_id': court_id, 'date': date_str, 'time_slot': court_time,
+            'user_id': member['id'], 'user_name': member['name'], 'user_email': member['email'],
+        })
+        reqs.append((None, 'GET', f'/court-booking-success?session_id={session_id}', None))
+
+    def check(db):
+        taken = db.court_bookings.count_documents({'date': date_str, 'court_id': court_id, 'time': court_time})
+        return taken, taken <= 1
+
+    return reqs, check
+
+
+def _lesson_check(date_str, lesson_time):
+    def check(db):
+        group = db.bookings.count_documents({'date': date_str, 'time': lesson_time, 'lesson_type': 'group'})
+        private = db.bookings.count_documents({'date': date_str, 'time': lesson_time, 'lesson_type': 'private'})
+        ok = group <= datagen.GROUP_CAPACITY and not (private and group) and private <= 1
+        return group + private, ok
+    return check
+
+
+def _lesson_success_requests(ctx, day, slot_idx, contenders):
+    date_str = day.strftime('%Y-%m-%d')
+    lesson_time = datagen.lesson_slot_labels()[slot_idx]
+    _clear_slot(ctx['db'], date_str, lesson_time=lesson_time)
+    reqs = []
+    for i in range(contenders):
+        member = ctx['members'][i % len(ctx['members'])]
+        session_id = stubs.register_session({
+            'user_id': member['id'], 'lesson_type': 'group', 'day_idx': str(day.day - 1),
+            'slot_idx': str(slot_idx), 'recurring_weeks': '1', 'date': date_str, 'time': lesson_time,
+        }, amount_total=2500)
+        reqs.append((None, 'GET', f'/lesson-booking-success?session_id={session_id}', None))
+    return reqs, _lesson_check(date_str, lesson_time)
+
+
+def _lessons_post_requests(ctx, day, slot_idx, contenders):
+    date_str = day.strftime('%Y-%m-%d')
+    lesson_time = datagen.lesson_slot_labels()[slot_idx]
+    _clear_slot(ctx['db'], date_str, lesson_time=lesson_time)
+    path = f'/lessons?year={day.year}&month={day.month}'
+    form = {'lesson_type': 'group', 'day_idx': str(day.day - 1), 'slot_idx': str(slot_idx), 'recurring_weeks': '1'}
+    reqs = [(ctx['members'][i % len(ctx['members'])], 'POST', path, form) for i in range(contenders)]
+    return reqs, _lesson_check(date_str, lesson_time)
+
+
+SCENARIOS = {
+    'court_booking_success': _court_requests,
+    'lesson_booking_success': _lesson_success_requests,
+    'lessons_post': _lessons_post_requests,
+}
+
+
+def _send(client, method, path, form, max_retries):
+    """Send with browser-refresh style retries; returns (ok, retries, latency of the last attempt)."""
+    retries = 0
+    while True:
+        start = time.perf_counter()
+        try:
+            status, _ = client.request(method, path, form)
+            ok = status < 500
+        except Exception:
+            ok = False
+        elapsed = time.perf_counter() - start
+        if ok or retries >= max_retries:
+            return ok, retries, elapsed
+        retries += 1
+        time.sleep(0.01 * retries)
+
+
+def run_round(ctx, host, port, build, day, slot_idx, contenders, max_retries):
+    reqs, check = build(ctx, day, slot_idx, contenders)
+    clients = []
+    for member, method, path, form in reqs:
+        client = Client(host, port)
+        if member is not None:
+            # Log each member in once; password hashing would otherwise dominate the set-up
+            cookies = ctx['cookies'].get(member['email'])
+            if cookies is None:
+                client.login(member['email'])
+                ctx['cookies'][member['email']] = dict(client.cookies)
+            else:
+                client.cookies = dict(cookies)
+        clients.append(client)
+
+    latencies, retries, failed = [], [0], [0]
+    lock = threading.Lock()
+    barrier = threading.Barrier(len(reqs) + 1)
+
+    def worker(client, method, path, form):
+        barrier.wait()
+        ok, n_retries, elapsed = _send(client, method, path, form, max_retries)
+        with lock:
+            latencies.append(elapsed)
+            retries[0] += n_retries
+            if not ok:
+                failed[0] += 1
+
+    threads = [threading.Thread(target=worker, args=(c, m, p, f), daemon=True)
+               for c, (_, m, p, f) in zip(clients, reqs)]
+    for t in threads:
+        t.start()
+    barrier.wait()
+    wall_start = time.perf_counter()
+    for t in threads:
+        t.join()
+    wall = time.perf_counter() - wall_start
+
+    booked, ok = check(ctx['db'])
+    return {'latencies': latencies, 'retries': retries[0], 'failed': failed[0], 'wall': wall,
+            'booked': booked, 'invariant_ok': ok}
+
+
+def summarize(rounds, contenders):
+    lat = sorted(l for r in rounds for l in r['latencies'])
+    wall = sum(r['wall'] for r in rounds)
+    attempts = len(lat) + sum(r['retries'] for r in rounds)
+    return {
+        'rounds': len(rounds),
+        'contenders': contenders,
+        'requests': len(lat),
+        'errors': sum(r['failed'] for r in rounds),
+        'retries': sum(r['retries'] for r in rounds),
+        'retry_rate': round(sum(r['retries'] for r in rounds) / attempts, 4) if attempts else 0.0,
+        'violations': sum(1 for r in rounds if not r['invariant_ok']),
+        'booked_per_round': [r['booked'] for r in rounds],
+        'throughput_rps': round(len(lat) / wall, 2) if wall else 0.0,
+        'p50_ms': round(1000 * percentile(lat, 50), 2),
+        'p95_ms': round(1000 * percentile(lat, 95), 2),
+        'p99_ms': round(1000 * percentile(lat, 99), 2),
+        'max_ms': round(1000 * lat[-1], 2) if lat else 0.0,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Race concurrent bookings for one slot and check invariants.')
+    datagen.add_arguments(parser)
+    parser.add_argument('--generate', action='store_true', help='(re)generate the dataset first')
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS), help='comma-separated subset to run')
+    parser.add_argument('--contenders', type=int, default=50, help='simultaneous requests per slot')
+    parser.add_argument('--rounds', type=int, default=5, help='slots raced per scenario')
+    parser.add_argument('--max-retries', type=int, default=3)
+    parser.add_argument('--days-ahead', type=int, default=365, help='how far out the raced slots are')
+    parser.add_argument('--server', choices=('werkzeug', 'waitress'), default='werkzeug')
+    parser.add_argument('--stripe-latency', type=float, default=0.0, help='simulated seconds per Stripe call')
+    parser.add_argument('--label', default=None, help='results file name (default: contention-<git revision>)')
+    parser.add_argument('--output', default=None, help='explicit results path')
+    args = parser.parse_args(argv)
+
+    db = datagen.default_database(args.mongo_uri)
+    datagen.check_bench_db(db, args.force)
+    params = dict(seed=args.seed, users=args.users, coaches=args.coaches,
+                  lessons=args.lessons, courts=args.courts, years=args.years, today=args.today)
+    if args.generate or db.users.count_documents({}) == 0:
+        print('Generating dataset...')
+        datagen.generate(db, **params)
+
+    os.environ['MONGO_URI'] = args.mongo_uri
+    os.environ['LESSON_SERIES_INTERVAL'] = '0'
+    os.environ['ROLLUPS_BACKFILL_ON_STARTUP'] = '0'
+    stubs.install(stripe_latency=args.stripe_latency)
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    # Build the daily_stats rollups for the generated bookings now, not while requests are measured
+    import rollups
+    rollups.backfill_once(db)
+    from app import app as flask_app
+    logging.getLogger('werkzeug').setLevel(logging.WARNING)
+
+    members = db.users.find({'role': 'member', 'is_active': True},
+                            {'_id': 1, 'name': 1, 'email': 1}).sort('_id', 1).limit(args.contenders)
+    ctx = {'db': db, 'cookies': {}, 'members': [{'id': str(m['_id']), 'name': m['name'], 'email': m['email']} for m in members]}
+    if not ctx['members']:
+        raise SystemExit('Dataset needs at least one active member.')
+    host, port = start_server(flask_app, args.server)
+
+    label = args.label or f"contention-{_git_revision() or 'unlabelled'}"
+    results = {
+        'meta': {
+            'label': label,
+            'git_revision': _git_revision(),
+            'started_at': datetime.now().isoformat(timespec='seconds'),
+            'concurrency': args.contenders,
+            'requests_per_scenario': args.contenders * args.rounds,
+            'server': args.server,
+            'stripe_latency': args.stripe_latency,
+            'today': args.today,
+            'dataset': params,
+        },
+        'scenarios': {},
+    }
+
+    print(f"{'scenario':<24}{'req/s':>9}{'p50 ms':>9}{'p95 ms':>9}{'retry %':>9}{'errors':>8}  booked per round")
+    any_violation = False
+    for offset, name in enumerate(s.strip() for s in args.scenarios.split(',') if s.strip()):
+        if name not in SCENARIOS:
+            raise SystemExit(f'Unknown scenario {name!r}; choose from {", ".join(SCENARIOS)}')
+        rounds = []
+        for i in range(args.rounds):
+            # Spread scenarios over different days so they never race each other
+            day, slot_idx = _target(offset * args.rounds + i, args.days_ahead)
+            rounds.append(run_round(ctx, host, port, SCENARIOS[name], day, slot_idx,
+                                    args.contenders, args.max_retries))
+        res = summarize(rounds, args.contenders)
+        results['scenarios'][name] = res
+        flag = '  INVARIANT VIOLATED' if res['violations'] else ''
+        any_violation = any_violation or bool(res['violations'])
+        print(f"{name:<24}{res['throughput_rps']:>9.1f}{res['p50_ms']:>9.1f}{res['p95_ms']:>9.1f}"
+              f"{100 * res['retry_rate']:>9.1f}{res['errors']:>8}  {res['booked_per_round']}{flag}")
+
+    path = args.output or os.path.join(RESULTS_DIR, f'{label}.json')
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, 'w') as fh:
+        json.dump(results, fh, indent=2, sort_keys=True)
+    print(f'Results written to {path}')
+    if any_violation:
+        print('Capacity invariants were violated (court: 1 booking per hour, group: at most '
+              f'{datagen.GROUP_CAPACITY} seats, never mixed with a private lesson).')
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,262 @@
+"""Seeded synthetic data generator for benchmarks.
+
+Fills a MongoDB database with users, coaches, an admin, weekly coach
+availability, lesson and court bookings spread over several years (with the
+mixed legacy `date` types found in production: plain strings, ISO strings with
+a time part and datetime objects) and `schedule_settings` overrides.
+
+The same seed, sizes and `--today` always produce the same documents, so
+results from different code versions are comparable. `--today` (the day the
+bookings are spread around) defaults to the fixed DEFAULT_TODAY rather than
+the current date; pass e.g. `--today $(date +%F)` for a dataset around now.
+
+    python -m bench.datagen --mongo-uri mongodb://localhost:27017/primecourt_bench \
+        --users 2000 --coaches 8 --lessons 50000 --courts 30000 --years 2
+"""
+import argparse
+import random
+import sys
+from datetime import datetime, timedelta
+
+from pymongo import MongoClient
+from werkzeug.security import generate_password_hash
+
+BENCH_PASSWORD = 'bench-password'
+ADMIN_EMAIL = 'admin@bench.local'
+COURT_IDS = ['court-1', 'court-2', 'court-3']
+COURT_HOURS = range(9, 21)
+GROUP_CAPACITY = 5
+DEFAULT_TODAY = '2025-06-02'
+
+COLLECTIONS = ('users', 'bookings', 'court_bookings', 'coach_weekly_availability',
+               'coach_availability', 'schedule_settings', 'settings')
+
+
+def lesson_slot_labels():
+    """Slot labels exactly as routes.generate_month_slots builds them."""
+    labels = []
+    for h in range(9, 22):
+        start_hour = h if h <= 12 else h - 12
+        end_hour = h + 1 if h + 1 <= 12 else (h + 1) - 12
+        start_ampm = 'AM' if h < 12 else 'PM'
+        end_ampm = 'AM' if h + 1 < 12 else 'PM'
+        labels.append(f'{start_hour}:00 {start_ampm} - {end_hour}:00 {end_ampm}')
+    return labels
+
+
+def court_slot_labels():
+    return [f"{h:02d}:00 - {h+1:02d}:00" for h in COURT_HOURS]
+
+
+def member_email(i):
+    return f'member{i}@bench.local'
+
+
+def coach_email(i):
+    return f'coach{i}@bench.local'
+
+
+def _legacy_date(rng, day):
+    """Mostly 'YYYY-MM-DD', with some datetime and ISO-with-time values."""
+    roll = rng.random()
+    if roll < 0.85:
+        return day.strftime('%Y-%m-%d')
+    if roll < 0.95:
+        return datetime(day.year, day.month, day.day)
+    return day.strftime('%Y-%m-%dT00:00:00')
+
+
+def _insert_batched(collection, docs, batch=5000):
+    for i in range(0, len(docs), batch):
+        collection.insert_many(docs[i:i + batch], ordered=False)
+
+
+def generate(db, seed=42, users=1000, coaches=6, lessons=20000, courts=10000, years=2,
+             future_days=60, today=DEFAULT_TODAY):
+    """Drop and regenerate the benchmark collections; returns a summary dict.
+
+    `today` ('YYYY-MM-DD' or a datetime) is the day the bookings are spread around.
+    """
+    rng = random.Random(seed)
+    if isinstance(today, str):
+        today = datetime.strptime(today, '%Y-%m-%d')
+    today = today.replace(hour=0, minute=0, second=0, microsecond=0)
+    start = today - timedelta(days=365 * years)
+    span_days = (today + timedelta(days=future_days) - start).days
+
+    for name in COLLECTIONS:
+        db.drop_collection(name)
+
+    # Hashing is deliberately slow; every generated account shares one hash
+    pw_hash = generate_password_hash(BENCH_PASSWORD, method='pbkdf2:sha256')
+    created = start - timedelta(days=30)
+
+    admin = {'name': 'Bench Admin', 'email': ADMIN_EMAIL, 'password': pw_hash, 'role': 'admin',
+             'is_admin': True, 'is_active': True, 'created_at': created, 'bio': '', 'specialties': []}
+    coach_docs = [{
+        'name': f'Coach {i}', 'email': coach_email(i), 'password': pw_hash, 'role': 'coach',
+        'is_admin': False, 'is_active': True, 'created_at': created + timedelta(days=i),
+        'bio': 'Professional tennis coach', 'specialties': ['Tennis', 'Coaching'],
+    } for i in range(coaches)]
+    member_docs = [{
+        'name': f'Member {i}', 'email': member_email(i), 'password': pw_hash, 'role': 'member',
+        'is_admin': False, 'is_active': rng.random() > 0.02,
+        'created_at': start + timedelta(seconds=rng.randrange(span_days * 86400)),
+        'bio': '', 'specialties': [],
+    } for i in range(users)]
+    db.users.insert_one(admin)
+    if coach_docs:
+        db.users.insert_many(coach_docs)
+    _insert_batched(db.users, member_docs)
+
+    # One coach per weekday, as enforced by /coach/availability
+    weekday_coach = {}
+    for wd in range(7):
+        if not coach_docs:
+            break
+        coach = coach_docs[wd % len(coach_docs)]
+        weekday_coach[wd] = coach
+    by_coach = {}
+    for wd, coach in weekday_coach.items():
+        by_coach.setdefault(coach['_id'], (coach, []))[1].append(wd)
+    for coach, wds in by_coach.values():
+        db.coach_weekly_availability.insert_one({
+            'coach_id': str(coach['_id']), 'coach_name': coach['name'], 'weekdays': sorted(wds),
+            'updated_at': created,
+        })
+
+    lesson_slots = lesson_slot_labels()
+    taken_private = set()
+    group_counts = {}
+    lesson_docs = []
+    attempts = 0
+    while len(lesson_docs) < lessons and attempts < lessons * 5:
+        attempts += 1
+        day = start + timedelta(days=rng.randrange(span_days))
+        ds = day.strftime('%Y-%m-%d')
+        slot = rng.choice(lesson_slots)
+        lesson_type = 'group' if rng.random() < 0.7 else 'private'
+        key = (ds, slot)
+        if lesson_type == 'private':
+            if key in taken_private:
+                continue
+            taken_private.add(key)
+        else:
+            if group_counts.get(key, 0) >= GROUP_CAPACITY:
+                continue
+            group_counts[key] = group_counts.get(key, 0) + 1
+        member = member_docs[rng.randrange(len(member_docs))] if member_docs else admin
+        coach = weekday_coach.get(day.weekday())
+        doc = {
+            'user_id': str(member['_id']), 'name': member['name'], 'email': member['email'],
+            'date': _legacy_date(rng, day), 'time': slot, 'lesson_type': lesson_type,
+            'created_at': day - timedelta(days=rng.randrange(1, 30)),
+            'payment_status': 'paid', 'stripe_session_id': f'cs_bench_{len(lesson_docs)}',
+            'recurring_week': None,
+        }
+        if lesson_type == 'group':
+            doc['group_size'] = group_counts[key]
+        if coach:
+            doc['coach_id'] = str(coach['_id'])
+            doc['coach_name'] = coach['name']
+        if day < today and rng.random() < 0.5:
+            doc['status'] = 'done'
+        elif rng.random() < 0.03:
+            doc['status'] = 'cancelled'
+        lesson_docs.append(doc)
+    _insert_batched(db.bookings, lesson_docs)
+
+    court_slots = court_slot_labels()
+    taken_courts = set()
+    court_docs = []
+    attempts = 0
+    while len(court_docs) < courts and attempts < courts * 5:
+        attempts += 1
+        day = start + timedelta(days=rng.randrange(span_days))
+        ds = day.strftime('%Y-%m-%d')
+        key = (ds, rng.choice(COURT_IDS), rng.choice(court_slots))
+        if key in taken_courts:
+            continue
+        taken_courts.add(key)
+        member = member_docs[rng.randrange(len(member_docs))] if member_docs else admin
+        court_docs.append({
+            'date': _legacy_date(rng, day) if rng.random() < 0.2 else ds,
+            'court_id': key[1], 'time': key[2],
+            'user_id': str(member['_id']), 'user_name': member['name'], 'user_email': member['email'],
+            'payment_intent': f'pi_bench_{len(court_docs)}', 'amount_paid': 15.0,
+            'created_at': day - timedelta(days=rng.randrange(1, 14)), 'status': 'confirmed',
+        })
+    _insert_batched(db.court_bookings, court_docs)
+
+    settings = []
+    for offset in range(span_days):
+        if rng.random() >= 0.05:
+            continue
+        day = start + timedelta(days=offset)
+        doc = {'date': day.strftime('%Y-%m-%d'), 'updated_at': created}
+        if rng.random() < 0.4:
+            doc.update({'no_classes': True, 'reason': rng.choice(['Holiday', 'Tournament', 'Maintenance'])})
+        else:
+            doc.update({'no_classes': False, 'custom_time_slots': sorted(rng.sample(lesson_slots, 6))})
+        settings.append(doc)
+    if settings:
+        db.schedule_settings.insert_many(settings)
+
+    return {
+        'seed': seed, 'users': len(member_docs), 'coaches': len(coach_docs),
+        'lesson_bookings': len(lesson_docs), 'court_bookings': len(court_docs),
+        'schedule_settings': len(settings), 'years': years, 'today': today.strftime('%Y-%m-%d'),
+        'coach_ids': [str(c['_id']) for c in coach_docs],
+    }
+
+
+def default_database(uri):
+    client = MongoClient(uri)
+    db = client.get_default_database()
+    if db is None:
+        raise SystemExit('The Mongo URI must name a database, e.g. mongodb://localhost:27017/primecourt_bench')
+    return db
+
+
+def check_bench_db(db, force=False):
+    # generate() drops collections; refuse to touch anything that is not obviously a bench DB
+    if not force and not db.name.endswith('_bench'):
+        raise SystemExit(f"Refusing to overwrite database '{db.name}': name must end with '_bench' (or pass --force)")
+
+
+def _day_arg(text):
+    try:
+        datetime.strptime(text, '%Y-%m-%d')
+    except ValueError:
+        raise argparse.ArgumentTypeError(f'{text!r} is not a YYYY-MM-DD date')
+    return text
+
+
+def add_arguments(parser):
+    parser.add_argument('--mongo-uri', default='mongodb://localhost:27017/primecourt_bench')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--coaches', type=int, default=6)
+    parser.add_argument('--lessons', type=int, default=20000)
+    parser.add_argument('--courts', type=int, default=10000)
+    parser.add_argument('--years', type=int, default=2)
+    parser.add_argument('--today', type=_day_arg, default=DEFAULT_TODAY,
+                        help=f'day the bookings are spread around, YYYY-MM-DD (default {DEFAULT_TODAY})')
+    parser.add_argument('--force', action='store_true', help="allow a database whose name does not end in '_bench'")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Generate a seeded benchmark dataset.')
+    add_arguments(parser)
+    args = parser.parse_args(argv)
+    db = default_database(args.mongo_uri)
+    check_bench_db(db, args.force)
+    summary = generate(db, seed=args.seed, users=args.users, coaches=args.coaches,
+                       lessons=args.lessons, courts=args.courts, years=args.years, today=args.today)
+    summary.pop('coach_ids')
+    print(' '.join(f'{k}={v}' for k, v in summary.items()))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
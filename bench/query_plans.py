@@ -0,0 +1,477 @@
+"""Query-plan regression guard.
+
+Seeds the benchmark dataset (bench.datagen), builds the indexes from
+db_indexes.py and requests every route in app.py/routes.py once through the
+Flask test client. Every Mongo command a request issues is captured with a
+pymongo CommandListener and re-run through `explain` (executionStats). The run
+fails when
+
+- a query does a COLLSCAN on a collection holding more than
+  `--collscan-threshold` documents (unless the case lists that collection in
+  `allow_collscan`), or
+- a route issues more commands than its declared budget, or
+- a route answers with a 5xx.
+
+The cases in CASES double as the list of known debt: a `budget` of None or an
+`allow_collscan` entry marks a route that is known to scan or to issue a query
+per row, with a note saying why. Tighten them as those routes get fixed. Routes
+that are not covered by a case also fail the run, so new routes have to declare
+a budget.
+
+    python -m bench.query_plans --mongo-uri mongodb://localhost:27017/primecourt_bench --generate
+
+Needs a real mongod (explain is not emulated by test doubles).
+"""
+import argparse
+import copy
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+from bson import ObjectId
+from pymongo import monitoring
+from werkzeug.security import generate_password_hash
+
+from bench import datagen, stubs
+
+# Commands that hit the data; getMore/killCursors are cursor continuations of a
+# counted find/aggregate and handshakes/session bookkeeping are not queries.
+COUNTED_COMMANDS = {'find', 'aggregate', 'count', 'distinct', 'insert', 'update', 'delete', 'findAndModify'}
+EXPLAINABLE_COMMANDS = COUNTED_COMMANDS - {'insert'}
+
+# Driver-added fields explain does not accept
+_DRIVER_FIELDS = ('lsid', '$db', '$clusterTime', 'txnNumber', '$readPreference', 'readConcern',
+                  'writeConcern', 'autocommit', 'startTransaction', 'apiVersion', 'apiStrict',
+                  'apiDeprecationErrors', 'ordered', 'bypassDocumentValidation')
+
+
+# --- Command capture --------------------------------------------------------
+
+class CommandRecorder(monitoring.CommandListener):
+    """Collects the commands issued by the current thread while recording() is active."""
+
+    def __init__(self):
+        self._local = threading.local()
+
+    @contextmanager
+    def recording(self):
+        self._local.commands = []
+        try:
+            yield self._local.commands
+        finally:
+            self._local.commands = None
+
+    def started(self, event):
+        commands = getattr(self._local, 'commands', None)
+        if commands is not None and event.command_name in COUNTED_COMMANDS:
+            commands.append((event.command_name, copy.deepcopy(dict(event.command))))
+
+    def succeeded(self, event):
+        pass
+
+    def failed(self, event):
+        pass
+
+
+def _explain_targets(command_name, command):
+    """Split a (possibly batched) command into explainable single-statement commands."""
+    base = {k: v for k, v in command.items() if k not in _DRIVER_FIELDS}
+    if command_name == 'update':
+        return [dict(base, updates=[u]) for u in base.get('updates', [])]
+    if command_name == 'delete':
+        return [dict(base, deletes=[d]) for d in base.get('deletes', [])]
+    return [base]
+
+
+def _walk(node, found):
+    if isinstance(node, dict):
+        stage = node.get('stage')
+        if isinstance(stage, str):
+            found['stages'].add(stage)
+        for key, value in node.items():
+            if key == 'totalDocsExamined' and isinstance(value, int):
+                found['docs_examined'] += value
+            elif key == 'executionTimeMillis' and isinstance(value, (int, float)):
+                found['millis'] += value
+            else:
+                _walk(value, found)
+    elif isinstance(node, list):
+        for item in node:
+            _walk(item, found)
+
+
+def summarize_explain(explain_doc):
+    """Stages used, total documents examined and execution time from an explain document.
+
+    Walks the whole document so find, aggregate ($cursor stages) and write
+    explains, in either the classic or the SBE layout, are handled alike.
+    """
+    found = {'stages': set(), 'docs_examined': 0, 'millis': 0}
+    _walk(explain_doc, found)
+    return found
+
+
+def explain_command(db, command_name, command):
+    """Explain a captured command; returns a list of summaries (one per statement)."""
+    results = []
+    for target in _explain_targets(command_name, command):
+        doc = db.command({'explain': target, 'verbosity': 'executionStats'})
+        results.append(summarize_explain(doc))
+    return results
+
+
+# --- Cases ------------------------------------------------------------------
+
+class Case:
+    """One request against one endpoint.
+
+    `path` and `data` may be callables taking the context dict (for ids and
+    freshly registered Checkout Sessions). `budget` is the maximum number of
+    counted Mongo commands; None means unbounded (known debt, see `note`).
+    """
+
+    def __init__(self, endpoint, path, role='anon', method='GET', data=None, budget=5,
+                 allow_collscan=(), note=''):
+        self.endpoint = endpoint
+        self.path = path
+        self.role = role
+        self.method = method
+        self.data = data
+        self.budget = budget
+        self.allow_collscan = set(allow_collscan)
+        self.note = note
+
+
+def _future(days=14):
+    return (datetime.now() + timedelta(days=days)).strftime('%Y-%m-%d')
+
+
+def _lesson_session(ctx):
+    day = datetime.now() + timedelta(days=21)
+    session_id = stubs.register_session({
+        'user_id': ctx['member_id'], 'lesson_type': 'group', 'day_idx': str(day.day - 1),
+        'slot_idx': '0', 'recurring_weeks': '1', 'date': day.strftime('%Y-%m-%d'),
+        'time': datagen.lesson_slot_labels()[0],
+    }, amount_total=2500)
+    return f'/lesson-booking-success?session_id={session_id}'
+
+
+def _court_session(ctx):
+    session_id = stubs.register_session({
+        'court_id': datagen.COURT_IDS[0], 'date': _future(400), 'time_slot': datagen.court_slot_labels()[0],
+        'user_id': ctx['member_id'], 'user_name': 'Plan Member', 'user_email': ctx['member_email'],
+    })
+    return f'/court-booking-success?session_id={session_id}'
+
+
+def _membership_session(ctx):
+    session_id = stubs.register_session({'user_id': ctx['member_id'], 'plan_id': 'basic'},
+                                        subscription='sub_bench_plans')
+    return f'/membership-success?session_id={session_id}'
+
+
+CASES = [
+    # app.py
+    Case('index', '/', budget=2),
+    Case('contact', '/contact', budget=0),
+    Case('court_booking_success', _court_session, budget=3),
+    Case('test_email', '/test-email', budget=0),
+    Case('_test_smtp', '/_test_smtp', budget=0),
+    # auth
+    Case('signup', '/signup', method='POST', budget=3,
+         data=lambda ctx: {'name': 'Plan Signup', 'email': f"plans-signup-{ObjectId()}@bench.local",
+                           'password': 'x', 'confirm_password': 'x'}),
+    Case('login', '/login', method='POST', budget=1,
+         data=lambda ctx: {'email': ctx['member_email'], 'password': datagen.BENCH_PASSWORD}),
+    Case('logout', '/logout', role='member', budget=0),
+    Case('make_me_admin', '/make-me-admin', role='member', budget=0),
+    Case('_debug_db', '/_debug_db', budget=3),
+    # member
+    Case('lessons', '/lessons', role='member', budget=4),
+    Case('lessons', '/lessons?day=3', role='member', budget=7,
+         note='day fragment: one availability version lookup, then bookings + series on a cache miss'),
+    Case('lessons_day', lambda ctx: f'/lessons/day/{_future(3)}', role='member', budget=5),
+    Case('next_available', '/next-available?kind=lesson&lesson_type=private&hour_from=18', budget=21),
+    Case('next_available', '/next-available?kind=court&court_id=court-1&weekday=5', budget=7),
+    Case('api_courts_availability', '/api/courts/availability', budget=2),
+    Case('api_lessons_availability', '/api/lessons/availability?day=15', role='member', budget=4),
+    Case('create_lesson_booking', '/create-lesson-booking', role='member', method='POST', budget=2,
+         data=lambda ctx: {'lesson_type': 'group', 'day_idx': '20', 'slot_idx': '0', 'recurring_weeks': '1',
+                           'date': _future(20), 'time': datagen.lesson_slot_labels()[0]}),
+    Case('lesson_booking_success', _lesson_session, budget=9),
+    Case('courts', lambda ctx: '/courts?date=' + _future(), role='member', budget=2),
+    Case('create_court_booking_session', '/create-court-booking-session', role='member', method='POST', budget=1,
+         data=lambda ctx: {'court_id': datagen.COURT_IDS[1], 'date': _future(401),
+                           'time_slot': datagen.court_slot_labels()[0]}),
+    Case('membership', '/membership', role='member', budget=0),
+    Case('create_checkout_session', '/create-checkout-session', role='member', method='POST', budget=1,
+         data={'plan_id': 'basic'}),
+    Case('membership_success', _membership_session, role='member', budget=1),
+    Case('membership_cancel', '/membership-cancel', role='member', budget=0),
+    Case('profile', '/profile', role='member', budget=2),
+    Case('cancel_lesson_series', lambda ctx: f"/lesson-series/{ctx['series_id']}/cancel", role='member',
+         method='POST', budget=3),
+    Case('coaches', '/coaches', budget=1),
+    Case('coach_profile', lambda ctx: f"/coaches/{ctx['coach_id']}", budget=4),
+    Case('send_reminders', '/send-reminders?secret=plans', budget=None,
+         note='one user lookup per booking tomorrow'),
+    Case('promote_me', '/admin/promote-me', role='member', budget=2),
+    # coach
+    Case('coach_dashboard', '/coach/dashboard', role='coach', budget=None,
+         note='marks each finished lesson done with its own update'),
+    Case('coach_profile_edit', '/coach/profile', role='coach', budget=2),
+    Case('coach_lessons', '/coach/lessons', role='coach', budget=None,
+         note='marks each finished lesson done with its own update'),
+    Case('coach_mark_booking_done', lambda ctx: f"/coach/booking/{ctx['coach_booking_id']}/mark_done",
+         role='coach', method='POST', budget=2),
+    Case('coach_message_student', lambda ctx: f"/coach/booking/{ctx['coach_booking_id']}/message",
+         role='coach', method='POST', data={'message': 'See you on court'}, budget=1),
+    Case('coach_availability', '/coach/availability', role='coach', budget=2),
+    Case('coach_cancel_days', '/coach/cancel-days', role='coach', method='POST',
+         data={'dates': '2099-01-01'}, budget=2),
+    # admin
+    Case('admin_dashboard', '/admin', role='admin', budget=None, allow_collscan={'bookings', 'court_bookings', 'users'},
+         note='loads every lesson and court booking with a user lookup per booking'),
+    Case('admin_courts', '/admin/courts', role='admin', budget=2),
+    Case('admin_courts', lambda ctx: '/admin/courts?court_id=court-2&date_from=' + _future(-90), role='admin',
+         budget=2),
+    Case('admin_lessons_today', '/admin/lessons-today', role='admin', budget=None, allow_collscan={'bookings'},
+         note='scans all bookings and filters to today in Python'),
+    Case('admin_users', '/admin/users', role='admin', budget=1),
+    Case('admin_users', '/admin/users?role=user', role='admin', budget=1),
+    Case('admin_users', '/admin/users?q=member1', role='admin', budget=1),
+    Case('admin_user_search', '/admin/users/search?q=member1', role='admin', budget=2),
+    Case('admin_user_search', '/admin/users/search?q=m', role='admin', budget=2,
+         note='one-letter prefix: each field query must stop after the limit, not sort every match'),
+    Case('admin_user_search', '/admin/users/search?q=m&role=user', role='admin', budget=2),
+    Case('admin_export', lambda ctx: f"/admin/export/bookings.csv?date_from={_future(-30)}&date_to={_future(0)}",
+         role='admin', budget=1),
+    Case('admin_export', '/admin/export/users.csv?type=coach', role='admin', budget=1),
+    Case('admin_analytics', lambda ctx: f"/admin/analytics?date_from={_future(-30)}&date_to={_future(0)}",
+         role='admin', budget=2),
+    Case('admin_pricing', '/admin/pricing', role='admin', budget=1),
+    Case('admin_court_catalog', '/admin/court-catalog', role='admin', budget=1),
+    Case('admin_court_catalog', '/admin/court-catalog', role='admin', method='POST', budget=5,
+         data=dict({'id': 'court-3', 'name': 'Court 3', 'surface': 'Grass', 'price': '15', 'position': '3',
+                    'active': '1'}, **{f'{edge}_{wd}': h for wd in range(7) for edge, h in (('open', 9), ('close', 21))}),
+         note='first save also seeds the default courts'),
+    Case('admin_schedule', '/admin/schedule', role='admin', budget=3),
+    Case('admin_schedule', '/admin/schedule', role='admin', method='POST', budget=1,
+         data=lambda ctx: {'action': 'set_time_slots', 'date_from': _future(300), 'date_to': _future(330),
+                           'weekdays': '0', 'available_slots': '6:00 PM - 7:00 PM'}),
+    Case('admin_profiles', '/admin/profiles', role='admin', budget=0),
+    Case('admin_profile_folded', '/admin/profiles/missing.folded', role='admin', budget=0),
+    Case('admin_profiles_clear', '/admin/profiles/clear', role='admin', method='POST', budget=0),
+    Case('promote_to_admin', lambda ctx: f"/admin/promote-to-admin/{ctx['throwaway'][0]}", role='admin', budget=2),
+    Case('promote_to_coach', lambda ctx: f"/admin/promote-to-coach/{ctx['throwaway'][1]}", role='admin', budget=2),
+    Case('demote_user', lambda ctx: f"/admin/demote/{ctx['throwaway'][1]}", role='admin', budget=2),
+    Case('admin_disable_user', lambda ctx: f"/admin/disable-user/{ctx['throwaway'][2]}", role='admin', budget=3),
+    Case('admin_enable_user', lambda ctx: f"/admin/enable-user/{ctx['throwaway'][2]}", role='admin', budget=3),
+    # infrastructure
+    Case('metrics', '/metrics', budget=0),
+    Case('uploaded_file', '/uploads/coach_photos/missing.jpg', budget=0),
+    # the stream itself never ends; the bench only checks the validation path
+    Case('live_availability', '/live/availability?kind=unknown', budget=0),
+]
+
+IGNORED_ENDPOINTS = {'static'}
+
+
+# --- Runner -----------------------------------------------------------------
+
+def _login(client, role, ctx):
+    if role == 'anon':
+        return
+    user = ctx['users'][role]
+    with client.session_transaction() as sess:
+        sess['user_id'] = user['id']
+        sess['user_name'] = user['name']
+        sess['user_email'] = user['email']
+        sess['is_admin'] = role == 'admin'
+        sess['is_coach'] = role == 'coach'
+
+
+def _resolve(value, ctx):
+    return value(ctx) if callable(value) else value
+
+
+def _collection_of(command_name, command):
+    return command.get(command_name) if isinstance(command.get(command_name), str) else None
+
+
+def run_case(flask_app, db, recorder, case, ctx, sizes, threshold):
+    client = flask_app.test_client()
+    _login(client, case.role, ctx)
+    path = _resolve(case.path, ctx)
+    data = _resolve(case.data, ctx)
+    start = time.perf_counter()
+    with recorder.recording() as commands:
+        resp = client.open(path, method=case.method, data=data)
+        resp.get_data()  # streamed responses query while the body is consumed
+    elapsed_ms = 1000 * (time.perf_counter() - start)
+
+    row = {'endpoint': case.endpoint, 'path': path, 'status': resp.status_code, 'queries': len(commands),
+           'budget': case.budget, 'docs_examined': 0, 'db_ms': 0, 'request_ms': round(elapsed_ms, 1),
+           'collscans': [], 'failures': [], 'note': case.note}
+    for command_name, command in commands:
+        if command_name not in EXPLAINABLE_COMMANDS:
+            continue
+        collection = _collection_of(command_name, command)
+        try:
+            summaries = explain_command(db, command_name, command)
+        except Exception as e:
+            row['failures'].append(f'explain failed for {command_name} on {collection}: {e}')
+            continue
+        for summary in summaries:
+            row['docs_examined'] += summary['docs_examined']
+            row['db_ms'] += summary['millis']
+            if 'COLLSCAN' in summary['stages']:
+                row['collscans'].append(collection)
+                size = sizes.get(collection, 0)
+                if size > threshold and collection not in case.allow_collscan:
+                    row['failures'].append(f'COLLSCAN on {collection} ({size} docs) for {command_name}')
+
+    if resp.status_code >= 500:
+        row['failures'].append(f'HTTP {resp.status_code}')
+    if case.budget is not None and len(commands) > case.budget:
+        row['failures'].append(f'{len(commands)} queries, budget {case.budget}')
+    return row
+
+
+def _prepare_context(db):
+    """Pick representative users and create throwaway ones for the destructive admin routes."""
+    def pick(query):
+        user = db.users.find_one(query, sort=[('_id', 1)])
+        if not user:
+            raise SystemExit(f'Dataset has no user matching {query}')
+        return {'id': str(user['_id']), 'name': user.get('name', ''), 'email': user['email']}
+
+    member = pick({'role': 'member', 'is_active': True})
+    coach = pick({'email': datagen.coach_email(0)})
+    admin = pick({'email': datagen.ADMIN_EMAIL})
+    booking = db.bookings.find_one({'coach_id': coach['id']}, sort=[('_id', 1)])
+    if not booking:
+        raise SystemExit('Dataset has no lesson booking for the first coach')
+
+    db.users.delete_many({'email': {'$regex': r'^plans-'}})
+    throwaway = []
+    for i in range(3):
+        res = db.users.insert_one({
+            'name': f'Plan Throwaway {i}', 'email': f'plans-throwaway{i}@bench.local',
+            'password': generate_password_hash(datagen.BENCH_PASSWORD, method='pbkdf2:sha256'),
+            'role': 'member', 'is_active': True, 'created_at': datetime.now(),
+        })
+        throwaway.append(str(res.inserted_id))
+
+    # A throwaway recurring series for the member to cancel (nothing materialized)
+    db.lesson_series.delete_many({'email': 'plans-series@bench.local'})
+    start = (datetime.now() + timedelta(days=200)).strftime('%Y-%m-%d')
+    series = db.lesson_series.insert_one({
+        'user_id': member['id'], 'name': member['name'], 'email': 'plans-series@bench.local',
+        'lesson_type': 'group', 'time': datagen.lesson_slot_labels()[0], 'start_date': start, 'weeks': 4,
+        'end_date': (datetime.now() + timedelta(days=221)).strftime('%Y-%m-%d'), 'exceptions': {},
+        'materialized_through': start, 'status': 'active', 'booking_fields': {},
+    })
+
+    return {
+        'users': {'member': member, 'coach': coach, 'admin': admin},
+        'member_id': member['id'], 'member_email': member['email'],
+        'coach_id': coach['id'], 'coach_booking_id': str(booking['_id']),
+        'throwaway': throwaway, 'series_id': str(series.inserted_id),
+    }
+
+
+def _print_table(rows):
+    print(f"{'endpoint':<30}{'status':>7}{'queries':>9}{'budget':>8}{'docs exam.':>12}{'db ms':>8}"
+          f"{'req ms':>9}  collscans")
+    for row in rows:
+        budget = '-' if row['budget'] is None else row['budget']
+        scans = ','.join(sorted(set(row['collscans']))) or '-'
+        flag = '  FAIL' if row['failures'] else ''
+        print(f"{row['endpoint']:<30}{row['status']:>7}{row['queries']:>9}{budget:>8}{row['docs_examined']:>12}"
+              f"{row['db_ms']:>8}{row['request_ms']:>9.1f}  {scans}{flag}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Check per-route Mongo query budgets and index usage.')
+    datagen.add_arguments(parser)
+    parser.add_argument('--generate', action='store_true', help='(re)generate the dataset first')
+    parser.add_argument('--collscan-threshold', type=int, default=1000,
+                        help='collections with more documents than this must not be collection-scanned')
+    parser.add_argument('--endpoints', default='', help='comma-separated subset of endpoints to check')
+    parser.add_argument('--json', dest='json_path', default=None, help='also write the rows to this file')
+    args = parser.parse_args(argv)
+
+    import rollups
+    import user_search
+    from db_indexes import ensure_indexes
+
+    db = datagen.default_database(args.mongo_uri)
+    datagen.check_bench_db(db, args.force)
+    if args.generate or db.users.count_documents({}) == 0:
+        print('Generating dataset...')
+        datagen.generate(db, seed=args.seed, users=args.users, coaches=args.coaches,
+                         lessons=args.lessons, courts=args.courts, years=args.years, today=args.today)
+    if ensure_indexes(db):
+        raise SystemExit('Some indexes could not be created; see the log.')
+    user_search.backfill(db)
+    rollups.backfill_once(db)
+
+    # The listener has to exist before the app's client is created
+    recorder = CommandRecorder()
+    monitoring.register(recorder)
+    os.environ['MONGO_URI'] = args.mongo_uri
+    os.environ['LESSON_SERIES_INTERVAL'] = '0'
+    os.environ['ENSURE_INDEXES_ON_STARTUP'] = '0'
+    os.environ['ROLLUPS_BACKFILL_ON_STARTUP'] = '0'
+    os.environ['REMINDER_SECRET'] = 'plans'
+    stubs.install()
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    from app import app as flask_app
+    logging.getLogger('werkzeug').setLevel(logging.WARNING)
+
+    ctx = _prepare_context(db)
+    sizes = {name: db[name].estimated_document_count() for name in db.list_collection_names()}
+
+    failures = []
+    covered = {case.endpoint for case in CASES}
+    missing = sorted(rule.endpoint for rule in flask_app.url_map.iter_rules()
+                     if rule.endpoint not in covered and rule.endpoint not in IGNORED_ENDPOINTS)
+    for endpoint in missing:
+        failures.append(f'{endpoint}: no query-plan case (add one to CASES in bench/query_plans.py)')
+
+    selected = {e.strip() for e in args.endpoints.split(',') if e.strip()}
+    rows = []
+    for case in CASES:
+        if selected and case.endpoint not in selected:
+            continue
+        row = run_case(flask_app, db, recorder, case, ctx, sizes, args.collscan_threshold)
+        rows.append(row)
+        failures.extend(f"{row['endpoint']}: {f}" for f in row['failures'])
+
+    _print_table(rows)
+    if args.json_path:
+        with open(args.json_path, 'w') as fh:
+            json.dump(rows, fh, indent=2, default=str)
+
+    debt = [row for row in rows if row['note']]
+    if debt:
+        print('\nKnown debt:')
+        for row in debt:
+            print(f"  {row['endpoint']}: {row['note']}")
+    if failures:
+        print(f'\n{len(failures)} failure(s):')
+        for f in failures:
+            print(f'  {f}')
+        return 1
+    print('\nAll routes within budget.')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,297 @@
+"""Drive the main pages and booking flows at a fixed concurrency and record latencies.
+
+The app runs in-process against the benchmark database (see bench.datagen)
+with Stripe and SMTP replaced by bench.stubs, behind a threaded HTTP server on
+a free local port. Each scenario is hammered by `--concurrency` client threads
+(each logged in as the right kind of user) for `--requests` requests, and the
+throughput and p50/p95/p99 latencies are written to a JSON results file that
+bench/compare.py can diff between versions.
+
+    python -m bench.run --mongo-uri mongodb://localhost:27017/primecourt_bench \
+        --generate --concurrency 8 --requests 400 --label v1.4
+"""
+import argparse
+import http.client
+import json
+import logging
+import math
+import os
+import random
+import subprocess
+import sys
+import threading
+import time
+from datetime import datetime, timedelta
+from urllib.parse import urlencode
+
+from bench import datagen, stubs
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results')
+
+
+# --- HTTP client ------------------------------------------------------------
+
+class Client:
+    """Minimal cookie-keeping HTTP client (no redirects followed)."""
+
+    def __init__(self, host, port):
+        self.host = host
+        self.port = port
+        self.cookies = {}
+
+    def request(self, method, path, form=None):
+        conn = http.client.HTTPConnection(self.host, self.port, timeout=60)
+        headers = {}
+        body = None
+        if form is not None:
+            body = urlencode(form)
+            headers['Content-Type'] = 'application/x-www-form-urlencoded'
+        if self.cookies:
+            headers['Cookie'] = '; '.join(f'{k}={v}' for k, v in self.cookies.items())
+        try:
+            conn.request(method, path, body=body, headers=headers)
+            resp = conn.getresponse()
+            data = resp.read()
+            for header in resp.headers.get_all('Set-Cookie') or []:
+                name, _, rest = header.partition('=')
+                self.cookies[name.strip()] = rest.split(';', 1)[0]
+            return resp.status, data
+        finally:
+            conn.close()
+
+    def login(self, email):
+        status, _ = self.request('POST', '/login', {'email': email, 'password': datagen.BENCH_PASSWORD})
+        if status >= 400 or 'session' not in self.cookies:
+            raise RuntimeError(f'login failed for {email} (HTTP {status})')
+
+
+# --- Scenarios --------------------------------------------------------------
+
+def _future_day(rng, days=60):
+    return datetime.now() + timedelta(days=rng.randrange(1, days))
+
+
+def _lesson_success(ctx, rng):
+    day = _future_day(rng)
+    member = rng.choice(ctx['members'])
+    session_id = stubs.register_session({
+        'user_id': member['id'],
+        'lesson_type': 'group' if rng.random() < 0.7 else 'private',
+        'day_idx': str(day.day - 1),
+        'slot_idx': '0',
+        'recurring_weeks': '1',
+        'date': day.strftime('%Y-%m-%d'),
+        'time': rng.choice(datagen.lesson_slot_labels()),
+    }, amount_total=2500)
+    return 'GET', f'/lesson-booking-success?session_id={session_id}'
+
+
+def _court_success(ctx, rng):
+    day = _future_day(rng)
+    member = rng.choice(ctx['members'])
+    session_id = stubs.register_session({
+        'court_id': rng.choice(datagen.COURT_IDS),
+        'date': day.strftime('%Y-%m-%d'),
+        'time_slot': rng.choice(datagen.court_slot_labels()),
+        'user_id': member['id'],
+        'user_name': member['name'],
+        'user_email': member['email'],
+    })
+    return 'GET', f'/court-booking-success?session_id={session_id}'
+
+
+SCENARIOS = {
+    'lessons': ('member', lambda ctx, rng: ('GET', '/lessons?day=%d' % rng.randrange(28))),
+    'courts': ('member', lambda ctx, rng: ('GET', '/courts?date=' + _future_day(rng).strftime('%Y-%m-%d'))),
+    'admin': ('admin', lambda ctx, rng: ('GET', '/admin')),
+    'admin_courts': ('admin', lambda ctx, rng: ('GET', '/admin/courts')),
+    'coach_profile': ('anon', lambda ctx, rng: ('GET', '/coaches/' + rng.choice(ctx['summary']['coach_ids']))),
+    'coach_dashboard': ('coach', lambda ctx, rng: ('GET', '/coach/dashboard')),
+    'lesson_booking_success': ('anon', _lesson_success),
+    'court_booking_success': ('anon', _court_success),
+}
+
+
+def _login_for(client, role, worker, ctx):
+    if role == 'admin':
+        client.login(datagen.ADMIN_EMAIL)
+    elif role == 'coach':
+        client.login(datagen.coach_email(0))
+    elif role == 'member':
+        client.login(ctx['members'][worker % len(ctx['members'])]['email'])
+
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return 0.0
+    k = max(0, min(len(sorted_values) - 1, math.ceil(pct / 100.0 * len(sorted_values)) - 1))
+    return sorted_values[k]
+
+
+def run_scenario(name, ctx, host, port, concurrency, requests_total, seed):
+    role, make_request = SCENARIOS[name]
+    latencies = []
+    errors = []
+    lock = threading.Lock()
+    counter = iter(range(requests_total))
+    barrier = threading.Barrier(concurrency + 1)
+
+    def worker(idx):
+        rng = random.Random(seed * 1000 + idx)
+        client = Client(host, port)
+        try:
+            _login_for(client, role, idx, ctx)
+        except Exception as e:
+            with lock:
+                errors.append(str(e))
+        barrier.wait()
+        while True:
+            with lock:
+                if next(counter, None) is None:
+                    return
+            method, path = make_request(ctx, rng)
+            start = time.perf_counter()
+            try:
+                status, _ = client.request(method, path)
+                ok = status < 400
+            except Exception as e:
+                status, ok = str(e), False
+            elapsed = time.perf_counter() - start
+            with lock:
+                latencies.append(elapsed)
+                if not ok:
+                    errors.append(f'{path}: {status}')
+
+    threads = [threading.Thread(target=worker, args=(i,), daemon=True) for i in range(concurrency)]
+    for t in threads:
+        t.start()
+    barrier.wait()
+    wall_start = time.perf_counter()
+    for t in threads:
+        t.join()
+    wall = time.perf_counter() - wall_start
+
+    lat = sorted(latencies)
+    return {
+        'role': role,
+        'requests': len(lat),
+        'errors': len(errors),
+        'error_samples': errors[:5],
+        'duration_s': round(wall, 3),
+        'throughput_rps': round(len(lat) / wall, 2) if wall else 0.0,
+        'mean_ms': round(1000 * sum(lat) / len(lat), 2) if lat else 0.0,
+        'p50_ms': round(1000 * percentile(lat, 50), 2),
+        'p95_ms': round(1000 * percentile(lat, 95), 2),
+        'p99_ms': round(1000 * percentile(lat, 99), 2),
+        'max_ms': round(1000 * lat[-1], 2) if lat else 0.0,
+    }
+
+
+# --- Server -----------------------------------------------------------------
+
+def start_server(flask_app, server='werkzeug'):
+    """Serve the app on a free local port in a background thread; returns (host, port)."""
+    host = '127.0.0.1'
+    if server == 'waitress':
+        from waitress.server import create_server
+        srv = create_server(flask_app, host=host, port=0, threads=32)
+        port = srv.effective_port
+        threading.Thread(target=srv.run, daemon=True).start()
+    else:
+        from werkzeug.serving import make_server
+        srv = make_server(host, 0, flask_app, threaded=True)
+        port = srv.server_port
+        threading.Thread(target=srv.serve_forever, daemon=True).start()
+    return host, port
+
+
+def _git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], text=True,
+                                       stderr=subprocess.DEVNULL).strip()
+    except Exception:
+        return None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Run the PrimeCourt benchmark suite.')
+    datagen.add_arguments(parser)
+    parser.add_argument('--generate', action='store_true', help='(re)generate the dataset before running')
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS), help='comma-separated subset to run')
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--requests', type=int, default=200, help='requests per scenario')
+    parser.add_argument('--warmup', type=int, default=20, help='unrecorded requests per scenario')
+    parser.add_argument('--server', choices=('werkzeug', 'waitress'), default='werkzeug')
+    parser.add_argument('--stripe-latency', type=float, default=0.0, help='simulated seconds per Stripe call')
+    parser.add_argument('--label', default=None, help='results file name (default: git revision)')
+    parser.add_argument('--output', default=None, help='explicit results path')
+    args = parser.parse_args(argv)
+
+    db = datagen.default_database(args.mongo_uri)
+    datagen.check_bench_db(db, args.force)
+    params = dict(seed=args.seed, users=args.users, coaches=args.coaches,
+                  lessons=args.lessons, courts=args.courts, years=args.years, today=args.today)
+    if args.generate or db.users.count_documents({}) == 0:
+        print('Generating dataset...')
+        summary = datagen.generate(db, **params)
+    else:
+        summary = dict(params, coach_ids=[str(c['_id']) for c in db.users.find({'role': 'coach'}, {'_id': 1})])
+
+    # The app reads MONGO_URI at import time, so point it at the bench DB first
+    os.environ['MONGO_URI'] = args.mongo_uri
+    os.environ['LESSON_SERIES_INTERVAL'] = '0'
+    os.environ['ROLLUPS_BACKFILL_ON_STARTUP'] = '0'
+    stubs.install(stripe_latency=args.stripe_latency)
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    # Build the daily_stats rollups for the generated bookings now, not while requests are measured
+    import rollups
+    rollups.backfill_once(db)
+    from app import app as flask_app
+    # Per-request access logs would dominate the measurement
+    logging.getLogger('werkzeug').setLevel(logging.WARNING)
+
+    members = db.users.find({'role': 'member', 'is_active': True},
+                            {'_id': 1, 'name': 1, 'email': 1}).sort('_id', 1).limit(500)
+    ctx = {'summary': summary,
+           'members': [{'id': str(m['_id']), 'name': m['name'], 'email': m['email']} for m in members]}
+    if not ctx['members'] or not summary.get('coach_ids'):
+        raise SystemExit('Dataset needs at least one member and one coach.')
+    host, port = start_server(flask_app, args.server)
+
+    results = {
+        'meta': {
+            'label': args.label or _git_revision() or 'unlabelled',
+            'git_revision': _git_revision(),
+            'started_at': datetime.now().isoformat(timespec='seconds'),
+            'concurrency': args.concurrency,
+            'requests_per_scenario': args.requests,
+            'server': args.server,
+            'stripe_latency': args.stripe_latency,
+            'today': args.today,
+            'dataset': {k: v for k, v in summary.items() if k != 'coach_ids'},
+        },
+        'scenarios': {},
+    }
+
+    print(f"{'scenario':<24}{'req/s':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'errors':>8}")
+    for name in [s.strip() for s in args.scenarios.split(',') if s.strip()]:
+        if name not in SCENARIOS:
+            raise SystemExit(f'Unknown scenario {name!r}; choose from {", ".join(SCENARIOS)}')
+        if args.warmup:
+            run_scenario(name, ctx, host, port, min(args.concurrency, args.warmup), args.warmup, args.seed + 1)
+        res = run_scenario(name, ctx, host, port, args.concurrency, args.requests, args.seed)
+        results['scenarios'][name] = res
+        print(f"{name:<24}{res['throughput_rps']:>9.1f}{res['p50_ms']:>9.1f}{res['p95_ms']:>9.1f}"
+              f"{res['p99_ms']:>9.1f}{res['errors']:>8}")
+
+    path = args.output or os.path.join(RESULTS_DIR, f"{results['meta']['label']}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, 'w') as fh:
+        json.dump(results, fh, indent=2, sort_keys=True)
+    print(f'Results written to {path}')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
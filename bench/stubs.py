@@ -0,0 +1,118 @@
+"""In-process stand-ins for Stripe and SMTP used by the benchmarks.
+
+`install()` patches the stripe-python resources the app calls and replaces
+`smtplib.SMTP`, so booking flows run end to end without network access.
+Checkout Sessions are kept in memory: call `register_session()` with the
+metadata the real Session would carry, then hit the success URL with its id.
+"""
+import itertools
+import os
+import smtplib
+import threading
+import time
+
+import stripe
+
+STRIPE_LATENCY = 0.0
+SMTP_LATENCY = 0.0
+
+_sessions = {}
+_lock = threading.Lock()
+_ids = itertools.count(1)
+
+
+class FakeStripeObject(dict):
+    """dict with attribute access, like stripe.StripeObject."""
+
+    def __getattr__(self, name):
+        try:
+            return self[name]
+        except KeyError:
+            raise AttributeError(name)
+
+
+def register_session(metadata, amount_total=1500, subscription=None, payment_status='paid'):
+    """Create a paid Checkout Session the success handlers will accept; returns its id."""
+    session_id = f'cs_bench_{next(_ids)}'
+    with _lock:
+        _sessions[session_id] = FakeStripeObject(
+            id=session_id,
+            url=f'https://checkout.stripe.test/{session_id}',
+            payment_status=payment_status,
+            payment_intent=f'pi_bench_{session_id}',
+            subscription=subscription,
+            amount_total=amount_total,
+            metadata=dict(metadata),
+        )
+    return session_id
+
+
+def _sleep(seconds):
+    if seconds:
+        time.sleep(seconds)
+
+
+def _retrieve_session(session_id, *args, **kwargs):
+    _sleep(STRIPE_LATENCY)
+    with _lock:
+        sess = _sessions.get(session_id)
+    if sess is None:
+        raise stripe.error.InvalidRequestError(f'No such checkout.session: {session_id}', 'id')
+    return sess
+
+
+def _create_session(**kwargs):
+    _sleep(STRIPE_LATENCY)
+    session_id = register_session(kwargs.get('metadata') or {}, payment_status='unpaid')
+    return _sessions[session_id]
+
+
+def _noop(*args, **kwargs):
+    _sleep(STRIPE_LATENCY)
+    return FakeStripeObject(id=f'bench_{next(_ids)}', data=[], charges=FakeStripeObject(data=[]))
+
+
+class FakeSMTP:
+    sent = 0
+    _count_lock = threading.Lock()
+
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def starttls(self, *args, **kwargs):
+        pass
+
+    def login(self, *args, **kwargs):
+        pass
+
+    def send_message(self, *args, **kwargs):
+        _sleep(SMTP_LATENCY)
+        with FakeSMTP._count_lock:
+            FakeSMTP.sent += 1
+
+    def quit(self):
+        pass
+
+
+def install(stripe_latency=0.0, smtp_latency=0.0):
+    """Patch stripe and smtplib; optional latencies simulate the real round trips."""
+    global STRIPE_LATENCY, SMTP_LATENCY
+    STRIPE_LATENCY = stripe_latency
+    SMTP_LATENCY = smtp_latency
+    # app.py assigns stripe.api_key from the environment when it is imported
+    os.environ['STRIPE_SECRET_KEY'] = 'sk_test_bench'
+    stripe.api_key = 'sk_test_bench'
+    stripe.checkout.Session.retrieve = staticmethod(_retrieve_session)
+    stripe.checkout.Session.create = staticmethod(_create_session)
+    stripe.Subscription.modify = staticmethod(_noop)
+    stripe.Subscription.delete = staticmethod(_noop)
+    stripe.Refund.create = staticmethod(_noop)
+    stripe.PaymentIntent.retrieve = staticmethod(_noop)
+    stripe.Invoice.list = staticmethod(_noop)
+    smtplib.SMTP = FakeSMTP
@@ -0,0 +1,276 @@
+"""On-the-fly gzip/brotli compression of dynamic responses (HTML, JSON, CSV, ...).
+
+Pages such as /lessons and the admin tables are large and repetitive HTML
+that compresses 5-10x. `CompressionMiddleware` wraps the WSGI app and, for
+clients that accept it, encodes responses with brotli (when the optional
+`brotli` package is installed) or gzip:
+
+- only compressible types (text/*, JSON, JavaScript, SVG, XML) and bodies of
+  at least COMPRESS_MIN_BYTES; smaller bodies are sent as they are
+- never responses that already carry a Content-Encoding (the precompressed
+  static build, see static_assets.py), Server-Sent Events (live.py) or
+  `Cache-Control: no-transform`
+- streamed bodies (no Content-Length, e.g. CSV exports) stay streamed: each
+  chunk the app yields is compressed and flushed to the client right away
+
+COMPRESS_LEVEL (gzip, 1-9) and COMPRESS_BROTLI_QUALITY (0-11) trade CPU for
+size; the defaults suit per-request compression. Input/output bytes and the
+CPU time spent compressing are recorded per endpoint in /metrics. Set
+COMPRESS=0 to leave compression to a reverse proxy instead.
+"""
+import logging
+import os
+import time
+import zlib
+
+import metrics
+
+log = logging.getLogger(__name__)
+
+try:
+    import brotli
+except ImportError:  # optional; gzip only without it
+    brotli = None
+
+ENABLED = os.getenv('COMPRESS', '1') != '0'
+MIN_BYTES = int(os.getenv('COMPRESS_MIN_BYTES', '1024'))
+LEVEL = int(os.getenv('COMPRESS_LEVEL', '6'))
+BROTLI_QUALITY = int(os.getenv('COMPRESS_BROTLI_QUALITY', '4'))
+
+COMPRESSIBLE_TYPES = {'application/json', 'application/javascript', 'application/xml', 'image/svg+xml'}
+NEVER_TYPES = {'text/event-stream'}
+# Flask stores the endpoint here so the middleware can label its metrics
+ENDPOINT_KEY = 'primecourt.endpoint'
+
+
+def negotiate(header, available=None):
+    """Best coding in `available` (server preference order) that Accept-Encoding allows, or None."""
+    if available is None:
+        available = ('br', 'gzip') if brotli is not None else ('gzip',)
+    weights = {}
+    for part in (header or '').split(','):
+        name, _, params = part.strip().partition(';')
+        name = name.strip().lower()
+        if not name:
+            continue
+        weight = 1.0
+        for param in params.split(';'):
+            key, _, value = param.strip().partition('=')
+            if key.strip().lower() == 'q':
+                try:
+                    weight = float(value)
+                except ValueError:
+                    weight = 0.0
+        weights[name] = weight
+    best = None
+    for coding in available:
+        weight = weights.get(coding, weights.get('*', 0.0))
+        if weight > 0 and (best is None or weight > best[1]):
+            best = (coding, weight)
+    return best[0] if best else None
+
+
+def compressible(content_type):
+    mimetype = (content_type or '').split(';', 1)[0].strip().lower()
+    if mimetype in NEVER_TYPES:
+        return False
+    return mimetype.startswith('text/') or mimetype in COMPRESSIBLE_TYPES
+
+
+def _compressor(coding, level, quality):
+    """(compress, flush, finish) callables for one response body."""
+    if coding == 'br':
+        c = brotli.Compressor(quality=quality)
+        return c.process, c.flush, c.finish
+    # wbits 16+: gzip container rather than raw zlib
+    z = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    return z.compress, lambda: z.flush(zlib.Z_SYNC_FLUSH), z.flush
+
+
+def _header(headers, name):
+    name = name.lower()
+    for key, value in headers:
+        if key.lower() == name:
+            return value
+    return None
+
+
+def _without(headers, *names):
+    names = {n.lower() for n in names}
+    return [(k, v) for k, v in headers if k.lower() not in names]
+
+
+def _add_vary(headers):
+    vary = _header(headers, 'Vary')
+    if vary is None:
+        return headers + [('Vary', 'Accept-Encoding')]
+    if 'accept-encoding' in vary.lower() or vary.strip() == '*':
+        return headers
+    return _without(headers, 'Vary') + [('Vary', f'{vary}, Accept-Encoding')]
+
+
+class _Exchange:
+    """One request/response pair passing through the middleware."""
+
+    def __init__(self, middleware, environ, start_response, coding):
+        self.mw = middleware
+        self.environ = environ
+        self.real_start_response = start_response
+        self.coding = coding
+        self.mode = None  # 'pass' or 'compress', decided when the app starts its response
+        self.status = self.headers = None
+        self.started = False
+        self.streaming = False
+        self.pending = []
+        self.pending_size = 0
+        self.codec = None
+        self.bytes_in = self.bytes_out = 0
+        self.cpu = 0.0
+
+    def start_response(self, status, headers, exc_info=None):
+        if exc_info and self.started:
+            raise exc_info[1].with_traceback(exc_info[2])
+        headers = list(headers)
+        reason = self._skip_reason(status, headers)
+        if compressible(_header(headers, 'Content-Type')):
+            headers = _add_vary(headers)
+        if reason:
+            metrics.compression_skipped.inc(reason)
+            self.mode = 'pass'
+            self.started = True
+            return self.real_start_response(status, headers, exc_info)
+        self.mode = 'compress'
+        self.status, self.headers = status, headers
+        self.streaming = _header(headers, 'Content-Length') is None
+        self.pending, self.pending_size = [], 0
+        return self._write
+
+    def _write(self, data):
+        # Legacy write() callable: treat it like body chunks sent ahead of the iterable
+        self.pending.append(data)
+        self.pending_size += len(data)
+
+    def _skip_reason(self, status, headers):
+        code = int(status.split(' ', 1)[0])
+        if self.coding is None:
+            return 'not-accepted'
+        if code < 200 or code in (204, 206, 304):
+            return 'status'
+        if _header(headers, 'Content-Encoding'):
+            return 'encoded'
+        if not compressible(_header(headers, 'Content-Type')):
+            return 'type'
+        if 'no-transform' in (_header(headers, 'Cache-Control') or '').lower():
+            return 'no-transform'
+        length = _header(headers, 'Content-Length')
+        if length is not None and length.isdigit() and int(length) < self.mw.min_bytes:
+            return 'small'
+        return None
+
+    def _begin(self):
+        """Send the headers of a compressed response."""
+        headers = _without(self.headers, 'Content-Length', 'Accept-Ranges')
+        etag = _header(headers, 'ETag')
+        if etag and not etag.startswith('W/'):
+            # Another representation of the same resource: only weakly equal to the identity body
+            headers = _without(headers, 'ETag') + [('ETag', 'W/' + etag)]
+        headers.append(('Content-Encoding', self.coding))
+        self.real_start_response(self.status, headers)
+        self.started = True
+        self.codec = _compressor(self.coding, self.mw.level, self.mw.brotli_quality)
+
+    def _begin_identity(self):
+        """The whole body turned out smaller than the threshold: send it unencoded."""
+        headers = self.headers
+        if _header(headers, 'Content-Length') is None:
+            headers = headers + [('Content-Length', str(self.pending_size))]
+        metrics.compression_skipped.inc('small')
+        self.real_start_response(self.status, headers)
+        self.started = True
+
+    def _encode(self, data, final=False):
+        compress, flush, finish = self.codec
+        started = time.thread_time()
+        out = compress(data) if data else b''
+        if final:
+            out += finish()
+        elif self.streaming:
+            out += flush()
+        self.cpu += time.thread_time() - started
+        self.bytes_in += len(data)
+        self.bytes_out += len(out)
+        return out
+
+    def iterate(self, result):
+        try:
+            for chunk in result:
+                if self.mode != 'compress':
+                    yield chunk
+                    continue
+                if not chunk:
+                    continue
+                if self.codec is None:
+                    self.pending.append(chunk)
+                    self.pending_size += len(chunk)
+                    if self.pending_size < self.mw.min_bytes:
+                        continue
+                    self._begin()
+                    chunk, self.pending = b''.join(self.pending), []
+                out = self._encode(chunk)
+                if out:
+                    yield out
+            if self.mode == 'compress':
+                if self.codec is None:
+                    self._begin_identity()
+                    if self.pending:
+                        yield b''.join(self.pending)
+                else:
+                    yield self._encode(b'', final=True)
+                    self._record()
+        finally:
+            if hasattr(result, 'close'):
+                result.close()
+
+    def _record(self):
+        endpoint = self.environ.get(ENDPOINT_KEY, 'unmatched')
+        metrics.compression_input_bytes.inc(endpoint, self.coding, amount=self.bytes_in)
+        metrics.compression_output_bytes.inc(endpoint, self.coding, amount=self.bytes_out)
+        metrics.compression_cpu.observe(self.cpu, endpoint, self.coding)
+
+
+class CompressionMiddleware:
+    """WSGI middleware that gzip/brotli-encodes compressible responses (see module docstring)."""
+
+    def __init__(self, app, min_bytes=MIN_BYTES, level=LEVEL, brotli_quality=BROTLI_QUALITY):
+        self.app = app
+        self.min_bytes = min_bytes
+        self.level = level
+        self.brotli_quality = brotli_quality
+
+    def __call__(self, environ, start_response):
+        if environ.get('REQUEST_METHOD') == 'HEAD':
+            return self.app(environ, start_response)
+        exchange = _Exchange(self, environ, start_response, negotiate(environ.get('HTTP_ACCEPT_ENCODING')))
+        result = self.app(environ, exchange.start_response)
+        if exchange.mode == 'pass':
+            # Untouched: hand back the app's iterable itself (keeps wsgi.file_wrapper for send_file)
+            return result
+        return exchange.iterate(result)
+
+
+def init_app(app):
+    """Wrap `app.wsgi_app` in CompressionMiddleware (unless COMPRESS=0)."""
+    from flask import request
+
+    if not ENABLED:
+        log.info('response compression off')
+        return
+
+    @app.after_request
+    def _compression_endpoint(response):
+        request.environ[ENDPOINT_KEY] = request.endpoint or 'unmatched'
+        return response
+
+    app.wsgi_app = CompressionMiddleware(app.wsgi_app)
+    log.info('response compression: %s, level %s, min %s bytes',
+             'br+gzip' if brotli is not None else 'gzip', LEVEL, MIN_BYTES)
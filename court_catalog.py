@@ -0,0 +1,180 @@
+"""Courts, their opening hours and prices, kept in the `courts` collection.
+
+    {'_id': 'court-2', 'name': 'Court 2', 'surface': 'Clay', 'price': 1500,
+     'hours': [[9, 21], [9, 21], [9, 21], [9, 21], [9, 21], [8, 22], None],
+     'active': True, 'position': 2}
+
+`price` is in cents per one-hour slot and `hours` holds the [open, close)
+start hours for each weekday, Monday first (None = closed that day). Inactive
+courts keep their bookings but take no new ones.
+
+Every worker holds the whole collection in memory as a `Catalog`, so court
+routes never read it per request. Admin edits go through `save()`, which bumps
+the 'courts' counter in cache_versions (page_cache.py); the editing worker
+reloads at once and the others within PAGE_CACHE_VERSION_TTL seconds.
+
+While the collection is empty DEFAULT_COURTS (the three courts the club opened
+with, 09:00-21:00 daily at $15) are served, and the first admin save writes
+them.
+"""
+import logging
+import math
+import re
+import threading
+
+from pymongo import UpdateOne
+
+import page_cache
+import slot_search
+
+log = logging.getLogger(__name__)
+
+COLLECTION = 'courts'
+NAMESPACE = 'courts'
+WEEKDAYS = ('Mon', 'Tue', 'Wed', 'Thu', 'Fri', 'Sat', 'Sun')
+DEFAULT_PRICE = 1500  # cents
+DEFAULT_HOURS = [[9, 21]] * 7
+DEFAULT_COURTS = [
+    {'_id': f'court-{n}', 'name': f'Court {n}', 'surface': surface, 'price': DEFAULT_PRICE,
+     'hours': DEFAULT_HOURS, 'active': True, 'position': n}
+    for n, surface in ((1, 'Hard'), (2, 'Clay'), (3, 'Grass'))
+]
+
+_ID_RE = re.compile(r'^[a-z0-9][a-z0-9-]{0,31}$')
+_lock = threading.Lock()
+_catalog = None
+
+
+class CatalogError(ValueError):
+    """An admin edit that cannot be saved (message is shown to the admin)."""
+
+
+def price_label(cents):
+    """'$15' or '$17.50'."""
+    return f'${cents // 100}' if cents % 100 == 0 else f'${cents / 100:.2f}'
+
+
+def _court(doc):
+    hours = list(doc.get('hours') or DEFAULT_HOURS)[:7]
+    hours += [None] * (7 - len(hours))
+    price = int(doc.get('price', DEFAULT_PRICE))
+    return {
+        'id': doc['_id'],
+        'name': doc.get('name') or doc['_id'],
+        'surface': doc.get('surface', ''),
+        'price': price,
+        'price_label': price_label(price),
+        'hours': [tuple(h) if h else None for h in hours],
+        'active': doc.get('active', True),
+        'position': doc.get('position', 0),
+    }
+
+
+class Catalog:
+    """Read-only snapshot of the courts collection."""
+
+    def __init__(self, docs, version=None):
+        self.version = version
+        self.courts = sorted((_court(d) for d in docs), key=lambda c: (c['position'], c['id']))
+        self._by_id = {c['id']: c for c in self.courts}
+        self._active = [c for c in self.courts if c['active']]
+        self._hours = sorted({h for c in self._active for span in c['hours'] if span for h in range(*span)})
+
+    def get(self, court_id):
+        return self._by_id.get(court_id)
+
+    def active(self):
+        """Courts that take bookings, in display order."""
+        return self._active
+
+    def ids(self):
+        return [c['id'] for c in self._active]
+
+    def open_hours(self, court_id, weekday):
+        """Start hours a court can be booked on a weekday (0=Mon); empty when closed or inactive."""
+        court = self._by_id.get(court_id)
+        if court is None or not court['active'] or not court['hours'][weekday]:
+            return range(0)
+        return range(*court['hours'][weekday])
+
+    def is_open(self, court_id, day, time_label):
+        """True if `time_label` ('18:00 - 19:00') is a bookable slot of the court on `day`."""
+        hours = self.open_hours(court_id, day.weekday())
+        return any(slot_search.court_label(h) == time_label for h in hours)
+
+    def open_labels(self, court_id, weekday):
+        return [slot_search.court_label(h) for h in self.open_hours(court_id, weekday)]
+
+    def hours(self):
+        """Every start hour any active court opens at, on any weekday (rows of the courts grid)."""
+        return self._hours
+
+    def slot_labels(self):
+        return [slot_search.court_label(h) for h in self._hours]
+
+
+def get(db):
+    """This worker's catalog, reloaded when an admin edit bumped the courts version."""
+    global _catalog
+    current = page_cache.versions(db, [NAMESPACE])
+    catalog = _catalog
+    if catalog is not None and (current is None or catalog.version == current[0]):
+        return catalog
+    with _lock:
+        if _catalog is not None and current is not None and _catalog.version == current[0]:
+            return _catalog
+        try:
+            docs = list(db[COLLECTION].find({}))
+        except Exception as e:
+            log.warning('could not load the courts catalog: %s', e)
+            return catalog or Catalog(DEFAULT_COURTS)
+        _catalog = Catalog(docs or DEFAULT_COURTS, current[0] if current else None)
+        return _catalog
+
+
+def from_form(form):
+    """Court document from the admin form; raises CatalogError on invalid input."""
+    court_id = (form.get('id') or '').strip().lower()
+    if not _ID_RE.match(court_id):
+        raise CatalogError('Court id must be lowercase letters, digits and dashes, e.g. court-4.')
+    name = (form.get('name') or '').strip()
+    if not name:
+        raise CatalogError('Court name is required.')
+    try:
+        dollars = float(form.get('price', ''))
+        if not math.isfinite(dollars):
+            raise ValueError(dollars)
+        price = round(dollars * 100)
+    except (ValueError, OverflowError):
+        raise CatalogError('Price must be a number.')
+    if price < 0:
+        raise CatalogError('Price cannot be negative.')
+    hours = []
+    for wd, label in enumerate(WEEKDAYS):
+        if form.get(f'closed_{wd}'):
+            hours.append(None)
+            continue
+        try:
+            open_h, close_h = int(form.get(f'open_{wd}', '')), int(form.get(f'close_{wd}', ''))
+        except ValueError:
+            raise CatalogError(f'{label}: opening hours must be whole hours.')
+        if not 0 <= open_h < close_h <= 24:
+            raise CatalogError(f'{label}: the court must open before it closes (0-24).')
+        hours.append([open_h, close_h])
+    try:
+        position = int(form.get('position') or 0)
+    except ValueError:
+        position = 0
+    return {'_id': court_id, 'name': name, 'surface': (form.get('surface') or '').strip(), 'price': price,
+            'hours': hours, 'active': bool(form.get('active')), 'position': position}
+
+
+def save(db, court):
+    """Insert or update one court and make every worker reload the catalog."""
+    if not db[COLLECTION].count_documents({}, limit=1):
+        # First edit: write the default courts the site was serving so they do not disappear
+        seed = [UpdateOne({'_id': d['_id']}, {'$setOnInsert': {k: v for k, v in d.items() if k != '_id'}},
+                          upsert=True) for d in DEFAULT_COURTS]
+        db[COLLECTION].bulk_write(seed, ordered=False)
+    db[COLLECTION].replace_one({'_id': court['_id']}, court, upsert=True)
+    page_cache.invalidate(db, NAMESPACE)
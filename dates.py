@@ -0,0 +1,60 @@
+"""Helpers for the legacy `date` fields.
+
+Bookings and court bookings store their day as 'YYYY-MM-DD', as an ISO string
+with a time part, or as a datetime, depending on which code path wrote them.
+"""
+from datetime import datetime, timedelta
+
+
+def day_key(value):
+    """'YYYY-MM-DD' for any of the stored representations, or None."""
+    if isinstance(value, datetime):
+        return value.strftime('%Y-%m-%d')
+    if isinstance(value, str) and len(value) >= 10:
+        return value[:10]
+    return None
+
+
+def range_filter(field, date_from, date_to):
+    """Query matching `field` between two 'YYYY-MM-DD' days (inclusive), or None.
+
+    The range is expressed for both strings and datetimes so every stored
+    representation matches, and each branch can use an index on `field`.
+    """
+    try:
+        start = datetime.strptime(date_from, '%Y-%m-%d') if date_from else None
+        end = datetime.strptime(date_to, '%Y-%m-%d') + timedelta(days=1) if date_to else None
+    except ValueError:
+        return None
+    if start is None and end is None:
+        return None
+    str_range, dt_range = {}, {}
+    if start is not None:
+        str_range['$gte'] = start.strftime('%Y-%m-%d')
+        dt_range['$gte'] = start
+    if end is not None:
+        # '<' the next day also takes in '2025-01-31T10:00:00' style values
+        str_range['$lt'] = end.strftime('%Y-%m-%d')
+        dt_range['$lt'] = end
+    return {'$or': [{field: str_range}, {field: dt_range}]}
+
+
+def days_between(date_from, date_to, weekdays=None, limit=366):
+    """'YYYY-MM-DD' days from date_from to date_to inclusive, optionally only the given weekdays (0=Mon).
+
+    Raises ValueError for an unparseable or reversed range, or one longer than
+    `limit` days.
+    """
+    start = datetime.strptime(date_from, '%Y-%m-%d')
+    end = datetime.strptime(date_to, '%Y-%m-%d')
+    if end < start:
+        raise ValueError('end date is before start date')
+    if (end - start).days >= limit:
+        raise ValueError(f'range is longer than {limit} days')
+    days = []
+    day = start
+    while day <= end:
+        if not weekdays or day.weekday() in weekdays:
+            days.append(day.strftime('%Y-%m-%d'))
+        day += timedelta(days=1)
+    return days
@@ -0,0 +1,125 @@
+"""MongoDB index definitions for the query shapes used by the routes.
+
+`ensure_indexes(db)` is idempotent (createIndex on an existing index is a
+no-op) and is run once at startup in a background thread, or explicitly with
+`flask --app app ensure-indexes`. bench/query_plans.py checks that the routes
+keep using these indexes.
+"""
+import logging
+
+from pymongo import ASCENDING, DESCENDING, TEXT
+
+import user_search
+
+log = logging.getLogger(__name__)
+
+# collection -> list of (keys, options)
+INDEXES = {
+    'users': [
+        ([('email', ASCENDING)], {'name': 'email'}),
+        # /admin/users pages newest-first within a role
+        ([('role', ASCENDING), ('_id', DESCENDING)], {'name': 'role_id'}),
+        ([('created_at', DESCENDING)], {'name': 'created_at'}),
+        # Admin search: anchored prefix regexes on the normalized fields (see user_search.py)
+        ([('email_lc', ASCENDING)], {'name': 'email_lc'}),
+        ([('name_lc', ASCENDING)], {'name': 'name_lc'}),
+    ],
+    'bookings': [
+        # Slot lookups in the booking flows and per-day views
+        ([('date', ASCENDING), ('time', ASCENDING), ('lesson_type', ASCENDING)], {'name': 'date_time_type'}),
+        # Coach dashboards/profiles list a coach's lessons by date
+        ([('coach_id', ASCENDING), ('date', ASCENDING)], {'name': 'coach_date'}),
+        ([('user_id', ASCENDING), ('date', ASCENDING)], {'name': 'user_date'}),
+        ([('stripe_session_id', ASCENDING)], {'name': 'stripe_session_id', 'sparse': True}),
+        # Series-wide cancellation; unique so materializing an occurrence twice is a no-op
+        ([('series_id', ASCENDING), ('date', ASCENDING)],
+         {'name': 'series_date_unique', 'unique': True, 'partialFilterExpression': {'series_id': {'$exists': True}}}),
+    ],
+    'lesson_series': [
+        # materialize_due() and expand() (see lesson_series.py)
+        ([('status', ASCENDING), ('materialized_through', ASCENDING)], {'name': 'status_materialized'}),
+        ([('status', ASCENDING), ('end_date', ASCENDING)], {'name': 'status_end'}),
+        ([('user_id', ASCENDING), ('end_date', ASCENDING)], {'name': 'user_end'}),
+    ],
+    'court_bookings': [
+        ([('date', ASCENDING), ('court_id', ASCENDING), ('time', ASCENDING)], {'name': 'date_court_time'}),
+        ([('user_id', ASCENDING), ('date', ASCENDING)], {'name': 'user_date'}),
+        # /admin/courts keyset pages
+        ([('date', ASCENDING), ('time', ASCENDING), ('_id', ASCENDING)], {'name': 'date_time_id'}),
+    ],
+    'schedule_settings': [
+        ([('date', ASCENDING)], {'name': 'date'}),
+    ],
+    'coach_weekly_availability': [
+        ([('weekdays', ASCENDING)], {'name': 'weekdays'}),
+        ([('coach_id', ASCENDING)], {'name': 'coach_id'}),
+    ],
+    'coach_availability': [
+        ([('date', ASCENDING)], {'name': 'date'}),
+    ],
+    'settings': [
+        ([('type', ASCENDING)], {'name': 'type'}),
+    ],
+}
+
+# collection -> names of indexes superseded by one above; dropped by ensure_indexes()
+OBSOLETE = {
+    'bookings': ['series_date'],
+}
+
+if user_search.USER_TEXT_SEARCH:
+    INDEXES['users'].append(([('name', TEXT), ('email', TEXT)], {'name': 'name_email_text'}))
+
+
+def ensure_indexes(db):
+    """Create every index in INDEXES; returns the number that failed."""
+    failures = 0
+    for collection, specs in INDEXES.items():
+        for keys, options in specs:
+            try:
+                db[collection].create_index(keys, **options)
+            except Exception as e:
+                # e.g. a unique index over legacy duplicate data; the app still works without it
+                failures += 1
+                log.warning('could not create index %s.%s: %s', collection, options.get('name'), e)
+    if failures:
+        # Keep the old indexes until their replacements exist
+        return failures
+    for collection, names in OBSOLETE.items():
+        for name in names:
+            try:
+                if name in db[collection].index_information():
+                    db[collection].drop_index(name)
+                    log.info('dropped obsolete index %s.%s', collection, name)
+            except Exception as e:
+                log.warning('could not drop index %s.%s: %s', collection, name, e)
+    return failures
+
+
+def init_app(app, mongo):
+    """Register the `ensure-indexes` CLI command and build indexes in the background at startup.
+
+    Set ENSURE_INDEXES_ON_STARTUP=0 to skip the startup build (e.g. when a
+    deploy step runs the CLI command instead).
+    """
+    import os
+    import threading
+
+    @app.cli.command('ensure-indexes')
+    def ensure_indexes_command():
+        """Create the MongoDB indexes the routes rely on."""
+        failures = ensure_indexes(mongo.db)
+        user_search.backfill(mongo.db)
+        print('Indexes ensured.' if not failures else f'{failures} index(es) could not be created; see log.')
+
+    if os.getenv('ENSURE_INDEXES_ON_STARTUP', '1') != '0':
+        # Run off the import path so an unreachable Mongo does not delay startup
+        threading.Thread(target=_startup, args=(mongo.db,), name='ensure-indexes', daemon=True).start()
+
+
+def _startup(db):
+    ensure_indexes(db)
+    try:
+        user_search.backfill(db)
+    except Exception as e:
+        log.warning('user search backfill failed: %s', e)
@@ -0,0 +1,126 @@
+"""Streaming CSV exports for the admin export endpoints.
+
+`csv_chunks()` turns a Mongo cursor into CSV text a few hundred rows at a
+time (optionally gzip-compressed on the fly), so an export's memory use is
+one cursor batch plus one chunk, whatever the number of rows.
+"""
+import csv
+import io
+import zlib
+from datetime import datetime
+
+BATCH_SIZE = 1000
+ROWS_PER_CHUNK = 500
+
+
+def _fmt(value):
+    if value is None:
+        return ''
+    if isinstance(value, datetime):
+        return value.isoformat(sep=' ', timespec='seconds')
+    if isinstance(value, (list, tuple)):
+        return '; '.join(str(v) for v in value)
+    return str(value)
+
+
+def _field(name, default_keys=()):
+    """Column getter reading `name`, falling back to older field names."""
+    def get(doc):
+        for key in (name,) + tuple(default_keys):
+            if doc.get(key) is not None:
+                return doc[key]
+        return None
+    return get
+
+
+# Export kind (also the collection name) -> [(header, getter)]
+COLUMNS = {
+    'bookings': [
+        ('id', _field('_id')),
+        ('date', _field('date')),
+        ('time', _field('time')),
+        ('lesson_type', _field('lesson_type')),
+        ('name', _field('name')),
+        ('email', _field('email')),
+        ('user_id', _field('user_id')),
+        ('coach_name', _field('coach_name')),
+        ('coach_id', _field('coach_id')),
+        ('status', _field('status')),
+        ('payment_status', _field('payment_status')),
+        ('amount_paid', _field('amount_paid')),
+        ('recurring_week', _field('recurring_week')),
+        ('stripe_session_id', _field('stripe_session_id')),
+        ('created_at', _field('created_at')),
+    ],
+    'court_bookings': [
+        ('id', _field('_id')),
+        ('date', _field('date')),
+        ('time', _field('time')),
+        ('court_id', _field('court_id')),
+        ('user_name', _field('user_name', ('name',))),
+        ('user_email', _field('user_email', ('email',))),
+        ('user_id', _field('user_id')),
+        ('amount_paid', _field('amount_paid')),
+        ('status', _field('status')),
+        ('payment_intent', _field('payment_intent')),
+        ('created_at', _field('created_at')),
+    ],
+    'users': [
+        ('id', _field('_id')),
+        ('name', _field('name')),
+        ('email', _field('email')),
+        ('role', _field('role')),
+        ('is_active', _field('is_active')),
+        ('membership_plan', lambda d: (d.get('membership') or {}).get('plan_id')),
+        ('membership_status', lambda d: (d.get('membership') or {}).get('status')),
+        ('membership_expires_at', lambda d: (d.get('membership') or {}).get('expires_at')),
+        ('created_at', _field('created_at')),
+    ],
+}
+
+# Fields read per export; passwords (and everything else) are never fetched
+PROJECTIONS = {
+    'bookings': ['date', 'time', 'lesson_type', 'name', 'email', 'user_id', 'coach_name', 'coach_id', 'status',
+                 'payment_status', 'amount_paid', 'recurring_week', 'stripe_session_id', 'created_at'],
+    'court_bookings': ['date', 'time', 'court_id', 'user_name', 'name', 'user_email', 'email', 'user_id',
+                       'amount_paid', 'status', 'payment_intent', 'created_at'],
+    'users': ['name', 'email', 'role', 'is_active', 'membership', 'created_at'],
+}
+
+
+def find_cursor(db, kind, query):
+    """Projected, batched cursor for an export kind."""
+    projection = {field: 1 for field in PROJECTIONS[kind]}
+    return db[kind].find(query, projection).batch_size(BATCH_SIZE)
+
+
+def csv_chunks(cursor, columns, compress=False):
+    """Yield the CSV (header first) in chunks of ROWS_PER_CHUNK rows, gzip-compressed if asked."""
+    gz = zlib.compressobj(6, zlib.DEFLATED, 31) if compress else None
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+
+    def flush():
+        data = buf.getvalue().encode('utf-8')
+        buf.seek(0)
+        buf.truncate()
+        return gz.compress(data) if gz else data
+
+    writer.writerow([header for header, _ in columns])
+    rows = 0
+    try:
+        for doc in cursor:
+            writer.writerow([_fmt(get(doc)) for _, get in columns])
+            rows += 1
+            if rows % ROWS_PER_CHUNK == 0:
+                chunk = flush()
+                if chunk:
+                    yield chunk
+        chunk = flush()
+        if gz:
+            chunk += gz.flush()
+        if chunk:
+            yield chunk
+    finally:
+        # Client went away mid-download: release the server-side cursor now
+        cursor.close()
@@ -0,0 +1,315 @@
+"""Recurring lesson series.
+
+A recurring purchase is stored once, as a `lesson_series` document holding the
+rule and its exceptions:
+
+    {
+      'user_id': '...', 'name': ..., 'email': ..., 'lesson_type': 'group',
+      'time': '6:00 PM - 7:00 PM', 'start_date': '2025-03-04', 'weeks': 12,
+      'end_date': '2025-05-20', 'exceptions': {'2025-04-15': 'no_classes'},
+      'materialized_through': '2025-04-01', 'status': 'active',
+      'booking_fields': {'stripe_session_id': ..., 'amount_paid': 25.0, ...},
+    }
+
+Occurrences become ordinary `bookings` (with `series_id`) only once they fall
+inside a rolling window of WINDOW_DAYS; `materialize_due()` advances the
+window from a background thread (or `flask --app app materialize-lesson-series`
+from cron). Calendars and slot checks add the not-yet-materialized
+occurrences from `expand()`, so a series holds its slots all the way to the
+end. Cancelling a series is one update plus the few bookings already in the
+window.
+
+WINDOW_DAYS defaults to 30 so the coach screens, which look 30 days ahead at
+bookings, see every occurrence they can act on.
+"""
+import logging
+import os
+from datetime import datetime, timedelta
+
+from bson import ObjectId
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+
+import availability
+import page_cache
+import rollups
+
+log = logging.getLogger(__name__)
+
+COLLECTION = 'lesson_series'
+WINDOW_DAYS = int(os.getenv('LESSON_SERIES_WINDOW_DAYS', '30'))
+# Seconds between background materialization runs; 0 disables the thread
+INTERVAL = int(os.getenv('LESSON_SERIES_INTERVAL', '3600'))
+GROUP_CAPACITY = rollups.GROUP_CAPACITY
+
+_EXPAND_PROJECTION = {'user_id': 1, 'name': 1, 'email': 1, 'lesson_type': 1, 'time': 1, 'start_date': 1,
+                      'weeks': 1, 'exceptions': 1, 'materialized_through': 1}
+
+
+def _day(d):
+    return d.strftime('%Y-%m-%d')
+
+
+def occurrences(series):
+    """(week_number, 'YYYY-MM-DD') for every occurrence of the rule, exceptions excluded."""
+    start = datetime.strptime(series['start_date'], '%Y-%m-%d')
+    exceptions = series.get('exceptions') or {}
+    out = []
+    for week in range(int(series.get('weeks') or 1)):
+        day = _day(start + timedelta(weeks=week))
+        if day not in exceptions:
+            out.append((week + 1, day))
+    return out
+
+
+def _as_booking(series, week, day):
+    return {
+        'series_id': series['_id'],
+        'user_id': series.get('user_id'),
+        'name': series.get('name', ''),
+        'email': series.get('email', ''),
+        'date': day,
+        'time': series['time'],
+        'lesson_type': series['lesson_type'],
+        'recurring_week': f"{week}/{series.get('weeks')}",
+    }
+
+
+def expand(db, date_from, date_to):
+    """Booking-shaped dicts for the occurrences in date_from..date_to not materialized yet."""
+    out = []
+    cursor = db[COLLECTION].find({'status': 'active', 'end_date': {'$gte': date_from},
+                                  'start_date': {'$lte': date_to}}, _EXPAND_PROJECTION)
+    for series in cursor:
+        for week, day in occurrences(series):
+            if date_from <= day <= date_to and day > series.get('materialized_through', ''):
+                out.append(_as_booking(series, week, day))
+    return out
+
+
+def expand_counts(db, date_from, date_to):
+    """{(date, 'HH:MM'): {'private': n, 'group': n}} for the not-yet-materialized occurrences."""
+    counts = {}
+    for b in expand(db, date_from, date_to):
+        slot = counts.setdefault((b['date'], rollups.slot_key(b['time'])), {'private': 0, 'group': 0})
+        if b['lesson_type'] in slot:
+            slot[b['lesson_type']] += 1
+    return counts
+
+
+def slot_counts(db, date_str, time_str, exclude=None):
+    """Private/group lessons held in one slot: live bookings plus other series' pending occurrences."""
+    counts = {'private': 0, 'group': 0}
+    for b in db.bookings.find({'date': date_str, 'time': time_str, 'status': {'$ne': 'cancelled'}},
+                              {'lesson_type': 1}):
+        if b.get('lesson_type') in counts:
+            counts[b['lesson_type']] += 1
+    for b in expand(db, date_str, date_str):
+        if b['time'] == time_str and b['series_id'] != exclude and b['lesson_type'] in counts:
+            counts[b['lesson_type']] += 1
+    return counts
+
+
+def unavailable_reason(db, date_str, time_str, lesson_type, exclude=None):
+    """Why a lesson cannot take place in a slot ('no_classes', 'closed', 'full'), or None if it can."""
+    setting = db.schedule_settings.find_one({'date': date_str}) or {}
+    if setting.get('no_classes'):
+        return 'no_classes'
+    if not rollups.lesson_offered(setting, time_str):
+        return 'closed'
+    counts = slot_counts(db, date_str, time_str, exclude=exclude)
+    if not rollups.lesson_open(counts['private'], counts['group'], lesson_type):
+        return 'full'
+    return None
+
+
+def create(db, user_id, name, email, lesson_type, time_str, start_date, weeks, **booking_fields):
+    """Store a new series and materialize its first window; returns the series document.
+
+    Weeks whose slot is unavailable right now are recorded as exceptions, so
+    the series (and the confirmation email) lists only lessons that will run.
+    `booking_fields` (Stripe ids, amount_paid, ...) are kept on the series and
+    copied to each materialized booking.
+    """
+    start = datetime.strptime(start_date, '%Y-%m-%d')
+    series = {
+        '_id': ObjectId(),
+        'user_id': user_id,
+        'name': name or '',
+        'email': email or '',
+        'lesson_type': lesson_type,
+        'time': time_str,
+        'start_date': start_date,
+        'weeks': weeks,
+        'end_date': _day(start + timedelta(weeks=weeks - 1)),
+        'exceptions': {},
+        'materialized_through': _day(start - timedelta(days=1)),
+        'status': 'active',
+        'created_at': datetime.utcnow(),
+        'booking_fields': booking_fields,
+    }
+    for week in range(weeks):
+        day = _day(start + timedelta(weeks=week))
+        reason = unavailable_reason(db, day, time_str, lesson_type, exclude=series['_id'])
+        if reason:
+            series['exceptions'][day] = reason
+    db[COLLECTION].insert_one(series)
+    # The pending occurrences hold their slots from now on
+    availability.bump(db, 'lessons', *[day for _week, day in occurrences(series)])
+    materialize(db, series, _day(datetime.utcnow() + timedelta(days=WINDOW_DAYS)))
+    return series
+
+
+def materialize(db, series, through, assign_coach=None):
+    """Write the series' bookings up to `through` (inclusive); returns the bookings this call inserted.
+
+    Bookings are written first, as upserts keyed on the unique (series_id,
+    date) index, and only then is materialized_through advanced with a
+    compare-and-set. Until that moment expand() still returns the
+    occurrences, so a slot is never free while it is being written (it may
+    briefly count twice, which only errs towards "full"). A run that fails
+    half-way leaves the window unclaimed, and the next run writes what is
+    missing; workers racing on the same series insert each occurrence once.
+    """
+    done = series.get('materialized_through', '')
+    through = min(through, series['end_date'])
+    if through <= done or series.get('status') != 'active':
+        return []
+
+    if assign_coach is None:
+        from routes import _assign_coach_for_date as assign_coach
+
+    bookings = []
+    skipped = {}
+    for week, day in occurrences(series):
+        if not (done < day <= through):
+            continue
+        # Schedule changes since purchase (holidays, closed slots) still win; a
+        # 'full' slot was booked over this series' reservation, which keeps its place
+        reason = unavailable_reason(db, day, series['time'], series['lesson_type'], exclude=series['_id'])
+        if reason and reason != 'full':
+            skipped[f'exceptions.{day}'] = reason
+            continue
+        booking = _as_booking(series, week, day)
+        booking.update(series.get('booking_fields') or {})
+        booking['created_at'] = datetime.utcnow()
+        coach_info = assign_coach(day)
+        if coach_info:
+            booking['coach_id'] = coach_info.get('coach_id')
+            booking['coach_name'] = coach_info.get('coach_name')
+        bookings.append(booking)
+
+    inserted = _upsert_bookings(db, bookings)
+    if inserted:
+        for booking in inserted:
+            rollups.record_lesson_booking(db, booking)
+        for coach_id in {b.get('coach_id') for b in inserted if b.get('coach_id')}:
+            page_cache.invalidate(db, f'coach:{coach_id}')
+        availability.bump(db, 'lessons', *[b['date'] for b in inserted])
+
+    update = {'$set': dict(skipped, materialized_through=through)}
+    if through >= series['end_date']:
+        update['$set']['status'] = 'completed'
+    claimed = db[COLLECTION].find_one_and_update(
+        {'_id': series['_id'], 'status': 'active', 'materialized_through': done}, update)
+    if claimed is None:
+        current = db[COLLECTION].find_one({'_id': series['_id']}, {'status': 1, 'cancelled_from': 1})
+        if current and current.get('status') == 'cancelled' and inserted:
+            # Cancelled while these were being written: cancel() did not see them
+            cancel_from = current.get('cancelled_from', '')
+            late = [b for b in inserted if b['date'] >= cancel_from]
+            _cancel_bookings(db, late)
+            inserted = [b for b in inserted if b['date'] < cancel_from]
+        # Otherwise another worker advanced the window; the upserts made sure nothing was written twice
+    return inserted
+
+
+def _upsert_bookings(db, bookings):
+    """Insert the bookings whose (series_id, date) is not written yet; returns those inserted."""
+    if not bookings:
+        return []
+    ops = [UpdateOne({'series_id': b['series_id'], 'date': b['date']}, {'$setOnInsert': b}, upsert=True)
+           for b in bookings]
+    try:
+        upserted = db.bookings.bulk_write(ops, ordered=False).upserted_ids
+    except BulkWriteError as e:
+        # A worker racing on the same series inserted some of them first (duplicate key)
+        if any(err.get('code') != 11000 for err in e.details.get('writeErrors', [])):
+            raise
+        upserted = {u['index']: u['_id'] for u in e.details.get('upserted', [])}
+    inserted = []
+    for index, _id in sorted(upserted.items()):
+        bookings[index]['_id'] = _id
+        inserted.append(bookings[index])
+    return inserted
+
+
+def _cancel_bookings(db, bookings):
+    if not bookings:
+        return
+    db.bookings.update_many({'_id': {'$in': [b['_id'] for b in bookings]}},
+                            {'$set': {'status': 'cancelled', 'cancelled_by': 'member',
+                                      'cancelled_at': datetime.utcnow()}})
+    for b in bookings:
+        rollups.record_lesson_booking(db, b, delta=-1)
+    for coach_id in {b.get('coach_id') for b in bookings if b.get('coach_id')}:
+        page_cache.invalidate(db, f'coach:{coach_id}')
+
+
+def materialize_due(db, today=None):
+    """Advance every active series' window to today + WINDOW_DAYS; returns bookings written."""
+    today = today or datetime.utcnow()
+    through = _day(today + timedelta(days=WINDOW_DAYS))
+    written = 0
+    for series in db[COLLECTION].find({'status': 'active', 'materialized_through': {'$lt': through}}):
+        try:
+            written += len(materialize(db, series, through))
+        except Exception as e:
+            log.exception('materializing lesson series %s failed: %s', series.get('_id'), e)
+    if written:
+        log.info('materialized %d lesson series bookings', written)
+    return written
+
+
+def cancel(db, series_id, from_date=None):
+    """Cancel a series from `from_date` (default today) on; returns the cancelled bookings.
+
+    Pending occurrences disappear with the series; bookings already written
+    in the window are marked cancelled and taken out of the daily rollups.
+    """
+    from_date = from_date or _day(datetime.utcnow())
+    series = db[COLLECTION].find_one_and_update(
+        {'_id': series_id, 'status': {'$in': ['active', 'completed']}},
+        {'$set': {'status': 'cancelled', 'cancelled_from': from_date, 'cancelled_at': datetime.utcnow()}})
+    if series is None:
+        return []
+    availability.bump(db, 'lessons', *[day for _week, day in occurrences(series) if day >= from_date])
+    query = {'series_id': series_id, 'date': {'$gte': from_date}, 'status': {'$ne': 'cancelled'}}
+    bookings = list(db.bookings.find(query, {'date': 1, 'time': 1, 'lesson_type': 1, 'amount_paid': 1,
+                                             'coach_id': 1}))
+    _cancel_bookings(db, bookings)
+    return bookings
+
+
+def init_app(app, mongo):
+    """Register the `materialize-lesson-series` CLI command and the background materializer."""
+    import threading
+    import time
+
+    @app.cli.command('materialize-lesson-series')
+    def materialize_command():
+        """Write the lesson series bookings that entered the rolling window."""
+        print(f'Materialized {materialize_due(mongo.db)} booking(s).')
+
+    def loop():
+        # Give the app (and routes, which materialize() imports) time to finish loading
+        time.sleep(30)
+        while True:
+            try:
+                materialize_due(mongo.db)
+            except Exception as e:
+                log.warning('lesson series materialization failed: %s', e)
+            time.sleep(INTERVAL)
+
+    if INTERVAL > 0:
+        threading.Thread(target=loop, name='lesson-series', daemon=True).start()
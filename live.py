@@ -0,0 +1,301 @@
+"""Live availability over Server-Sent Events.
+
+Open /courts and /lessons pages subscribe to /live/availability?kind=courts&date=...
+and receive deltas as other members book or cancel:
+
+    event: slot-taken
+    data: {"date": "2025-03-04", "court_id": "court-2", "time": "18:00 - 19:00"}
+
+Each worker runs one watcher thread for all of its streams. It reads the
+per-date counters in `availability_versions` (availability.py) for the dates
+somebody is watching, every POLL_SECONDS or at once when a booking write in
+this process bumps them. Only a date whose counter moved is reloaded, once
+per worker however many browsers watch it, and the diff against the previous
+snapshot is fanned out to the subscribers. With LIVE_CHANGE_STREAMS=1 (needs a
+replica set) a change stream on the counters wakes the watcher immediately
+for writes made by other workers and hosts too.
+
+Streams are cheap when idle: a bounded queue per connection, a comment line
+every HEARTBEAT_SECONDS, and no per-connection threads, so under a greenlet
+server (`gunicorn -k gevent`) a worker holds thousands of them. A client that
+cannot keep up gets a `resync` event (its queue is dropped) and refetches the
+grid from the ETag'd JSON API. Past LIVE_MAX_STREAMS per worker (by default 0
+unless the server runs on gevent greenlets), new streams get a 503 and the
+pages fall back to polling that API.
+"""
+import json
+import logging
+import os
+import queue
+import re
+import threading
+import time
+
+import availability
+import court_catalog
+import lesson_series
+import metrics
+import rollups
+import slot_search
+
+log = logging.getLogger(__name__)
+
+KINDS = ('courts', 'lessons')
+POLL_SECONDS = float(os.getenv('LIVE_POLL_SECONDS', '2'))
+HEARTBEAT_SECONDS = float(os.getenv('LIVE_HEARTBEAT_SECONDS', '15'))
+# Streams are closed after this long; EventSource reconnects on its own
+MAX_STREAM_SECONDS = float(os.getenv('LIVE_MAX_STREAM_SECONDS', '900'))
+QUEUE_SIZE = int(os.getenv('LIVE_QUEUE_SIZE', '64'))
+CHANGE_STREAMS = os.getenv('LIVE_CHANGE_STREAMS', '0') == '1'
+
+_DATE_RE = re.compile(r'^\d{4}-\d{2}-\d{2}$')
+
+
+def _greenlet_server():
+    try:
+        from gevent import monkey
+        return monkey.is_module_patched('socket')
+    except ImportError:
+        return False
+
+
+def max_streams():
+    """Per-worker stream limit.
+
+    Without greenlets every stream pins a server thread (or a whole sync
+    worker) for up to MAX_STREAM_SECONDS, so streaming is off by default there
+    and the pages poll; set LIVE_MAX_STREAMS to opt in on a threaded server
+    with threads to spare.
+    """
+    default = '2000' if _greenlet_server() else '0'
+    return int(os.getenv('LIVE_MAX_STREAMS', default))
+
+
+def court_state(db, date_str):
+    """{(court_id, time)} booked on a day."""
+    return {(b.get('court_id'), b.get('time'))
+            for b in db.court_bookings.find({'date': date_str, 'court_id': {'$in': court_catalog.get(db).ids()},
+                                             'status': {'$ne': 'cancelled'}},
+                                            {'court_id': 1, 'time': 1})}
+
+
+def lesson_state(db, date_str):
+    """{time: (offered, private, group)} for every lesson slot of a day."""
+    setting = db.schedule_settings.find_one({'date': date_str}, {'no_classes': 1, 'custom_time_slots': 1}) or {}
+    docs = rollups.load(db, date_str, date_str)
+    pending = lesson_series.expand_counts(db, date_str, date_str)
+    state = {}
+    for h in slot_search.LESSON_HOURS:
+        label = slot_search.lesson_label(h)
+        private, group = rollups.lesson_counts(docs[0] if docs else None, label)
+        extra = pending.get((date_str, f'{h:02d}:00'), {})
+        state[label] = (rollups.lesson_offered(setting, label), private + extra.get('private', 0), group + extra.get('group', 0))
+    return state
+
+
+def _lesson_open(slot):
+    offered, private, group = slot
+    return offered and rollups.lesson_open(private, group)
+
+
+def diff(kind, date_str, before, after):
+    """(event, data) deltas between two snapshots of a day."""
+    events = []
+    if kind == 'courts':
+        for court_id, time_label in sorted(after - before):
+            events.append(('slot-taken', {'date': date_str, 'court_id': court_id, 'time': time_label}))
+        for court_id, time_label in sorted(before - after):
+            events.append(('slot-freed', {'date': date_str, 'court_id': court_id, 'time': time_label}))
+        return events
+    for time_label, slot in after.items():
+        old = before.get(time_label)
+        if old == slot:
+            continue
+        data = {'date': date_str, 'time': time_label, 'offered': slot[0], 'private': bool(slot[1]), 'group': slot[2]}
+        if old is not None and _lesson_open(old) and not _lesson_open(slot):
+            events.append(('slot-taken', data))
+        elif old is not None and not _lesson_open(old) and _lesson_open(slot):
+            events.append(('slot-freed', data))
+        else:
+            events.append(('slot-changed', data))
+    return events
+
+
+class Subscriber:
+    def __init__(self, topic):
+        self.topic = topic
+        self.queue = queue.Queue(maxsize=QUEUE_SIZE)
+        self.ready = False
+
+    def push(self, event, data):
+        try:
+            self.queue.put_nowait((event, data))
+        except queue.Full:
+            # Back-pressure: drop what this client has not read and make it refetch instead
+            self._drain()
+            self.queue.put_nowait(('resync', {'date': self.topic[1]}))
+            metrics.live_events.inc('resync')
+
+    def _drain(self):
+        try:
+            while True:
+                self.queue.get_nowait()
+        except queue.Empty:
+            pass
+
+
+class Hub:
+    """Per-worker registry of streams and the watcher that feeds them."""
+
+    def __init__(self):
+        self.db = None
+        self._lock = threading.Lock()
+        self._topics = {}  # (kind, date) -> set of Subscriber
+        self._state = {}  # (kind, date) -> (version, snapshot)
+        self._dirty = set()
+        self._wake = threading.Event()
+        self._started = False
+
+    def count(self):
+        with self._lock:
+            return sum(len(subs) for subs in self._topics.values())
+
+    def subscribe(self, kind, date_str):
+        sub = Subscriber((kind, date_str))
+        with self._lock:
+            self._topics.setdefault(sub.topic, set()).add(sub)
+            if sub.topic in self._state:
+                # Deltas are already tracked from a snapshot: the page can resync now
+                sub.ready = True
+                sub.push('ready', {'date': date_str})
+            if not self._started:
+                self._started = True
+                threading.Thread(target=self._watch, name='live-watcher', daemon=True).start()
+                if CHANGE_STREAMS:
+                    threading.Thread(target=self._follow_changes, name='live-changes', daemon=True).start()
+        metrics.live_streams.inc()
+        self._wake.set()
+        return sub
+
+    def unsubscribe(self, sub):
+        with self._lock:
+            subs = self._topics.get(sub.topic)
+            if subs is not None:
+                subs.discard(sub)
+                if not subs:
+                    del self._topics[sub.topic]
+                    self._state.pop(sub.topic, None)
+        metrics.live_streams.dec()
+
+    def notify(self, kind, days):
+        """A write in this process changed `kind` availability on `days`."""
+        with self._lock:
+            hit = [(kind, d) for d in days if (kind, d) in self._topics]
+            self._dirty.update(hit)
+        if hit:
+            self._wake.set()
+
+    def _watch(self):
+        while True:
+            self._wake.wait(POLL_SECONDS)
+            self._wake.clear()
+            try:
+                self._refresh()
+            except Exception as e:
+                log.warning('live availability refresh failed: %s', e)
+                time.sleep(POLL_SECONDS)
+
+    def _refresh(self):
+        with self._lock:
+            topics = list(self._topics)
+            dirty, self._dirty = self._dirty, set()
+        if not topics:
+            return
+        # One query for the counters of every watched date
+        days = sorted({d for _kind, d in topics})
+        versions = {doc['_id']: doc for doc in self.db[availability.COLLECTION].find({'_id': {'$in': days}})}
+        for topic in topics:
+            kind, date_str = topic
+            version = versions.get(date_str, {}).get(kind, 0)
+            previous = self._state.get(topic)
+            if previous is not None and previous[0] == version and topic not in dirty:
+                continue
+            snapshot = court_state(self.db, date_str) if kind == 'courts' else lesson_state(self.db, date_str)
+            if previous is not None:
+                # First snapshot of a topic has nothing to diff against; its subscribers get `ready`
+                for event, data in diff(kind, date_str, previous[1], snapshot):
+                    metrics.live_events.inc(event)
+                    with self._lock:
+                        subs = list(self._topics.get(topic, ()))
+                    for sub in subs:
+                        sub.push(event, data)
+            with self._lock:
+                if topic in self._topics:
+                    self._state[topic] = (version, snapshot)
+                    for sub in self._topics[topic]:
+                        if not sub.ready:
+                            sub.ready = True
+                            sub.push('ready', {'date': date_str})
+
+    def _follow_changes(self):
+        try:
+            with self.db[availability.COLLECTION].watch() as stream:
+                for change in stream:
+                    day = (change.get('documentKey') or {}).get('_id')
+                    if day:
+                        for kind in KINDS:
+                            self.notify(kind, [day])
+        except Exception as e:
+            log.warning('availability change stream unavailable, polling every %ss: %s', POLL_SECONDS, e)
+
+
+hub = Hub()
+
+
+def _format(event, data):
+    return f'event: {event}\ndata: {json.dumps(data, separators=(",", ":"))}\n\n'
+
+
+def init_app(app, mongo):
+    """Register /live/availability and feed the hub from this process's availability bumps."""
+    from flask import Response, jsonify, request, session
+
+    hub.db = mongo.db
+    availability.on_change(hub.notify)
+    limit = max_streams()
+
+    @app.route('/live/availability')
+    def live_availability():
+        kind = request.args.get('kind', 'courts')
+        date_str = request.args.get('date', '')
+        if kind not in KINDS or not _DATE_RE.match(date_str):
+            return jsonify({'error': 'kind must be courts or lessons and date YYYY-MM-DD'}), 400
+        if kind == 'lessons' and 'user_id' not in session:
+            return jsonify({'error': 'login required'}), 401
+        if hub.count() >= limit:
+            resp = jsonify({'error': 'too many live streams, poll instead' if limit else 'live streams are off, poll instead'})
+            resp.status_code = 503
+            resp.headers['Retry-After'] = '60'
+            return resp
+
+        def stream():
+            sub = hub.subscribe(kind, date_str)
+            try:
+                # `ready` (sent once deltas are tracked) tells the page to resync anything that
+                # changed since it rendered; retry slows down reconnects
+                yield 'retry: 5000\n\n'
+                deadline = time.monotonic() + MAX_STREAM_SECONDS
+                while time.monotonic() < deadline:
+                    try:
+                        event, data = sub.queue.get(timeout=HEARTBEAT_SECONDS)
+                    except queue.Empty:
+                        yield ': ping\n\n'
+                        continue
+                    yield _format(event, data)
+            finally:
+                hub.unsubscribe(sub)
+
+        resp = Response(stream(), mimetype='text/event-stream')
+        resp.headers['Cache-Control'] = 'no-cache'
+        resp.headers['X-Accel-Buffering'] = 'no'  # nginx: do not buffer the stream
+        return resp
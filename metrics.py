@@ -0,0 +1,461 @@
+"""In-process metrics registry exposed in Prometheus text format at /metrics.
+
+Each worker keeps its own counters/histograms in memory (a dict update under a
+lock per observation, so the per-request overhead is a few microseconds).
+When METRICS_DIR is set, every worker periodically dumps a snapshot of its
+registry into that directory and /metrics merges the snapshots of all workers,
+so a scrape of any gunicorn worker returns the totals for the whole host.
+"""
+import hmac
+import json
+import logging
+import os
+import re
+import threading
+import time
+from bisect import bisect_left
+
+from flask import Response, abort, g, request
+
+log = logging.getLogger(__name__)
+
+# Latency buckets in seconds; tuned for web requests and DB round trips
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+METRICS_DIR = os.getenv('METRICS_DIR')
+METRICS_FLUSH_SECONDS = float(os.getenv('METRICS_FLUSH_SECONDS', 5))
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def snapshot(self):
+        with self._lock:
+            return {'|'.join(k): self._copy(v) for k, v in self._values.items()}
+
+    def _copy(self, value):
+        return value
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def inc(self, *labelvalues, amount=1):
+        key = tuple(str(v) for v in labelvalues)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    """Gauge whose per-worker values are summed across live workers."""
+    kind = 'gauge'
+
+    def inc(self, *labelvalues, amount=1):
+        key = tuple(str(v) for v in labelvalues)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, *labelvalues, amount=1):
+        self.inc(*labelvalues, amount=-amount)
+
+    def set(self, value, *labelvalues):
+        key = tuple(str(v) for v in labelvalues)
+        with self._lock:
+            self._values[key] = value
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, *labelvalues):
+        key = tuple(str(v) for v in labelvalues)
+        # Index of the first bucket whose upper bound is >= value (len(buckets) == +Inf)
+        idx = bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            entry[0][idx] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    def _copy(self, value):
+        return [list(value[0]), value[1], value[2]]
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _register(self, metric):
+        with self._lock:
+            existing = self._metrics.get(metric.name)
+            if existing is not None:
+                return existing
+            self._metrics[metric.name] = metric
+            return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name, documentation, labelnames=()):
+        return self._register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def get(self, name):
+        return self._metrics.get(name)
+
+    def snapshot(self):
+        """Plain-JSON view of every metric, used for cross-worker merging."""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return {m.name: {'kind': m.kind, 'values': m.snapshot()} for m in metrics}
+
+
+registry = Registry()
+
+http_request_duration = registry.histogram(
+    'primecourt_http_request_duration_seconds',
+    'Time spent handling a request, by Flask endpoint, method and status.',
+    ('endpoint', 'method', 'status'))
+mongo_command_duration = registry.histogram(
+    'primecourt_mongo_command_duration_seconds',
+    'MongoDB command latency by command name and collection.',
+    ('command', 'collection'))
+mongo_command_failures = registry.counter(
+    'primecourt_mongo_command_failures_total',
+    'MongoDB commands that returned an error.',
+    ('command', 'collection'))
+stripe_request_duration = registry.histogram(
+    'primecourt_stripe_request_duration_seconds',
+    'Stripe API call latency by HTTP method and normalized path.',
+    ('method', 'path', 'status'))
+mail_queue_depth = registry.gauge(
+    'primecourt_mail_queue_depth',
+    'Emails queued or currently being sent by background threads.')
+mail_send_duration = registry.histogram(
+    'primecourt_mail_send_duration_seconds',
+    'Time to deliver one email over SMTP, by outcome.',
+    ('outcome',))
+page_cache_requests = registry.counter(
+    'primecourt_page_cache_requests_total',
+    'Cacheable page/fragment renders by name and outcome (hit, miss, bypass).',
+    ('name', 'outcome'))
+page_cache_invalidations = registry.counter(
+    'primecourt_page_cache_invalidations_total',
+    'Page cache version bumps by namespace kind.',
+    ('namespace',))
+live_streams = registry.gauge(
+    'primecourt_live_streams',
+    'Open Server-Sent Events availability streams.')
+live_events = registry.counter(
+    'primecourt_live_events_total',
+    'Availability events pushed to SSE streams, by event type.',
+    ('event',))
+compression_input_bytes = registry.counter(
+    'primecourt_compression_input_bytes_total',
+    'Response bytes before compression, by endpoint and content coding.',
+    ('endpoint', 'encoding'))
+compression_output_bytes = registry.counter(
+    'primecourt_compression_output_bytes_total',
+    'Response bytes sent after compression, by endpoint and content coding.',
+    ('endpoint', 'encoding'))
+compression_cpu = registry.histogram(
+    'primecourt_compression_cpu_seconds',
+    'CPU time spent compressing one response, by endpoint and content coding.',
+    ('endpoint', 'encoding'),
+    buckets=(0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1))
+template_render_duration = registry.histogram(
+    'primecourt_template_render_duration_seconds',
+    'Time spent in render_template(), by template.',
+    ('template',))
+compression_skipped = registry.counter(
+    'primecourt_compression_skipped_total',
+    'Responses sent uncompressed, by reason (not-accepted, type, encoded, small, ...).',
+    ('reason',))
+
+
+# --- Cross-worker aggregation -------------------------------------------------
+
+_flusher_pid = None
+
+
+def _snapshot_path(pid):
+    return os.path.join(METRICS_DIR, f'worker-{pid}.json')
+
+
+def _write_snapshot():
+    data = {'pid': os.getpid(), 'written_at': time.time(), 'metrics': registry.snapshot()}
+    path = _snapshot_path(os.getpid())
+    tmp = path + '.tmp'
+    with open(tmp, 'w') as fh:
+        json.dump(data, fh)
+    os.replace(tmp, path)
+
+
+def _flush_loop():
+    while True:
+        time.sleep(METRICS_FLUSH_SECONDS)
+        try:
+            _write_snapshot()
+        except Exception as e:
+            log.warning('could not write metrics snapshot: %s', e)
+
+
+def _ensure_flusher():
+    """Start the snapshot thread once per process (re-checked after fork)."""
+    global _flusher_pid
+    if not METRICS_DIR or _flusher_pid == os.getpid():
+        return
+    _flusher_pid = os.getpid()
+    try:
+        os.makedirs(METRICS_DIR, exist_ok=True)
+    except Exception as e:
+        log.error('cannot create METRICS_DIR %s: %s', METRICS_DIR, e)
+        return
+    threading.Thread(target=_flush_loop, name='metrics-flush', daemon=True).start()
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+        return True
+    except ProcessLookupError:
+        return False
+    except Exception:
+        return True
+
+
+def _merged_snapshot():
+    """Merge this worker's live registry with the other workers' snapshots.
+
+    Counters and histograms from exited workers are kept (they are cumulative,
+    like Prometheus multiprocess mode); gauges only count live workers.
+    """
+    merged = registry.snapshot()
+    if not METRICS_DIR or not os.path.isdir(METRICS_DIR):
+        return merged
+    me = os.getpid()
+    for fname in os.listdir(METRICS_DIR):
+        if not (fname.startswith('worker-') and fname.endswith('.json')):
+            continue
+        try:
+            with open(os.path.join(METRICS_DIR, fname)) as fh:
+                data = json.load(fh)
+        except Exception:
+            continue
+        pid = data.get('pid')
+        if pid == me:
+            continue
+        alive = _pid_alive(pid)
+        for name, metric in data.get('metrics', {}).items():
+            kind = metric.get('kind')
+            if kind == 'gauge' and not alive:
+                continue
+            target = merged.setdefault(name, {'kind': kind, 'values': {}})['values']
+            for key, value in metric.get('values', {}).items():
+                if key not in target:
+                    target[key] = value
+                elif kind == 'histogram':
+                    cur = target[key]
+                    cur[0] = [a + b for a, b in zip(cur[0], value[0])]
+                    cur[1] += value[1]
+                    cur[2] += value[2]
+                else:
+                    target[key] += value
+    return merged
+
+
+# --- Prometheus text exposition ---------------------------------------------
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _label_str(labelnames, key, extra=None):
+    values = key.split('|') if labelnames else []
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(labelnames, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _fmt(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def render_prometheus():
+    merged = _merged_snapshot()
+    lines = []
+    for name in sorted(merged):
+        metric = registry.get(name)
+        if metric is None:
+            continue
+        lines.append(f'# HELP {name} {metric.documentation}')
+        lines.append(f'# TYPE {name} {metric.kind}')
+        for key, value in sorted(merged[name]['values'].items()):
+            if metric.kind == 'histogram':
+                counts, total, count = value
+                running = 0
+                for bound, c in zip(list(metric.buckets) + [float('inf')], counts):
+                    running += c
+                    le = _label_str(metric.labelnames, key, f'le="{_fmt(bound)}"')
+                    lines.append(f'{name}_bucket{le} {running}')
+                labels = _label_str(metric.labelnames, key)
+                lines.append(f'{name}_sum{labels} {_fmt(total)}')
+                lines.append(f'{name}_count{labels} {count}')
+            else:
+                lines.append(f'{name}{_label_str(metric.labelnames, key)} {_fmt(value)}')
+    return '\n'.join(lines) + '\n'
+
+
+# --- MongoDB and Stripe instrumentation -------------------------------------
+
+def _command_collection(command_name, command):
+    """Best-effort collection name for a MongoDB command document."""
+    target = command.get(command_name)
+    if isinstance(target, str):
+        return target
+    # getMore carries the collection in a separate field
+    return command.get('collection') or '-'
+
+
+try:
+    from pymongo import monitoring as _pymongo_monitoring
+
+    class MongoCommandListener(_pymongo_monitoring.CommandListener):
+        """Times every command sent by any MongoClient created after install."""
+
+        def __init__(self):
+            self._pending = {}
+
+        def started(self, event):
+            key = (event.request_id, event.connection_id)
+            self._pending[key] = _command_collection(event.command_name, event.command)
+
+        def succeeded(self, event):
+            collection = self._pending.pop((event.request_id, event.connection_id), '-')
+            mongo_command_duration.observe(event.duration_micros / 1e6, event.command_name, collection)
+
+        def failed(self, event):
+            collection = self._pending.pop((event.request_id, event.connection_id), '-')
+            mongo_command_duration.observe(event.duration_micros / 1e6, event.command_name, collection)
+            mongo_command_failures.inc(event.command_name, collection)
+except ImportError:
+    _pymongo_monitoring = None
+    MongoCommandListener = None
+
+
+_mongo_listener_installed = False
+
+
+def install_mongo_listener():
+    """Register the command listener globally; call before creating MongoClients."""
+    global _mongo_listener_installed
+    if _mongo_listener_installed or MongoCommandListener is None:
+        return
+    _pymongo_monitoring.register(MongoCommandListener())
+    _mongo_listener_installed = True
+
+
+# Stripe object ids look like cs_test_a1B2..., pi_3Nx..., sub_1Nx...
+_STRIPE_ID_RE = re.compile(r'^[a-z]{2,5}_[A-Za-z0-9_]{6,}$')
+
+
+def stripe_path_label(url):
+    """Normalize a Stripe API URL to a low-cardinality label like /v1/checkout/sessions/{id}."""
+    path = url.split('://', 1)[-1]
+    path = path[path.find('/'):] if '/' in path else '/'
+    path = path.split('?', 1)[0]
+    return '/'.join('{id}' if _STRIPE_ID_RE.match(seg) else seg for seg in path.split('/'))
+
+
+class TimedStripeClient:
+    """Wraps a stripe HTTP client and records the latency of every API call."""
+
+    def __init__(self, client):
+        self._client = client
+
+    def __getattr__(self, name):
+        return getattr(self._client, name)
+
+    def _timed(self, fn, method, url, *args, **kwargs):
+        start = time.perf_counter()
+        status = 'error'
+        try:
+            result = fn(method, url, *args, **kwargs)
+            try:
+                status = str(result[1])
+            except Exception:
+                status = 'ok'
+            return result
+        finally:
+            stripe_request_duration.observe(time.perf_counter() - start, method.upper(), stripe_path_label(url), status)
+
+    def request_with_retries(self, method, url, *args, **kwargs):
+        return self._timed(self._client.request_with_retries, method, url, *args, **kwargs)
+
+    def request_stream_with_retries(self, method, url, *args, **kwargs):
+        return self._timed(self._client.request_stream_with_retries, method, url, *args, **kwargs)
+
+
+def install_stripe_client(stripe_module):
+    """Route all stripe-python API calls through TimedStripeClient."""
+    client = getattr(stripe_module, 'default_http_client', None)
+    if isinstance(client, TimedStripeClient):
+        return
+    if client is None:
+        client = stripe_module.new_default_http_client(
+            verify_ssl_certs=getattr(stripe_module, 'verify_ssl_certs', True),
+            proxy=getattr(stripe_module, 'proxy', None))
+    stripe_module.default_http_client = TimedStripeClient(client)
+
+
+# --- Flask integration ------------------------------------------------------
+
+def init_app(app):
+    """Install request timing hooks and the /metrics endpoint on `app`.
+
+    Set METRICS_TOKEN to require `Authorization: Bearer <token>` on scrapes
+    (the header only, so the token stays out of access logs); leave it unset
+    for a private network scrape target.
+    """
+    token = os.getenv('METRICS_TOKEN')
+
+    @app.before_request
+    def _metrics_start_timer():
+        _ensure_flusher()
+        g._metrics_start = time.perf_counter()
+
+    @app.after_request
+    def _metrics_record_request(response):
+        start = g.pop('_metrics_start', None)
+        if start is not None:
+            endpoint = request.endpoint or 'unmatched'
+            http_request_duration.observe(time.perf_counter() - start, endpoint, request.method, response.status_code)
+        return response
+
+    def metrics_endpoint():
+        if token:
+            scheme, _, supplied = request.headers.get('Authorization', '').partition(' ')
+            if scheme.lower() != 'bearer' or not hmac.compare_digest(supplied.strip().encode(), token.encode()):
+                abort(401)
+        return Response(render_prometheus(), mimetype='text/plain; version=0.0.4; charset=utf-8')
+
+    app.add_url_rule('/metrics', 'metrics', metrics_endpoint)
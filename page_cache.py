@@ -0,0 +1,163 @@
+"""Rendered HTML cache for the public pages, invalidated by writes.
+
+`/`, `/coaches` and `/coaches/<id>` are the same for every anonymous visitor
+and change only when a coach edits their profile or a booking lands, so their
+rendered HTML is kept in each worker's memory. Entries are keyed by
+endpoint, view args, query string and the current *version* of the
+namespaces the page depends on:
+
+    'coaches'        -> every coach list (profile edits, promotions, photos)
+    'coach:<id>'     -> one coach's profile (availability, their bookings)
+
+A write calls `invalidate(db, namespace)`, which bumps a counter in the
+`cache_versions` collection. Every worker reads those counters at most once
+per VERSION_TTL seconds, so after a write the other workers serve the old page
+for at most that long; the writing worker sees the change immediately. TTL
+bounds the age of any entry regardless (pages also show "upcoming" data).
+
+Only anonymous GETs without pending flash messages are cached; the navbar
+differs per logged-in user. Set PAGE_CACHE=0 to turn the cache off.
+"""
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+
+from pymongo import ReturnDocument
+
+import metrics
+
+log = logging.getLogger(__name__)
+
+COLLECTION = 'cache_versions'
+ENABLED = os.getenv('PAGE_CACHE', '1') != '0'
+TTL = float(os.getenv('PAGE_CACHE_TTL', '300'))
+VERSION_TTL = float(os.getenv('PAGE_CACHE_VERSION_TTL', '2'))
+MAX_ENTRIES = int(os.getenv('PAGE_CACHE_MAX_ENTRIES', '500'))
+
+_lock = threading.Lock()
+_entries = OrderedDict()  # key -> (expires_at, value), least recently used first
+_versions = {}  # namespace -> (version, checked_at)
+_mongo = None
+
+
+def versions(db, namespaces):
+    """Current version of each namespace, re-read from Mongo at most every VERSION_TTL seconds."""
+    now = time.monotonic()
+    stale = [ns for ns in namespaces if ns not in _versions or now - _versions[ns][1] > VERSION_TTL]
+    if stale:
+        try:
+            found = {d['_id']: d.get('v', 0) for d in db[COLLECTION].find({'_id': {'$in': stale}})}
+        except Exception as e:
+            # Without the counters we cannot tell if an entry is current
+            log.warning('could not read cache versions: %s', e)
+            return None
+        with _lock:
+            for ns in stale:
+                _versions[ns] = (found.get(ns, 0), now)
+    return tuple(_versions[ns][0] for ns in namespaces)
+
+
+def invalidate(db, *namespaces):
+    """Bump the given namespaces so every worker stops serving pages rendered before this write."""
+    for ns in namespaces:
+        metrics.page_cache_invalidations.inc(ns.split(':', 1)[0])
+        try:
+            doc = db[COLLECTION].find_one_and_update({'_id': ns}, {'$inc': {'v': 1}}, upsert=True,
+                                                     return_document=ReturnDocument.AFTER)
+        except Exception as e:
+            # Stale pages then live until TTL at most; never fail the write over it
+            log.warning('page cache invalidation of %s failed: %s', ns, e)
+            continue
+        with _lock:
+            _versions[ns] = (doc['v'], time.monotonic())
+
+
+def booking_changed(db, booking):
+    """Invalidate the profile of the coach a lesson booking belongs to (if any)."""
+    if booking.get('coach_id'):
+        invalidate(db, f"coach:{booking['coach_id']}")
+
+
+def _get(key):
+    with _lock:
+        entry = _entries.get(key)
+        if entry is None:
+            return None
+        if entry[0] < time.monotonic():
+            del _entries[key]
+            return None
+        _entries.move_to_end(key)
+        return entry[1]
+
+
+def _put(key, value):
+    with _lock:
+        _entries[key] = (time.monotonic() + TTL, value)
+        _entries.move_to_end(key)
+        while len(_entries) > MAX_ENTRIES:
+            _entries.popitem(last=False)
+
+
+def fragment(db, name, key_parts, namespaces, render):
+    """`render()` output cached under (name, key_parts) until a namespace is invalidated."""
+    current = versions(db, namespaces) if ENABLED else None
+    if current is None:
+        metrics.page_cache_requests.inc(name, 'bypass')
+        return render()
+    key = (name, key_parts, current)
+    value = _get(key)
+    if value is not None:
+        metrics.page_cache_requests.inc(name, 'hit')
+        return value
+    metrics.page_cache_requests.inc(name, 'miss')
+    value = render()
+    _put(key, value)
+    return value
+
+
+def page(namespaces):
+    """Cache a view's 200 responses for anonymous visitors.
+
+    `namespaces` is a list, or a callable taking the view args and returning
+    one (e.g. `lambda coach_id: ['coaches', f'coach:{coach_id}']`).
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(**kwargs):
+            from flask import make_response, request, session
+
+            name = request.endpoint or view.__name__
+            if (not ENABLED or _mongo is None or request.method != 'GET'
+                    or session.get('user_id') or session.get('_flashes')):
+                metrics.page_cache_requests.inc(name, 'bypass')
+                return view(**kwargs)
+            deps = namespaces(**kwargs) if callable(namespaces) else namespaces
+            current = versions(_mongo.db, deps)
+            if current is None:
+                metrics.page_cache_requests.inc(name, 'bypass')
+                return view(**kwargs)
+            key = (name, tuple(sorted(kwargs.items())), tuple(sorted(request.args.items(multi=True))), current)
+            cached = _get(key)
+            if cached is not None:
+                metrics.page_cache_requests.inc(name, 'hit')
+                resp = make_response(cached[0])
+                resp.mimetype = cached[1]
+                return resp
+            metrics.page_cache_requests.inc(name, 'miss')
+            resp = make_response(view(**kwargs))
+            # Redirects and errors (which usually flash) are never cached
+            if resp.status_code == 200 and not resp.direct_passthrough and not session.get('_flashes'):
+                _put(key, (resp.get_data(), resp.mimetype))
+            return resp
+        return wrapper
+    return decorator
+
+
+def init_app(app, mongo):
+    """Give the page decorator its database (for the version counters)."""
+    global _mongo
+    _mongo = mongo
+    log.info('page cache %s (ttl %ss, version check every %ss)', 'on' if ENABLED else 'off', TTL, VERSION_TTL)
@@ -0,0 +1,107 @@
+"""Keyset (range-based) pagination over MongoDB cursors.
+
+Pages are addressed by the sort-key values of the row at their edge instead of
+by a skip offset, so fetching page 200 costs the same index range scan as page
+1. Cursors are opaque URL-safe tokens; a tampered or stale token just yields
+the first page.
+
+    docs, next_cursor, prev_cursor = keyset_page(
+        mongo.db.users, {'role': 'coach'}, [('_id', -1)], limit=50,
+        after=request.args.get('after'), before=request.args.get('before'))
+
+The last sort key must be unique (normally `_id`) so every row has exactly one
+position.
+"""
+import base64
+from datetime import datetime
+
+from bson import json_util
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+
+def page_size(value, default=DEFAULT_PAGE_SIZE, maximum=MAX_PAGE_SIZE):
+    """Clamp a requested page size (e.g. from ?per_page=) to 1..maximum."""
+    try:
+        size = int(value)
+    except (TypeError, ValueError):
+        return default
+    return max(1, min(size, maximum))
+
+
+def encode_cursor(values):
+    raw = json_util.dumps(values).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def decode_cursor(token):
+    """Sort-key values from a cursor token, or None if it is missing or invalid."""
+    if not token:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+        values = json_util.loads(raw.decode('utf-8'))
+    except Exception:
+        return None
+    return values if isinstance(values, list) else None
+
+
+def _after(field, value, direction):
+    """Condition for `field` strictly past `value` in the given sort direction."""
+    cond = {field: {'$gt' if direction == 1 else '$lt': value}}
+    # Legacy documents mix 'YYYY-MM-DD' strings and datetimes in date fields.
+    # BSON orders every string before every date, but a $gt/$lt only matches
+    # its own type, so moving past a string also has to take in all dates
+    # (and moving backwards past a date, all strings).
+    if isinstance(value, str) and direction == 1:
+        return {'$or': [cond, {field: {'$type': 'date'}}]}
+    if isinstance(value, datetime) and direction == -1:
+        return {'$or': [cond, {field: {'$type': 'string'}}]}
+    return cond
+
+
+def _keyset_filter(sort, values):
+    clauses = []
+    for i, (field, direction) in enumerate(sort):
+        clause = {f: v for (f, _), v in zip(sort[:i], values[:i])}
+        clause.update(_after(field, values[i], direction))
+        clauses.append(clause)
+    return {'$or': clauses}
+
+
+def _cursor_for(doc, sort):
+    return encode_cursor([doc.get(field) for field, _ in sort])
+
+
+def keyset_page(collection, query, sort, limit, after=None, before=None, projection=None):
+    """Fetch one page; returns (docs, next_cursor, prev_cursor).
+
+    `after` continues forward from a next_cursor, `before` goes back from a
+    prev_cursor. Cursors are None when there is no page in that direction.
+    """
+    values = decode_cursor(before) or decode_cursor(after)
+    backwards = bool(before) and decode_cursor(before) is not None
+    if values is not None and len(values) != len(sort):
+        values, backwards = None, False
+
+    effective_sort = [(f, -d) for f, d in sort] if backwards else list(sort)
+    if values is not None:
+        keyset = _keyset_filter(effective_sort, values)
+        query = {'$and': [query, keyset]} if query else keyset
+
+    docs = list(collection.find(query, projection).sort(effective_sort).limit(limit + 1))
+    has_more = len(docs) > limit
+    docs = docs[:limit]
+    if backwards:
+        docs.reverse()
+    if not docs:
+        return docs, None, None
+
+    if backwards:
+        next_cursor = _cursor_for(docs[-1], sort)
+        prev_cursor = _cursor_for(docs[0], sort) if has_more else None
+    else:
+        next_cursor = _cursor_for(docs[-1], sort) if has_more else None
+        prev_cursor = _cursor_for(docs[0], sort) if values is not None else None
+    return docs, next_cursor, prev_cursor
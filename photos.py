@@ -0,0 +1,194 @@
+"""Coach photo uploads: content-addressed storage plus resized JPEG/WebP variants.
+
+An upload is streamed to a temp file while it is hashed, then saved to the
+upload storage (storage.py) as
+
+    coach_photos/<sha256[:20]>/original.<ext>
+
+so the same photo uploaded twice is stored once. Resizing runs on a small
+worker pool off the request thread and writes `<size>.jpg` / `<size>.webp`
+next to the original for each of VARIANTS, then records them on every user
+whose picture is that photo:
+
+    'picture': 'uploads/coach_photos/3b1f.../original.jpg',
+    'photo_variants': {'thumb': 160, 'card': 480, 'full': 1200},
+
+Templates render these through templates/_photo.html (a <picture> with WebP
+and JPEG srcsets); until the variants exist they fall back to the original.
+Content-addressed files never change, so they are served with an immutable
+Cache-Control.
+
+Everything goes through the storage backend, so this works the same on local
+disk and on S3. Variants need Pillow; without it uploads are still deduplicated but served
+as uploaded. `flask --app app process-coach-photos` moves legacy uploads into
+this layout and (re)builds missing variants.
+"""
+import hashlib
+import logging
+import os
+import re
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+import page_cache
+import storage
+
+log = logging.getLogger(__name__)
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # optional; variants are skipped without it
+    Image = ImageOps = None
+
+KEY_PREFIX = 'coach_photos'
+UPLOAD_DIR = storage.path_for(KEY_PREFIX)
+# Longest edge in pixels per variant
+VARIANTS = {'thumb': 160, 'card': 480, 'full': 1200}
+ALLOWED_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.webp', '.gif'}
+MAX_UPLOAD_BYTES = int(os.getenv('MAX_PHOTO_UPLOAD_BYTES', str(15 * 1024 * 1024)))
+CHUNK = 64 * 1024
+IMMUTABLE = 'public, max-age=31536000, immutable'
+
+# Served from /uploads/ (storage.py) or, for older links, /static/uploads/
+_ADDRESSED = re.compile(r'^(/static)?/' + re.escape(UPLOAD_DIR) + r'/[0-9a-f]{20}/')
+_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='photos')
+
+
+class PhotoError(ValueError):
+    """The upload cannot be stored (too large or not an image type we accept)."""
+
+
+def store(backend, stream, filename):
+    """Stream an upload into content-addressed storage; returns (key, 'uploads/...' path).
+
+    Raises PhotoError for disallowed extensions or uploads over MAX_UPLOAD_BYTES.
+    """
+    ext = os.path.splitext(filename or '')[1].lower()
+    if ext not in ALLOWED_EXTENSIONS:
+        raise PhotoError(f'Unsupported image type {ext or "(none)"}')
+    ext = '.jpg' if ext == '.jpeg' else ext
+
+    digest = hashlib.sha256()
+    size = 0
+    # The key is only known once the whole upload is hashed, so spool it locally first
+    with tempfile.TemporaryFile() as tmp:
+        while True:
+            chunk = stream.read(CHUNK)
+            if not chunk:
+                break
+            size += len(chunk)
+            if size > MAX_UPLOAD_BYTES:
+                raise PhotoError('Photo is too large')
+            digest.update(chunk)
+            tmp.write(chunk)
+        key = digest.hexdigest()[:20]
+        object_key = f'{KEY_PREFIX}/{key}/original{ext}'
+        if not backend.exists(object_key):  # else already stored: dedupe
+            tmp.seek(0)
+            backend.save(object_key, tmp, cache_control=IMMUTABLE)
+    return key, storage.path_for(object_key)
+
+
+def make_variants(backend, key, original):
+    """Write the JPEG and WebP variants of a stored photo; returns {name: edge} or None."""
+    if Image is None:
+        return None
+    made = {}
+    with backend.open(storage.key_for(original)) as src, Image.open(src) as img:
+        img = ImageOps.exif_transpose(img)
+        if img.mode in ('RGBA', 'LA', 'P'):
+            # Flatten transparency onto white; JPEG has no alpha channel
+            rgba = img.convert('RGBA')
+            img = Image.new('RGB', rgba.size, (255, 255, 255))
+            img.paste(rgba, mask=rgba.getchannel('A'))
+        elif img.mode not in ('RGB', 'L'):
+            img = img.convert('RGB')
+        for name, edge in VARIANTS.items():
+            for fmt, ext, options in (('JPEG', 'jpg', {'quality': 82, 'optimize': True, 'progressive': True}),
+                                      ('WEBP', 'webp', {'quality': 80, 'method': 6})):
+                variant_key = f'{KEY_PREFIX}/{key}/{name}.{ext}'
+                if backend.exists(variant_key):
+                    continue
+                copy = img.copy()
+                copy.thumbnail((edge, edge), Image.LANCZOS)
+                buf = BytesIO()
+                copy.save(buf, fmt, **options)
+                buf.seek(0)
+                backend.save(variant_key, buf, cache_control=IMMUTABLE)
+            made[name] = edge
+    return made
+
+
+def _process(db, backend, key, original):
+    try:
+        variants = make_variants(backend, key, original)
+    except Exception as e:
+        log.warning('could not build variants for photo %s: %s', key, e)
+        return
+    if variants:
+        db.users.update_many({'picture': original}, {'$set': {'photo_variants': variants}})
+        page_cache.invalidate(db, 'coaches')
+
+
+def process_async(db, backend, key, original):
+    """Build the variants on the worker pool and record them on the users showing this photo."""
+    return _executor.submit(_process, db, backend, key, original)
+
+
+def srcset(picture, variants, fmt):
+    """(static filename, width) of each variant of a stored photo in one format, smallest first."""
+    base = picture.rsplit('/', 1)[0]
+    return [(f'{base}/{name}.{fmt}', edge) for name, edge in sorted(variants.items(), key=lambda kv: kv[1])]
+
+
+def init_app(app, mongo):
+    """Register the `process-coach-photos` CLI command and immutable caching for stored photos."""
+    import click
+    from flask import request
+
+    @app.template_global('photo_srcset')
+    def photo_srcset(picture, variants, fmt='jpg'):
+        upload_url = app.jinja_env.globals['upload_url']
+        return ', '.join(f'{upload_url(f)} {w}w' for f, w in srcset(picture, variants, fmt))
+
+    @app.after_request
+    def _cache_photos(resp):
+        if resp.status_code == 200 and _ADDRESSED.match(request.path):
+            resp.headers['Cache-Control'] = IMMUTABLE
+        return resp
+
+    @app.cli.command('process-coach-photos')
+    @click.option('--delete-orphans', is_flag=True, help='remove legacy upload files no user references any more')
+    def process_coach_photos(delete_orphans):
+        """Move legacy coach photos into content-addressed storage and build missing variants."""
+        backend = storage.get()
+        moved = built = 0
+        for user in mongo.db.users.find({'picture': {'$regex': '^' + re.escape(UPLOAD_DIR) + '/'}},
+                                        {'picture': 1, 'photo_variants': 1}):
+            picture = user['picture']
+            if not backend.exists(storage.key_for(picture)):
+                log.warning('photo %s for user %s is missing', picture, user['_id'])
+                continue
+            if not re.match(re.escape(UPLOAD_DIR) + r'/[0-9a-f]{20}/original\.', picture):
+                with backend.open(storage.key_for(picture)) as f:
+                    key, picture = store(backend, f, picture)
+                mongo.db.users.update_one({'_id': user['_id']}, {'$set': {'picture': picture},
+                                                                 '$unset': {'photo_variants': ''}})
+                moved += 1
+            else:
+                key = picture.split('/')[-2]
+            if not user.get('photo_variants') or picture != user['picture']:
+                _process(mongo.db, backend, key, picture)
+                built += 1
+        print(f'Moved {moved} photo(s), built variants for {built}.')
+
+        if delete_orphans:
+            referenced = set(mongo.db.users.distinct('picture'))
+            removed = 0
+            for object_key in list(backend.keys(KEY_PREFIX + '/')):
+                # Only legacy files sit directly in coach_photos/; hashed ones are shared and kept
+                if '/' not in object_key[len(KEY_PREFIX) + 1:] and storage.path_for(object_key) not in referenced:
+                    backend.delete(object_key)
+                    removed += 1
+            print(f'Removed {removed} unreferenced legacy file(s).')
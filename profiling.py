@@ -0,0 +1,170 @@
+"""On-demand request profiler for admins.
+
+An admin adds `?_profile=1` (or sends `X-Profile: 1`) to any request and it is
+run under a lightweight sampling profiler: a background thread snapshots the
+request thread's Python stack every PROFILE_SAMPLE_INTERVAL seconds. The
+result is stored as collapsed stacks ("a;b;c 12" per line), the format read by
+flamegraph.pl, speedscope and inferno, together with the time spent rendering
+each Jinja template. Only the slowest PROFILE_BUFFER_SIZE profiles are kept.
+"""
+import heapq
+import itertools
+import os
+import sys
+import threading
+import time
+import uuid
+from datetime import datetime
+
+from flask import before_render_template, g, request, session, template_rendered
+
+PROFILE_SAMPLE_INTERVAL = float(os.getenv('PROFILE_SAMPLE_INTERVAL', 0.001))
+PROFILE_BUFFER_SIZE = int(os.getenv('PROFILE_BUFFER_SIZE', 20))
+
+
+class StackSampler(threading.Thread):
+    """Samples one thread's stack until stopped and aggregates collapsed stacks."""
+
+    def __init__(self, thread_id, interval=PROFILE_SAMPLE_INTERVAL):
+        super().__init__(name='profile-sampler', daemon=True)
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = {}
+        self.samples = 0
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            parts = []
+            while frame is not None:
+                code = frame.f_code
+                parts.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                frame = frame.f_back
+            key = ';'.join(reversed(parts))
+            self.stacks[key] = self.stacks.get(key, 0) + 1
+            self.samples += 1
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+
+class SlowestProfiles:
+    """Keeps the N slowest profiles (min-heap on duration)."""
+
+    def __init__(self, size=PROFILE_BUFFER_SIZE):
+        self.size = size
+        self._heap = []
+        self._by_id = {}
+        self._counter = itertools.count()
+        self._lock = threading.Lock()
+
+    def add(self, profile):
+        entry = (profile['duration'], next(self._counter), profile)
+        with self._lock:
+            if len(self._heap) < self.size:
+                heapq.heappush(self._heap, entry)
+            elif entry[0] > self._heap[0][0]:
+                evicted = heapq.heapreplace(self._heap, entry)
+                self._by_id.pop(evicted[2]['id'], None)
+            else:
+                return False
+            self._by_id[profile['id']] = profile
+            return True
+
+    def get(self, profile_id):
+        with self._lock:
+            return self._by_id.get(profile_id)
+
+    def slowest(self):
+        with self._lock:
+            return [e[2] for e in sorted(self._heap, key=lambda e: e[0], reverse=True)]
+
+    def clear(self):
+        with self._lock:
+            self._heap = []
+            self._by_id = {}
+
+
+profiles = SlowestProfiles()
+
+
+def folded_report(profile):
+    """Collapsed-stack text for a stored profile (one `stack count` per line)."""
+    return '\n'.join(f'{stack} {count}' for stack, count in
+                     sorted(profile['stacks'].items(), key=lambda kv: kv[1], reverse=True)) + '\n'
+
+
+def top_frames(profile, limit=15):
+    """Leaf functions with the most samples, as (frame, samples, percent) rows."""
+    leaves = {}
+    for stack, count in profile['stacks'].items():
+        leaf = stack.rsplit(';', 1)[-1]
+        leaves[leaf] = leaves.get(leaf, 0) + count
+    total = profile['samples'] or 1
+    rows = sorted(leaves.items(), key=lambda kv: kv[1], reverse=True)[:limit]
+    return [(frame, count, 100.0 * count / total) for frame, count in rows]
+
+
+def _wants_profile():
+    if request.args.get('_profile') != '1' and request.headers.get('X-Profile') != '1':
+        return False
+    # Same check as routes.admin_required
+    return 'user_id' in session and bool(session.get('is_admin'))
+
+
+def _template_started(sender, template, context, **extra):
+    prof = g.get('_profile')
+    if prof is not None:
+        prof['render_stack'].append((template.name, time.perf_counter()))
+
+
+def _template_finished(sender, template, context, **extra):
+    prof = g.get('_profile')
+    if prof is not None and prof['render_stack']:
+        name, started = prof['render_stack'].pop()
+        prof['templates'].append({'name': name, 'duration': time.perf_counter() - started})
+
+
+def init_app(app):
+    """Install the before/after request hooks that run flagged requests under the sampler."""
+    before_render_template.connect(_template_started, app)
+    template_rendered.connect(_template_finished, app)
+
+    @app.before_request
+    def _profile_start():
+        if not _wants_profile():
+            return
+        sampler = StackSampler(threading.get_ident())
+        g._profile = {'sampler': sampler, 'started': time.perf_counter(),
+                      'render_stack': [], 'templates': []}
+        sampler.start()
+
+    @app.after_request
+    def _profile_finish(response):
+        prof = g.pop('_profile', None)
+        if prof is None:
+            return response
+        prof['sampler'].stop()
+        duration = time.perf_counter() - prof['started']
+        profile = {
+            'id': uuid.uuid4().hex[:12],
+            'path': request.full_path.rstrip('?'),
+            'endpoint': request.endpoint,
+            'method': request.method,
+            'status': response.status_code,
+            'created_at': datetime.now(),
+            'duration': duration,
+            'interval': prof['sampler'].interval,
+            'samples': prof['sampler'].samples,
+            'stacks': prof['sampler'].stacks,
+            'templates': prof['templates'],
+            'render_time': sum(t['duration'] for t in prof['templates']),
+        }
+        profiles.add(profile)
+        response.headers['X-Profile-Id'] = profile['id']
+        response.headers['X-Profile-Duration-Ms'] = f"{duration * 1000:.1f}"
+        return response
@@ -0,0 +1,349 @@
+"""Incrementally maintained per-day utilization and revenue rollups.
+
+One `daily_stats` document per calendar day (`_id` is 'YYYY-MM-DD'):
+
+    {
+      '_id': '2025-03-04', 'date': '2025-03-04', 'weekday': 1,
+      'courts': {'court-1': {'18:00': 1, ...}, ...},   # bookings per court and start hour
+      'court_bookings': 14, 'court_revenue': 210.0,
+      'lessons': {'18:00': {'private': 0, 'group': 4}, ...},
+      'lesson_bookings': 9, 'lesson_revenue': 225.0,
+    }
+
+Booking writes call `record_court_booking()` / `record_lesson_booking()` with
+delta=1 and cancellations with delta=-1; each is a single upserting $inc, so
+concurrent bookings never lose updates. `rebuild()` recomputes the documents
+from the booking collections (after a bulk import, or if the counters ever
+drift): `flask --app app rebuild-daily-stats --from 2024-01-01`.
+
+Reports and the /lessons month grid then read one small document per day in
+the range instead of every booking.
+
+Bookings written before the rollups existed are counted by `backfill_once()`,
+which rebuilds every day a single time on the first start of a release that
+has them (marker in `settings`, so only one worker does it). Until it finishes
+the grid shows those days as open; run the CLI rebuild as a deploy step to
+avoid that window.
+"""
+import logging
+import re
+from datetime import datetime, timedelta
+
+from pymongo import ReplaceOne
+
+from dates import day_key, range_filter
+
+log = logging.getLogger(__name__)
+
+COLLECTION = 'daily_stats'
+GROUP_CAPACITY = 5
+# settings document recording that daily_stats were built from the existing bookings
+BACKFILL_ID = 'daily_stats_backfill'
+# A backfill claimed longer ago than this without finishing (worker died) is retried
+BACKFILL_STALE = timedelta(hours=1)
+
+_TIME_RE = re.compile(r'^\s*(\d{1,2}):(\d{2})\s*([AaPp][Mm])?')
+
+
+def slot_key(label):
+    """24h 'HH:MM' start time of a slot label ('6:00 PM - 7:00 PM' or '18:00 - 19:00')."""
+    m = _TIME_RE.match(str(label or ''))
+    if not m:
+        return None
+    hour, minute, ampm = int(m.group(1)), int(m.group(2)), (m.group(3) or '').upper()
+    if ampm == 'PM' and hour != 12:
+        hour += 12
+    elif ampm == 'AM' and hour == 12:
+        hour = 0
+    return f'{hour:02d}:{minute:02d}'
+
+
+def parse_time_token(token):
+    """Minutes after midnight of '6:00 PM', '6 PM' or '18:00', or None."""
+    token = token.strip()
+    for fmt in ("%I:%M %p", "%I %p", "%H:%M"):
+        try:
+            t = datetime.strptime(token, fmt)
+            return t.hour * 60 + t.minute
+        except ValueError:
+            continue
+    return None
+
+
+def parse_range_minutes(range_str):
+    """(start, end) minutes of a slot label such as '6:00 PM - 7:00 PM' or '9:00-10:00', or None."""
+    parts = [p.strip() for p in str(range_str).split('-')]
+    if len(parts) != 2:
+        return None
+    s = parse_time_token(parts[0])
+    e = parse_time_token(parts[1])
+    if s is None or e is None:
+        return None
+    return s, e
+
+
+def custom_ranges(setting):
+    """Minute ranges of a day's custom_time_slots; empty means every slot is offered."""
+    ranges = set()
+    for s in (setting or {}).get('custom_time_slots') or []:
+        rng = parse_range_minutes(s)
+        if rng:
+            ranges.add(rng)
+    return ranges
+
+
+def lesson_offered(setting, time_label):
+    """True if a day's schedule_settings document offers the lesson slot `time_label`.
+
+    Custom slots are compared as parsed minute ranges, so '9:00-10:00' and
+    '9:00 AM - 10:00 AM' name the same slot.
+    """
+    if (setting or {}).get('no_classes'):
+        return False
+    ranges = custom_ranges(setting)
+    return not ranges or parse_range_minutes(time_label) in ranges
+
+
+def _base(day):
+    return {'date': day, 'weekday': datetime.strptime(day, '%Y-%m-%d').weekday()}
+
+
+def _amount(booking):
+    try:
+        return float(booking.get('amount_paid') or 0)
+    except (TypeError, ValueError):
+        return 0.0
+
+
+def record_court_booking(db, booking, delta=1):
+    """Apply one court booking (delta=1) or its cancellation (delta=-1) to its day's rollup."""
+    day, slot = day_key(booking.get('date')), slot_key(booking.get('time'))
+    if not day or not slot or not booking.get('court_id'):
+        return
+    try:
+        db[COLLECTION].update_one({'_id': day}, {
+            '$inc': {
+                f"courts.{booking['court_id']}.{slot}": delta,
+                'court_bookings': delta,
+                'court_revenue': delta * _amount(booking),
+            },
+            '$setOnInsert': _base(day),
+        }, upsert=True)
+    except Exception as e:
+        # A missed increment is repaired by rebuild(); never fail the booking over it
+        log.warning('daily_stats court update failed for %s: %s', day, e)
+
+
+def record_lesson_booking(db, booking, delta=1):
+    """Apply one lesson booking (delta=1) or its cancellation (delta=-1) to its day's rollup."""
+    day, slot = day_key(booking.get('date')), slot_key(booking.get('time'))
+    lesson_type = booking.get('lesson_type')
+    if not day or not slot or lesson_type not in ('private', 'group'):
+        return
+    try:
+        db[COLLECTION].update_one({'_id': day}, {
+            '$inc': {
+                f'lessons.{slot}.{lesson_type}': delta,
+                'lesson_bookings': delta,
+                'lesson_revenue': delta * _amount(booking),
+            },
+            '$setOnInsert': _base(day),
+        }, upsert=True)
+    except Exception as e:
+        log.warning('daily_stats lesson update failed for %s: %s', day, e)
+
+
+def rebuild(db, date_from=None, date_to=None):
+    """Recompute daily_stats for a date range (inclusive, None = unbounded); returns days written.
+
+    Streams both booking collections once and keeps only one accumulator per
+    day in memory. Increments that land on the rebuilt days while this runs are
+    overwritten, so run it when bookings are quiet.
+    """
+    days = {}
+
+    def acc(day):
+        return days.setdefault(day, dict(_base(day), _id=day, courts={}, court_bookings=0, court_revenue=0.0,
+                                         lessons={}, lesson_bookings=0, lesson_revenue=0.0))
+
+    query = range_filter('date', date_from, date_to)
+    live = {'status': {'$ne': 'cancelled'}}
+    full_query = {'$and': [query, live]} if query else live
+    for b in db.court_bookings.find(full_query, {'date': 1, 'time': 1, 'court_id': 1, 'amount_paid': 1}).batch_size(1000):
+        day, slot = day_key(b.get('date')), slot_key(b.get('time'))
+        if not day or not slot or not b.get('court_id'):
+            continue
+        doc = acc(day)
+        court = doc['courts'].setdefault(b['court_id'], {})
+        court[slot] = court.get(slot, 0) + 1
+        doc['court_bookings'] += 1
+        doc['court_revenue'] += _amount(b)
+
+    for b in db.bookings.find(full_query, {'date': 1, 'time': 1, 'lesson_type': 1, 'amount_paid': 1}).batch_size(1000):
+        day, slot = day_key(b.get('date')), slot_key(b.get('time'))
+        lesson_type = b.get('lesson_type')
+        if not day or not slot or lesson_type not in ('private', 'group'):
+            continue
+        doc = acc(day)
+        counts = doc['lessons'].setdefault(slot, {})
+        counts[lesson_type] = counts.get(lesson_type, 0) + 1
+        doc['lesson_bookings'] += 1
+        doc['lesson_revenue'] += _amount(b)
+
+    id_range = {}
+    if date_from:
+        id_range['$gte'] = date_from
+    if date_to:
+        id_range['$lte'] = date_to
+    db[COLLECTION].delete_many({'_id': id_range} if id_range else {})
+    ops = [ReplaceOne({'_id': day}, doc, upsert=True) for day, doc in days.items()]
+    for i in range(0, len(ops), 1000):
+        db[COLLECTION].bulk_write(ops[i:i + 1000], ordered=False)
+    log.info('rebuilt daily_stats for %d days', len(days))
+    return len(days)
+
+
+def _mark_built(db):
+    db.settings.update_one({'_id': BACKFILL_ID},
+                           {'$set': {'type': BACKFILL_ID, 'built_at': datetime.utcnow()}}, upsert=True)
+
+
+def backfill_once(db):
+    """Rebuild all days once per database; returns the days written, or None if already done or claimed."""
+    now = datetime.utcnow()
+    marker = db.settings.find_one_and_update(
+        {'_id': BACKFILL_ID}, {'$setOnInsert': {'type': BACKFILL_ID, 'started_at': now}}, upsert=True)
+    if marker is not None:
+        if marker.get('built_at') or marker.get('started_at', now) > now - BACKFILL_STALE:
+            return None
+        # The worker that claimed it died; take it over
+        taken = db.settings.update_one({'_id': BACKFILL_ID, 'started_at': marker.get('started_at')},
+                                       {'$set': {'started_at': now}})
+        if not taken.modified_count:
+            return None
+    log.info('building daily_stats from the existing bookings')
+    days = rebuild(db)
+    _mark_built(db)
+    return days
+
+
+def load(db, date_from, date_to):
+    """Rollup documents for date_from..date_to inclusive, ordered by day."""
+    return list(db[COLLECTION].find({'_id': {'$gte': date_from, '$lte': date_to}}).sort('_id', 1))
+
+
+def lesson_counts(doc, label):
+    """(private, group) lessons booked in one lesson slot of a day's rollup document."""
+    counts = (doc or {}).get('lessons', {}).get(slot_key(label)) or {}
+    return counts.get('private', 0), counts.get('group', 0)
+
+
+def lesson_open(private, group, lesson_type=None):
+    """True if a slot holding `private`/`group` lessons can take one more `lesson_type` lesson.
+
+    The one capacity rule for lessons: a private lesson needs an empty slot, a
+    group lesson a slot without a private lesson and fewer than GROUP_CAPACITY
+    group bookings. With lesson_type None, True if either kind still fits.
+    """
+    if private:
+        return False
+    if lesson_type == 'private':
+        return not group
+    return group < GROUP_CAPACITY
+
+
+def summarize(docs, date_from, date_to, court_ids, court_hours, lesson_hours, weekdays=None, hours=None,
+              lesson_overrides=None, court_open=None):
+    """Utilization and revenue over a range of rollup documents.
+
+    `weekdays` (0=Mon) and `hours` (start hours) restrict which days and slots
+    count, e.g. Tuesdays 17:00-20:00. Capacity is every court/lesson slot in
+    the range that matches, so days without bookings count as empty.
+    `lesson_overrides` maps a day to the set of lesson start hours offered
+    that day (empty for no_classes days), from schedule_settings.
+    `court_open(court_id, weekday, hour)` limits court capacity to the hours
+    each court is open (court_catalog.py). Revenue is per whole day.
+    """
+    lesson_overrides = lesson_overrides or {}
+    by_day = {d['_id']: d for d in docs}
+    start = datetime.strptime(date_from, '%Y-%m-%d')
+    end = datetime.strptime(date_to, '%Y-%m-%d')
+    court_hours = [h for h in court_hours if hours is None or h in hours]
+    lesson_hours = [h for h in lesson_hours if hours is None or h in hours]
+
+    out = {
+        'days': 0, 'court_slots': 0, 'court_taken': 0, 'court_revenue': 0.0,
+        'lesson_slots': 0, 'lesson_private': 0, 'lesson_group_seats': 0, 'group_sessions': 0,
+        'lesson_revenue': 0.0,
+        # weekday -> hour -> [taken, capacity] for the court heat map
+        'court_grid': {wd: {h: [0, 0] for h in court_hours} for wd in range(7)},
+    }
+    day = start
+    while day <= end:
+        wd = day.weekday()
+        if weekdays is None or wd in weekdays:
+            key = day.strftime('%Y-%m-%d')
+            doc = by_day.get(key, {})
+            out['days'] += 1
+            for h in court_hours:
+                slot = f'{h:02d}:00'
+                open_ids = court_ids if court_open is None else [c for c in court_ids if court_open(c, wd, h)]
+                taken = sum(min(1, (doc.get('courts', {}).get(c) or {}).get(slot, 0)) for c in open_ids)
+                out['court_slots'] += len(open_ids)
+                out['court_taken'] += taken
+                cell = out['court_grid'][wd][h]
+                cell[0] += taken
+                cell[1] += len(open_ids)
+            offered = lesson_overrides.get(key)
+            for h in lesson_hours:
+                if offered is not None and h not in offered:
+                    continue
+                counts = doc.get('lessons', {}).get(f'{h:02d}:00') or {}
+                out['lesson_slots'] += 1
+                out['lesson_private'] += min(1, counts.get('private', 0))
+                group = counts.get('group', 0)
+                out['lesson_group_seats'] += group
+                out['group_sessions'] += 1 if group else 0
+            out['court_revenue'] += doc.get('court_revenue', 0.0)
+            out['lesson_revenue'] += doc.get('lesson_revenue', 0.0)
+        day += timedelta(days=1)
+
+    out['court_utilization'] = out['court_taken'] / out['court_slots'] if out['court_slots'] else 0.0
+    # A lesson slot is full with one private lesson or GROUP_CAPACITY group seats
+    filled = out['lesson_private'] + out['lesson_group_seats'] / GROUP_CAPACITY
+    out['lesson_fill_rate'] = filled / out['lesson_slots'] if out['lesson_slots'] else 0.0
+    out['avg_group_size'] = out['lesson_group_seats'] / out['group_sessions'] if out['group_sessions'] else 0.0
+    return out
+
+
+def init_app(app, mongo):
+    """Register the `rebuild-daily-stats` CLI command and backfill the rollups once in the background.
+
+    Set ROLLUPS_BACKFILL_ON_STARTUP=0 to skip it (e.g. when the deploy runs
+    `flask --app app rebuild-daily-stats` instead).
+    """
+    import os
+    import threading
+
+    import click
+
+    @app.cli.command('rebuild-daily-stats')
+    @click.option('--from', 'date_from', default=None, help='first day (YYYY-MM-DD), default: all')
+    @click.option('--to', 'date_to', default=None, help='last day (YYYY-MM-DD), default: all')
+    def rebuild_daily_stats_command(date_from, date_to):
+        """Recompute the daily_stats rollups from the booking collections."""
+        days = rebuild(mongo.db, date_from, date_to)
+        if not date_from and not date_to:
+            _mark_built(mongo.db)
+        print(f'Rebuilt daily_stats for {days} day(s).')
+
+    if os.getenv('ROLLUPS_BACKFILL_ON_STARTUP', '1') != '0':
+        # Off the import path, like the index build
+        threading.Thread(target=_backfill_startup, args=(mongo.db,), name='rollups-backfill', daemon=True).start()
+
+
+def _backfill_startup(db):
+    try:
+        backfill_once(db)
+    except Exception as e:
+        log.warning('daily_stats backfill failed: %s', e)
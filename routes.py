@@ -1,6 +1,11 @@
-from flask import render_template, request, redirect, url_for, flash, session, jsonify
+from flask import render_template, request, redirect, url_for, flash, session, jsonify, Response, abort
 from app import app, mongo, stripe, stripe_public_key, MEMBERSHIP_PLANS
 import os
+import logging
+import log_config
+
+log = logging.getLogger(__name__)
+payload_log = log_config.payload_logger(__name__)
 
 # Defensive initialization: some deployment/import orders leave `mongo` as None
 # (or without a working .db). Try to ensure `mongo.db` is available by:
@@ -16,20 +21,20 @@ except Exception:
     # Try Flask-PyMongo first (preferred)
     try:
         from flask_pymongo import PyMongo
-        print('routes.py: attempting to initialize PyMongo(app) as fallback')
+        log.warning('mongo unavailable at import; attempting to initialize PyMongo(app) as fallback')
         mongo = PyMongo(app)
         if getattr(mongo, 'db', None) is not None:
             initialized = True
-            print('routes.py: initialized flask_pymongo successfully')
+            log.info('initialized flask_pymongo fallback successfully')
     except Exception as e:
-        print(f'routes.py: flask_pymongo init failed: {e}')
+        log.error('flask_pymongo fallback init failed: %s', e)
 
     if not initialized:
         # Final fallback: use raw pymongo MongoClient and expose a `.db`
         try:
             from pymongo import MongoClient
             uri = app.config.get('MONGO_URI') or os.getenv('MONGO_URI') or 'mongodb://localhost:27017/primecourt'
-            print(f'routes.py: falling back to pymongo MongoClient using URI: {uri}')
+            log.warning('falling back to pymongo MongoClient using URI: %s', uri)
             client = MongoClient(uri)
             try:
                 # Use default database from URI if present
@@ -43,10 +48,10 @@ except Exception:
                 pass
             mongo = _SimpleMongo()
             mongo.db = db
-            print('routes.py: pymongo fallback initialized; mongo.db is available')
+            log.info('pymongo fallback initialized; mongo.db is available')
             initialized = True
         except Exception as e:
-            print(f'routes.py: pymongo fallback failed: {e}')
+            log.error('pymongo fallback failed: %s', e)
 from werkzeug.security import generate_password_hash, check_password_hash
 from datetime import datetime, timedelta
 import os
@@ -58,6 +63,22 @@ from email.mime.multipart import MIMEMultipart
 from threading import Thread
 from functools import wraps
 from zoneinfo import ZoneInfo
+import time
+import metrics
+import tracing
+import pagination
+import user_search
+import exports
+import dates
+import rollups
+import slot_search
+import lesson_series
+import photos
+import storage
+import page_cache
+import availability
+import court_catalog
+from pymongo import UpdateOne
 
 LESSON_TYPES = {
     'group': {'name': 'Group Lesson', 'price_per_hour': 2500, 'capacity': 6},
@@ -82,6 +103,16 @@ def admin_required(f):
     return decorated_function
 
 
+def _pager_links(next_cursor, prev_cursor):
+    """Next/previous page URLs for the current view, keeping its other query args."""
+    args = {k: v for k, v in request.args.items() if k not in ('after', 'before')}
+    args.update(request.view_args or {})
+    return {
+        'next_url': url_for(request.endpoint, after=next_cursor, **args) if next_cursor else None,
+        'prev_url': url_for(request.endpoint, before=prev_cursor, **args) if prev_cursor else None,
+    }
+
+
 # Lightweight login_required defined early so decorators used above work at import time
 def login_required(f):
     from functools import wraps
@@ -92,27 +123,6 @@ def login_required(f):
         return f(*args, **kwargs)
     return decorated_function
 
-def _parse_range_minutes(range_str: str):
-    parts = [p.strip() for p in str(range_str).split('-')]
-    if len(parts) != 2:
-        return None
-    s = _parse_time_token(parts[0])
-    e = _parse_time_token(parts[1])
-    if s is None or e is None:
-        return None
-    return s, e
-
-def _parse_time_token(token: str):
-    token = token.strip()
-    fmts = ["%I:%M %p", "%I %p", "%H:%M"]
-    for fmt in fmts:
-        try:
-            t = datetime.strptime(token, fmt)
-            return t.hour * 60 + t.minute
-        except Exception:
-            continue
-    return None
-
 
 @app.route('/_debug_db')
 def _debug_db():
@@ -177,7 +187,7 @@ def update_lesson_prices(private_price, group_price):
         )
         return True
     except Exception as e:
-        print(f"Error updating lesson prices: {e}")
+        log.exception('Error updating lesson prices')
         return False
 
 # Email configuration
@@ -190,6 +200,8 @@ EMAIL_FROM = os.getenv('EMAIL_FROM', 'noreply@primecourt.com')
 def send_email_async(subject, recipient, html_content, text_content=None):
     """Send email asynchronously to avoid blocking the main thread"""
     def send_email():
+        start = time.perf_counter()
+        outcome = 'error'
         try:
             msg = MIMEMultipart('alternative')
             msg['Subject'] = subject
@@ -205,12 +217,18 @@ def send_email_async(subject, recipient, html_content, text_content=None):
                 server.login(EMAIL_USER, EMAIL_PASSWORD)
                 server.send_message(msg)
             
-            print(f"Email sent successfully to {recipient}")
+            outcome = 'sent'
+            log.info('Email sent', extra={'recipient': recipient, 'subject': subject})
         except Exception as e:
-            print(f"Error sending email to {recipient}: {str(e)}")
+            log.error('Error sending email: %s', e, extra={'recipient': recipient, 'subject': subject})
+        finally:
+            metrics.mail_send_duration.observe(time.perf_counter() - start, outcome)
+            metrics.mail_queue_depth.dec()
     
     # Start email sending in background thread
-    Thread(target=send_email).start()
+    metrics.mail_queue_depth.inc()
+    with tracing.span('mail.enqueue', subject=subject):
+        Thread(target=send_email).start()
 
 def send_booking_confirmation_email(booking_type, customer_name, customer_email, date, time, details):
     """Send booking confirmation email"""
@@ -305,6 +323,7 @@ def send_reminder_email(booking_type, customer_name, customer_email, date, time,
     send_email_async(subject, customer_email, html_content, text_content)
 
 
+@tracing.traced('assign_coach_for_date')
 def _assign_coach_for_date(date_str):
     """Return coach info dict {'coach_id': str, 'coach_name': name} if a coach is assigned/available for date_str."""
     try:
@@ -338,7 +357,7 @@ def _assign_coach_for_date(date_str):
         if 'coach_name' in avail:
             return {'coach_id': str(avail.get('coach_id') or ''), 'coach_name': avail.get('coach_name', '')}
     except Exception as e:
-        print(f"Error assigning coach for {date_str}: {e}")
+        log.exception('Error assigning coach for %s', date_str)
     return None
 
 def generate_month_slots(year, month):
@@ -374,6 +393,112 @@ def generate_month_slots(year, month):
         })
     return slots
 
+
+def _lesson_slot_is_past(date_str, time_label, now_local):
+    """True once a slot of today (local TZ) has ended; minutes-accurate, e.g. end of "5:00 PM - 6:30 PM"."""
+    if date_str != now_local.strftime('%Y-%m-%d'):
+        return False
+    try:
+        end_time_str = time_label.split(' - ')[1].strip()
+        end_dt = datetime.strptime(f"{date_str} {end_time_str}", "%Y-%m-%d %I:%M %p").replace(tzinfo=now_local.tzinfo)
+        return now_local >= end_dt
+    except Exception:
+        return False
+
+
+def _lesson_month_status(lesson_days, now_local):
+    """Mark each day of generate_month_slots() with no_classes, open_slots and full.
+
+    Reads the month's schedule_settings, daily_stats rollups and pending series
+    occurrences once each and returns them for per-slot detail.
+    """
+    month_from, month_to = lesson_days[0]['date'], lesson_days[-1]['date']
+    schedule_settings = {s['date']: s for s in mongo.db.schedule_settings.find(
+        {'date': {'$gte': month_from, '$lte': month_to}})}
+    day_stats = {d['_id']: d for d in rollups.load(mongo.db, month_from, month_to)}
+    pending = lesson_series.expand_counts(mongo.db, month_from, month_to)
+    for day in lesson_days:
+        setting = schedule_settings.get(day['date'], {})
+        day['no_classes'] = setting.get('no_classes', False)
+        day['no_classes_reason'] = setting.get('reason', '')
+        custom_ranges = rollups.custom_ranges(setting)
+        day['open_slots'] = 0
+        for slot in [] if day['no_classes'] else day['slots']:
+            if custom_ranges and rollups.parse_range_minutes(slot['time']) not in custom_ranges:
+                continue
+            if _lesson_slot_is_past(day['date'], slot['time'], now_local):
+                continue
+            private, group = _lesson_slot_counts(day_stats, pending, day['date'], slot['time'])
+            if rollups.lesson_open(private, group):
+                day['open_slots'] += 1
+        day['full'] = not day['no_classes'] and day['open_slots'] == 0
+    return schedule_settings, day_stats, pending
+
+
+def _lesson_slot_counts(day_stats, pending, date_str, time_label):
+    """(private, group) lessons in a slot: rollup counts plus pending series occurrences."""
+    private, group = rollups.lesson_counts(day_stats.get(date_str), time_label)
+    extra = pending.get((date_str, rollups.slot_key(time_label)), {})
+    return private + extra.get('private', 0), group + extra.get('group', 0)
+
+
+def _fill_lesson_day(day, setting, now_local):
+    """Fill one day's slots with availability, past flag and roster (paid bookings, or the member's own)."""
+    custom_ranges = rollups.custom_ranges(setting)
+    day_bookings = mongo.db.bookings.find({
+        'date': day['date'],
+        '$or': [
+            {'payment_status': 'paid'},
+            {'user_id': str(session['user_id'])}
+        ]
+    }, {'time': 1, 'lesson_type': 1, 'name': 1, 'email': 1})
+    by_time = {}
+    for booking in list(day_bookings) + lesson_series.expand(mongo.db, day['date'], day['date']):
+        by_time.setdefault(booking.get('time'), []).append(booking)
+    for slot in day['slots']:
+        slot['group'] = []
+        slot['private'] = None
+        if custom_ranges:
+            slot_rng = rollups.parse_range_minutes(slot['time'])
+            slot['is_available'] = slot_rng in custom_ranges if slot_rng else False
+        else:
+            slot['is_available'] = True
+        slot['is_past'] = _lesson_slot_is_past(day['date'], slot['time'], now_local)
+        for booking in by_time.get(slot['time'], []):
+            if booking.get('lesson_type') == 'group':
+                slot['group'].append({'name': booking.get('name'), 'email': booking.get('email')})
+            elif booking.get('lesson_type') == 'private':
+                slot['private'] = {'name': booking.get('name'), 'email': booking.get('email')}
+
+    # Optional debug: log why slots are marked unavailable
+    if request.args.get('debug') == '1':
+        log.info('lessons debug', extra={'date': day['date'], 'no_classes': setting.get('no_classes'),
+                                          'custom_time_slots': setting.get('custom_time_slots')})
+        for s in day['slots']:
+            log.info('lessons debug slot', extra={'time': s['time'], 'is_available': s.get('is_available'),
+                                                  'is_past': s.get('is_past'), 'has_private': bool(s.get('private')),
+                                                  'group_size': len(s.get('group', []))})
+
+
+def _lesson_day_etag(date_str, now_local):
+    """Strong ETag of one day's slot table: its lesson availability version, the member
+    (their unpaid bookings show too) and, for today, the local hour (slots turn past on the hour)."""
+    hour = now_local.strftime('%H') if date_str == now_local.strftime('%Y-%m-%d') else ''
+    return availability.etag(mongo.db, 'lessons', [date_str], hour, session.get('user_id', ''))
+
+
+def _lesson_day_html(day, day_idx, setting, now_local, tag=None):
+    """templates/_lesson_day.html for one day of generate_month_slots(), cached per worker under its ETag."""
+    tag = tag or _lesson_day_etag(day['date'], now_local)
+
+    def render():
+        _fill_lesson_day(day, setting, now_local)
+        return render_template('_lesson_day.html', selected_day=day, selected_day_idx=day_idx)
+
+    if request.args.get('debug') == '1':
+        return render()
+    return page_cache.fragment(mongo.db, 'lessons_day', (tag,), [], render)
+
 @app.route('/signup', methods=['GET', 'POST'])
 def signup():
     if request.method == 'POST':
@@ -420,6 +545,7 @@ def signup():
             'bio': 'Professional tennis coach' if is_coach else '',
             'specialties': ['Tennis', 'Coaching'] if is_coach else []
         }
+        user_data.update(user_search.search_fields(name, email))
         
         mongo.db.users.insert_one(user_data)
         flash('Signup successful! Please log in.')
@@ -519,7 +645,7 @@ def coach_dashboard():
                 app_tz = os.getenv('APP_TIMEZONE', 'America/New_York')
                 TZ = ZoneInfo(app_tz)
                 time_range = b.get('time') or ''
-                rng = _parse_range_minutes(time_range)
+                rng = rollups.parse_range_minutes(time_range)
                 if rng:
                     # rng is (start_min, end_min) in minutes since midnight
                     end_min = rng[1]
@@ -532,8 +658,9 @@ def coach_dashboard():
                         # Mark booking as done and skip adding to upcoming
                         try:
                             mongo.db.bookings.update_one({'_id': b['_id']}, {'$set': {'status': 'done', 'done_at': datetime.utcnow()}})
+                            page_cache.booking_changed(mongo.db, b)
                         except Exception as e:
-                            print(f"Warning: could not mark booking {b.get('_id')} done: {e}")
+                            log.warning('Could not mark booking %s done: %s', b.get('_id'), e)
                         continue
             except Exception:
                 # If anything fails during time parsing, fall back to including the booking
@@ -597,34 +724,37 @@ def coach_profile_edit():
 
     try:
         # Handle optional file upload (multipart/form-data)
-        picture_path = None
+        picture_path = photo_key = None
         if 'picture' in request.files:
             pic = request.files.get('picture')
             if pic and pic.filename:
                 from werkzeug.utils import secure_filename
-                import time, uuid
-                # sanitize filename and make it unique
-                filename = secure_filename(pic.filename)
-                filename = f"{int(time.time())}_{uuid.uuid4().hex}_{filename}"
-                upload_folder = os.path.join(app.root_path, 'static', 'uploads', 'coach_photos')
+                # Content-addressed: re-uploading the same photo reuses the stored file
                 try:
-                    os.makedirs(upload_folder, exist_ok=True)
-                    save_path = os.path.join(upload_folder, filename)
-                    pic.save(save_path)
-                    # Store relative path for url_for('static', filename=...)
-                    picture_path = os.path.join('uploads', 'coach_photos', filename).replace(os.path.sep, '/')
+                    photo_key, picture_path = photos.store(storage.get(), pic.stream,
+                                                           secure_filename(pic.filename))
+                except photos.PhotoError as e:
+                    if request.is_json:
+                        return jsonify({'success': False, 'error': str(e)}), 400
+                    flash(f'{e}. Upload a JPEG, PNG, WebP or GIF image.', 'error')
+                    return redirect(url_for('coach_profile_edit'))
                 except Exception as e:
-                    print(f"Error saving uploaded picture: {e}")
+                    log.exception('Error saving uploaded picture')
 
         # Build update document
-        update_doc = {'bio': bio, 'specialties': specialties, 'email': email}
+        update_doc = {'bio': bio, 'specialties': specialties, 'email': email,
+                      'email_lc': user_search.normalize(email)}
+        update = {'$set': update_doc}
         if picture_path:
             update_doc['picture'] = picture_path
-
-        mongo.db.users.update_one(
-            {'_id': ObjectId(user_id)},
-            {'$set': update_doc}
-        )
+            if picture_path != coach.get('picture'):
+                # Old variants belong to the old photo; the worker fills in the new ones
+                update['$unset'] = {'photo_variants': ''}
+
+        mongo.db.users.update_one({'_id': ObjectId(user_id)}, update)
+        page_cache.invalidate(mongo.db, 'coaches')
+        if picture_path and picture_path != coach.get('picture'):
+            photos.process_async(mongo.db, storage.get(), photo_key, picture_path)
         # Update session email to reflect change
         session['user_email'] = email or session.get('user_email')
         # Return JSON for AJAX clients
@@ -633,7 +763,7 @@ def coach_profile_edit():
         flash('Profile updated successfully.', 'success')
         return redirect(url_for('coach_dashboard'))
     except Exception as e:
-        print(f"Error updating coach profile: {e}")
+        log.exception('Error updating coach profile')
         if request.is_json:
             return jsonify({'success': False, 'error': 'Server error'}), 500
         flash('Error updating profile. Check server logs.', 'error')
@@ -690,7 +820,7 @@ def coach_lessons():
                 app_tz = os.getenv('APP_TIMEZONE', 'America/New_York')
                 TZ = ZoneInfo(app_tz)
                 time_range = b.get('time') or ''
-                rng = _parse_range_minutes(time_range)
+                rng = rollups.parse_range_minutes(time_range)
                 if rng:
                     end_min = rng[1]
                     end_hour = end_min // 60
@@ -700,8 +830,9 @@ def coach_lessons():
                     if now_local >= end_dt:
                         try:
                             mongo.db.bookings.update_one({'_id': b['_id']}, {'$set': {'status': 'done', 'done_at': datetime.utcnow()}})
+                            page_cache.booking_changed(mongo.db, b)
                         except Exception as e:
-                            print(f"Warning: could not mark booking {b.get('_id')} done: {e}")
+                            log.warning('Could not mark booking %s done: %s', b.get('_id'), e)
                         continue
             except Exception:
                 pass
@@ -745,9 +876,10 @@ def coach_mark_booking_done(booking_id):
 
     try:
         mongo.db.bookings.update_one({'_id': ObjectId(booking_id)}, {'$set': {'status': 'done', 'done_at': datetime.utcnow()}})
+        page_cache.booking_changed(mongo.db, b)
         return jsonify({'success': True, 'status': 'done'})
     except Exception as e:
-        print(f"Error marking booking done: {e}")
+        log.exception('Error marking booking done')
         return jsonify({'success': False, 'error': 'Server error'}), 500
 
 
@@ -789,7 +921,7 @@ def coach_message_student(booking_id):
         send_email_async(subject, student_email, html_content, text_content)
         return jsonify({'success': True})
     except Exception as e:
-        print(f"Error sending message email: {e}")
+        log.exception('Error sending message email')
         return jsonify({'success': False, 'error': 'Failed to send message'}), 500
 
 
@@ -828,6 +960,7 @@ def coach_availability():
                 'weekdays': wd_ints,
                 'updated_at': datetime.utcnow()
             })
+        page_cache.invalidate(mongo.db, f'coach:{coach_id}')
         flash('Availability updated.', 'success')
         return redirect(url_for('coach_dashboard'))
 
@@ -871,6 +1004,10 @@ def coach_cancel_days():
                 try:
                     # Update booking status to cancelled
                     mongo.db.bookings.update_one({'_id': b['_id']}, {'$set': {'status': 'cancelled', 'cancelled_by': 'coach', 'cancelled_at': datetime.utcnow()}})
+                    if b.get('status') != 'cancelled':
+                        rollups.record_lesson_booking(mongo.db, b, delta=-1)
+                        page_cache.booking_changed(mongo.db, b)
+                        availability.bump(mongo.db, 'lessons', b.get('date'))
 
                     # Send cancellation email to student
                     details = f"<p>Your lesson on {date_str} at {b.get('time')} has been cancelled by the coach. You will receive a refund for this lesson shortly.</p>"
@@ -925,12 +1062,12 @@ def coach_cancel_days():
 
                     cancelled_count += 1
                 except Exception as e:
-                    print(f"Error cancelling booking {b.get('_id')}: {e}")
+                    log.exception('Error cancelling booking %s', b.get('_id'))
                     refund_errors.append(str(e))
 
         flash(f'Cancelled {cancelled_count} bookings. Refunds attempted.', 'success' if cancelled_count > 0 else 'error')
         if refund_errors:
-            print('Refund errors:', refund_errors)
+            log.warning('Refund errors while cancelling coach days', extra={'refund_errors': refund_errors})
             flash('Some refunds failed or require manual review. Check server logs.', 'warning')
 
         return redirect(url_for('coach_dashboard'))
@@ -972,7 +1109,7 @@ def make_me_admin():
         flash('You have been promoted to admin (temporary). Remove the TEMP route after use.', 'success')
         return redirect(url_for('admin_dashboard'))
     except Exception as e:
-        print(f"Error making user admin: {e}")
+        log.exception('Error making user admin')
         flash('There was an error promoting your account. Check server logs.', 'error')
         return redirect(url_for('profile'))
 
@@ -1010,11 +1147,8 @@ def create_lesson_booking():
     if recurring_weeks > 12:
         recurring_weeks = 12
 
-    # Log incoming payload for easier debugging
-    try:
-        print('[create_lesson_booking] payload:', data)
-    except Exception:
-        pass
+    # Log a sample of incoming payloads for debugging (LOG_PAYLOAD_SAMPLE_RATE)
+    payload_log.info('create_lesson_booking payload', extra={'payload': data})
 
     # Basic validation with helpful errors
     if lesson_type not in ('group', 'private'):
@@ -1049,7 +1183,7 @@ def create_lesson_booking():
     # Ensure Stripe API key is configured
     if not getattr(stripe, 'api_key', None):
         err = 'Stripe API key not configured on server. Set STRIPE_SECRET_KEY.'
-        print(err)
+        log.error(err)
         return jsonify({'error': err}), 500
 
     try:
@@ -1120,7 +1254,7 @@ def create_lesson_booking():
         return redirect(session_obj.url, code=303)
 
     except Exception as e:
-        print('Error creating Stripe session:', str(e))
+        log.exception('Error creating Stripe session')
         return jsonify({'error': str(e)}), 500
 
 
@@ -1142,13 +1276,20 @@ def create_court_booking_session():
     if not (court_id and time_slot and date):
         return jsonify({'error': 'Missing booking information'}), 400
 
-    # Price for courts (CAD $15)
-    price_amount = 15.00
+    # Court, opening hours and price (CAD) come from the catalog
+    catalog = court_catalog.get(mongo.db)
+    court = catalog.get(court_id)
+    try:
+        bookable = court is not None and catalog.is_open(court_id, datetime.strptime(date, '%Y-%m-%d'), time_slot)
+    except ValueError:
+        bookable = False
+    if not bookable:
+        return jsonify({'error': 'That court is not open at this time'}), 400
 
     # Ensure Stripe API key is configured
     if not getattr(stripe, 'api_key', None):
         err = 'Stripe API key not configured on server. Set STRIPE_SECRET_KEY.'
-        print(err)
+        log.error(err)
         return jsonify({'error': err}), 500
 
     try:
@@ -1167,8 +1308,8 @@ def create_court_booking_session():
             line_items=[{
                 'price_data': {
                     'currency': 'cad',
-                    'product_data': {'name': f'PrimeCourt - Court Booking ({court_id})'},
-                    'unit_amount': int(price_amount * 100),
+                    'product_data': {'name': f"PrimeCourt - Court Booking ({court['name']})"},
+                    'unit_amount': court['price'],  # catalog prices are in cents
                 },
                 'quantity': 1,
             }],
@@ -1181,7 +1322,7 @@ def create_court_booking_session():
 
         return jsonify({'sessionId': session_obj.id, 'url': session_obj.url})
     except Exception as e:
-        print('Error creating court Stripe session:', str(e))
+        log.exception('Error creating court Stripe session')
         return jsonify({'error': str(e)}), 500
 
 @app.route('/lesson-booking-success')
@@ -1200,15 +1341,20 @@ def lesson_booking_success():
             subscription_id = checkout_session.get('subscription')
             payment_status = checkout_session.get('payment_status')
             metadata = checkout_session.get('metadata', {})
+            amount_total = checkout_session.get('amount_total')
         else:
             subscription_id = getattr(checkout_session, 'subscription', None)
             payment_status = getattr(checkout_session, 'payment_status', None)
             metadata = getattr(checkout_session, 'metadata', {}) or {}
+            amount_total = getattr(checkout_session, 'amount_total', None)
 
         if not subscription_id and payment_status != 'paid':
             flash('Payment was not successful. Please try again.', 'error')
             return redirect(url_for('lessons'))
 
+        # Both checkout modes charge the per-lesson price (weekly for subscriptions)
+        amount_paid = amount_total / 100 if amount_total is not None else None
+
         # Get metadata from the checkout session
         user_id = metadata.get('user_id')
         day_idx = int(metadata.get('day_idx', 0))
@@ -1254,90 +1400,75 @@ def lesson_booking_success():
                 cancel_at_ts = int(cancel_at_dt.replace(tzinfo=None).timestamp())
                 stripe.Subscription.modify(stripe_subscription_id, cancel_at=cancel_at_ts)
             except Exception as e:
-                print(f"Warning: could not set subscription cancel_at: {e}")
-
-        booked_entries = []
-        for week in range(recurring_weeks):
-            lesson_date = selected_date + timedelta(weeks=week)
-            week_date_str = lesson_date.strftime('%Y-%m-%d')
+                log.warning('Could not set subscription cancel_at: %s', e)
 
-            # Check if this date has no classes
-            schedule_settings = mongo.db.schedule_settings.find_one({'date': week_date_str}) or {}
-            if schedule_settings.get('no_classes', False):
-                continue
-
-            # Check if slot is available for this date
-            if schedule_settings.get('custom_time_slots'):
-                if time_str not in schedule_settings['custom_time_slots']:
-                    continue
-
-            # Check if slot is already booked (private vs group rules)
-            existing_booking = mongo.db.bookings.find_one({
-                'date': week_date_str,
-                'time': time_str,
-                'lesson_type': 'private'
-            })
-
-            if existing_booking:
-                if lesson_type == 'private':
-                    continue
-                elif lesson_type == 'group':
-                    group_count = mongo.db.bookings.count_documents({
-                        'date': week_date_str,
-                        'time': time_str,
-                        'lesson_type': 'group'
-                    })
-                    if group_count >= 5:
-                        continue
+        booking_fields = {'payment_status': 'paid', 'stripe_session_id': session_id}
+        if amount_paid is not None:
+            booking_fields['amount_paid'] = amount_paid
+        if stripe_subscription_id:
+            booking_fields['stripe_subscription_id'] = stripe_subscription_id
 
-            # Determine assigned coach for this date (if any)
-            coach_info = _assign_coach_for_date(week_date_str)
-
-            # Create booking in database
-            booking_data = {
-                'user_id': user_id,
-                'name': user.get('name', ''),
-                'email': user.get('email', ''),
-                'date': week_date_str,
-                'time': time_str,
-                'lesson_type': lesson_type,
-                'created_at': datetime.utcnow(),
-                'payment_status': 'paid',
-                'stripe_session_id': session_id,
-                'recurring_week': f"{week + 1}/{recurring_weeks}" if recurring_weeks > 1 else None
-            }
-            if stripe_subscription_id:
-                booking_data['stripe_subscription_id'] = stripe_subscription_id
-            if coach_info:
-                booking_data['coach_id'] = coach_info.get('coach_id')
-                booking_data['coach_name'] = coach_info.get('coach_name')
-
-            # Check if this is a group or private lesson
-            if lesson_type == 'group':
-                group_count = mongo.db.bookings.count_documents({
+        booked_entries = []
+        if recurring_weeks > 1:
+            # One series document; its bookings are written as they enter the rolling window
+            series = lesson_series.create(mongo.db, user_id, user.get('name', ''), user.get('email', ''),
+                                          lesson_type, time_str, selected_date.strftime('%Y-%m-%d'),
+                                          recurring_weeks, **booking_fields)
+            coach_info = _assign_coach_for_date(series['start_date'])
+            for week, week_date_str in lesson_series.occurrences(series):
+                entry = {
                     'date': week_date_str,
                     'time': time_str,
-                    'lesson_type': 'group'
-                })
-                if group_count >= 5:  # Max 5 people in a group
-                    continue
-                booking_data['group_size'] = group_count + 1
-
-            # Insert booking
-            mongo.db.bookings.insert_one(booking_data)
-            success_count += 1
-
-            # Collect booked entry for single aggregated email
-            entry = {
-                'date': week_date_str,
-                'time': time_str,
-                'type': lesson_type,
-                'week_number': week + 1,
-                'total_weeks': recurring_weeks,
-            }
-            if coach_info:
-                entry['coach_name'] = coach_info.get('coach_name')
-            booked_entries.append(entry)
+                    'type': lesson_type,
+                    'week_number': week,
+                    'total_weeks': recurring_weeks,
+                }
+                if coach_info:
+                    entry['coach_name'] = coach_info.get('coach_name')
+                booked_entries.append(entry)
+            success_count = len(booked_entries)
+        else:
+            week_date_str = selected_date.strftime('%Y-%m-%d')
+            # Schedule overrides, private/group capacity and pending series occurrences
+            if lesson_series.unavailable_reason(mongo.db, week_date_str, time_str, lesson_type) is None:
+                # Determine assigned coach for this date (if any)
+                coach_info = _assign_coach_for_date(week_date_str)
+
+                # Create booking in database
+                booking_data = {
+                    'user_id': user_id,
+                    'name': user.get('name', ''),
+                    'email': user.get('email', ''),
+                    'date': week_date_str,
+                    'time': time_str,
+                    'lesson_type': lesson_type,
+                    'created_at': datetime.utcnow(),
+                    'recurring_week': None
+                }
+                booking_data.update(booking_fields)
+                if coach_info:
+                    booking_data['coach_id'] = coach_info.get('coach_id')
+                    booking_data['coach_name'] = coach_info.get('coach_name')
+                if lesson_type == 'group':
+                    booking_data['group_size'] = lesson_series.slot_counts(mongo.db, week_date_str, time_str)['group'] + 1
+
+                # Insert booking
+                mongo.db.bookings.insert_one(booking_data)
+                rollups.record_lesson_booking(mongo.db, booking_data)
+                page_cache.booking_changed(mongo.db, booking_data)
+                availability.bump(mongo.db, 'lessons', booking_data['date'])
+                success_count += 1
+
+                entry = {
+                    'date': week_date_str,
+                    'time': time_str,
+                    'type': lesson_type,
+                    'week_number': 1,
+                    'total_weeks': 1,
+                }
+                if coach_info:
+                    entry['coach_name'] = coach_info.get('coach_name')
+                booked_entries.append(entry)
 
         if success_count > 0:
             # Send a single aggregated confirmation email for the series (or single booking)
@@ -1373,7 +1504,7 @@ def lesson_booking_success():
                     details
                 )
             except Exception as e:
-                print(f"Error sending aggregated confirmation email: {e}")
+                log.exception('Error sending aggregated confirmation email')
 
             if recurring_weeks == 1:
                 flash(f'Successfully booked {lesson_type} lesson!', 'success')
@@ -1385,7 +1516,7 @@ def lesson_booking_success():
         return redirect(url_for('lessons', day=day_idx, slot=slot_idx))
 
     except Exception as e:
-        print(f"Error processing lesson booking success: {str(e)}")
+        log.exception('Error processing lesson booking success')
         flash('Your payment was successful, but there was an error completing your booking. Please contact support.', 'warning')
         return redirect(url_for('lessons', show_flash=1))
 
@@ -1419,62 +1550,9 @@ def lessons():
     if 'user_id' in session:
         user = mongo.db.users.find_one({'_id': ObjectId(session['user_id'])})
 
-    # Load schedule settings and bookings
-    schedule_settings = {s['date']: s for s in mongo.db.schedule_settings.find()}
-    # Only show paid bookings or bookings by the current user
-    bookings = list(mongo.db.bookings.find({
-        '$or': [
-            {'payment_status': 'paid'},
-            {'user_id': str(session['user_id'])}
-        ]
-    }))
-    
-    for day_idx, day in enumerate(lesson_days):
-        # Check if this day has no classes
-        day['no_classes'] = schedule_settings.get(day['date'], {}).get('no_classes', False)
-        day['no_classes_reason'] = schedule_settings.get(day['date'], {}).get('reason', '')
-        
-        # Get custom time slots for this day (if any)
-        custom_slots = schedule_settings.get(day['date'], {}).get('custom_time_slots', [])
-        # Pre-parse to minutes for robust comparison across formats
-        custom_ranges = set()
-        for s in custom_slots:
-            rng = _parse_range_minutes(s)
-            if rng:
-                custom_ranges.add(rng)
-        
-        for slot_idx, slot in enumerate(day['slots']):
-            slot['group'] = []  # Reset group list
-            slot['private'] = None  # Reset private slot
-            
-            # Check if this time slot is available based on custom settings
-            if custom_ranges:
-                slot_rng = _parse_range_minutes(slot['time'])
-                slot['is_available'] = slot_rng in custom_ranges if slot_rng else False
-            else:
-                slot['is_available'] = True
-            
-            # Check if this time slot has passed for today (use minutes-accurate comparison in local TZ)
-            now_local = datetime.now(TZ)
-            if day['date'] == now_local.strftime('%Y-%m-%d'):
-                try:
-                    # Parse end time (e.g., "5:00 PM - 6:30 PM") and build a datetime on the slot's date
-                    end_time_str = slot['time'].split(' - ')[1].strip()
-                    end_dt = datetime.strptime(f"{day['date']} {end_time_str}", "%Y-%m-%d %I:%M %p").replace(tzinfo=TZ)
-                    now_dt = now_local
-                    # Mark as past if the slot has ended
-                    slot['is_past'] = now_dt >= end_dt
-                except Exception:
-                    slot['is_past'] = False
-            else:
-                slot['is_past'] = False
-            
-            for booking in bookings:
-                if booking['date'] == day['date'] and booking['time'] == slot['time']:
-                    if booking['lesson_type'] == 'group':
-                        slot['group'].append({'name': booking['name'], 'email': booking['email']})
-                    elif booking['lesson_type'] == 'private':
-                        slot['private'] = {'name': booking['name'], 'email': booking['email']}
+    # Month grid: this month's schedule overrides and one daily_stats rollup per day
+    now_local = datetime.now(TZ)
+    schedule_settings = _lesson_month_status(lesson_days, now_local)[0]
 
     if request.method == 'POST':
         try:
@@ -1491,113 +1569,51 @@ def lessons():
             
             slot = lesson_days[day_idx]['slots'][slot_idx]
             selected_date = datetime.strptime(lesson_days[day_idx]['date'], '%Y-%m-%d')
+            week_dates = [(selected_date + timedelta(weeks=w)).strftime('%Y-%m-%d') for w in range(recurring_weeks)]
+            schedule_settings.update({s['date']: s for s in mongo.db.schedule_settings.find(
+                {'date': {'$in': week_dates}})})
             
-            # Book recurring lessons
+            # Recurring lessons become one series; its bookings are written as they enter the rolling window
             success_count = 0
-            for week in range(recurring_weeks):
-                # Calculate date for this week
-                lesson_date = selected_date + timedelta(weeks=week)
-                date_str = lesson_date.strftime('%Y-%m-%d')
-                
-                # Check if this date has no classes
-                if schedule_settings.get(date_str, {}).get('no_classes', False):
-                    continue  # Skip this date
-                
-                # Check if slot is available for this date
-                slot_available = True
-                if schedule_settings.get(date_str, {}).get('custom_time_slots'):
-                    custom_slots = schedule_settings[date_str]['custom_time_slots']
-                    custom_ranges = set()
-                    for s in custom_slots:
-                        rng = _parse_range_minutes(s)
-                        if rng:
-                            custom_ranges.add(rng)
-                    if custom_ranges:
-                        slot_rng = _parse_range_minutes(slot['time'])
-                        slot_available = slot_rng in custom_ranges if slot_rng else False
-                    else:
-                        slot_available = True  # No valid ranges parsed; treat as unrestricted
-                
-                if not slot_available:
-                    continue  # Skip this date
-                
-                # Check if slot is past for this date (use minutes-accurate comparison in local TZ)
-                now_local = datetime.now(TZ)
-                if date_str == now_local.strftime('%Y-%m-%d'):
-                    try:
-                        end_time_str = slot['time'].split(' - ')[1].strip()
-                        end_dt = datetime.strptime(f"{date_str} {end_time_str}", "%Y-%m-%d %I:%M %p").replace(tzinfo=TZ)
-                        now_dt = now_local
-                        if now_dt >= end_dt:
-                            continue  # Skip past slots
-                    except Exception:
-                        pass
-                
-                # Check if slot is already booked for this date
-                existing_booking = mongo.db.bookings.find_one({
-                    'date': date_str,
-                    'time': slot['time']
-                })
-                
-                if existing_booking:
-                    if lesson_type == 'private':
-                        continue  # Skip if private slot is booked
-                    elif lesson_type == 'group' and len(existing_booking.get('group', [])) >= 5:
-                        continue  # Skip if group is full
-                
-                # Book the lesson
-                if lesson_type == 'private':
+            if recurring_weeks > 1:
+                series = lesson_series.create(mongo.db, session.get('user_id'), name, email, lesson_type, slot['time'],
+                                              selected_date.strftime('%Y-%m-%d'), recurring_weeks)
+                scheduled = lesson_series.occurrences(series)
+                success_count = len(scheduled)
+                if scheduled:
+                    details = f"<p><strong>Type:</strong> {lesson_type.title()} Lesson</p><h3>Scheduled Dates:</h3><ul>"
+                    for week, date_str in scheduled:
+                        details += f"<li>Week {week}/{recurring_weeks}: {date_str} — {slot['time']}</li>"
+                    details += "</ul>"
+                    send_booking_confirmation_email("Lesson", name, email, scheduled[0][1], slot['time'], details)
+            else:
+                date_str = selected_date.strftime('%Y-%m-%d')
+                # Same checks as lesson_booking_success: schedule overrides, capacity, pending series
+                reason = 'past' if _lesson_slot_is_past(date_str, slot['time'], datetime.now(TZ)) else None
+                if reason is None:
+                    reason = lesson_series.unavailable_reason(mongo.db, date_str, slot['time'], lesson_type)
+                if reason is None:
                     booking_data = {
                         'date': date_str,
                         'time': slot['time'],
-                        'lesson_type': 'private',
+                        'lesson_type': lesson_type,
                         'name': name,
                         'email': email,
                         'recurring_id': f"{name}_{email}_{slot['time']}_{lesson_type}",
-                        'week_number': week + 1,
-                        'total_weeks': recurring_weeks
+                        'week_number': 1,
+                        'total_weeks': 1
                     }
-                    # Check if this is the first week of a recurring booking
-                    if week == 0:
-                        # Create the booking
-                        mongo.db.bookings.insert_one(booking_data)
-                        success_count += 1
-                
-                    # Send confirmation email
-                    details = f"<p><strong>Type:</strong> Private Lesson</p>"
-                    if recurring_weeks > 1:
-                        details += f"<p><strong>Series:</strong> Week {week + 1} of {recurring_weeks}</p>"
+                    details = f"<p><strong>Type:</strong> {lesson_type.title()} Lesson</p>"
+                    if lesson_type == 'group':
+                        group_size = lesson_series.slot_counts(mongo.db, date_str, slot['time'])['group'] + 1
+                        details += f"<p><strong>Group Size:</strong> {group_size}/{rollups.GROUP_CAPACITY}</p>"
+                    mongo.db.bookings.insert_one(booking_data)
+                    rollups.record_lesson_booking(mongo.db, booking_data)
+                    page_cache.booking_changed(mongo.db, booking_data)
+                    availability.bump(mongo.db, 'lessons', booking_data['date'])
+                    success_count += 1
                     send_booking_confirmation_email("Lesson", name, email, date_str, slot['time'], details)
-                
-                elif lesson_type == 'group':
-                    # Check current group size for this date
-                    current_bookings = list(mongo.db.bookings.find({
-                        'date': date_str,
-                        'time': slot['time'],
-                        'lesson_type': 'group'
-                    }))
-                    
-                    if len(current_bookings) < 5:
-                        booking_data = {
-                            'date': date_str,
-                            'time': slot['time'],
-                            'lesson_type': 'group',
-                            'name': name,
-                            'email': email,
-                            'recurring_id': f"{name}_{email}_{slot['time']}_{lesson_type}",
-                            'week_number': week + 1,
-                            'total_weeks': recurring_weeks
-                        }
-                        mongo.db.bookings.insert_one(booking_data)
-                        success_count += 1
-                        
-                        # Send confirmation email
-                        details = f"<p><strong>Type:</strong> Group Lesson</p>"
-                        details += f"<p><strong>Group Size:</strong> {len(current_bookings) + 1}/5</p>"
-                        if recurring_weeks > 1:
-                            details += f"<p><strong>Series:</strong> Week {week + 1} of {recurring_weeks}</p>"
-                        send_booking_confirmation_email("Lesson", name, email, date_str, slot['time'], details)
-            
+
             if success_count > 0:
                 if recurring_weeks == 1:
                     message = f'{lesson_type.title()} lesson booked!'
@@ -1610,7 +1626,7 @@ def lessons():
             selected_day_idx = day_idx
             
         except Exception as e:
-            print(f"Error processing lesson booking: {str(e)}")
+            log.exception('Error processing lesson booking')
             message = 'An error occurred while processing your booking.'
             
             # Set default values for rendering the page
@@ -1619,6 +1635,12 @@ def lessons():
                 selected_day = lesson_days[day_idx]
                 selected_day_idx = day_idx
 
+    # Slot detail for the selected day only; the grid loads other days from lessons_day
+    day_html = None
+    if selected_day:
+        day_html = _lesson_day_html(selected_day, selected_day_idx,
+                                    schedule_settings.get(selected_day['date'], {}), now_local)
+
     # Calculate weekday index for the first day
     first_day_dt = datetime(year, month, 1)
     weekday = first_day_dt.weekday()  # Monday=0
@@ -1627,13 +1649,6 @@ def lessons():
 
     month_name = first_day_dt.strftime('%B')
 
-    # Optional debug: log why slots are marked unavailable
-    if request.args.get('debug') == '1' and selected_day:
-        day_cfg = schedule_settings.get(selected_day['date'], {})
-        print(f"[LESSONS DEBUG] Date: {selected_day['date']} no_classes={day_cfg.get('no_classes')} custom_time_slots={day_cfg.get('custom_time_slots')}")
-        for s in selected_day['slots']:
-            print(f"[LESSONS DEBUG] time={s['time']} is_available={s.get('is_available')} is_past={s.get('is_past')} has_private={bool(s.get('private'))} group_size={len(s.get('group', []))}")
-
     return render_template(
         'lessons.html',
         lesson_days=lesson_days,
@@ -1643,6 +1658,7 @@ def lessons():
         weekday=weekday,
         selected_day=selected_day,
         selected_day_idx=selected_day_idx,
+        day_html=day_html,
         lesson_types=LESSON_TYPES,
         stripe_public_key=stripe_public_key,
         message=message,
@@ -1656,13 +1672,14 @@ def courts():
     from datetime import datetime
     # Selected date (defaults to today)
     selected_date_str = request.args.get('date') or datetime.now().strftime('%Y-%m-%d')
+    try:
+        selected_weekday = datetime.strptime(selected_date_str, '%Y-%m-%d').weekday()
+    except ValueError:
+        selected_date_str = datetime.now().strftime('%Y-%m-%d')
+        selected_weekday = datetime.now().weekday()
 
-    # Define available courts (could be moved to DB later)
-    courts_list = [
-        {'id': 'court-1', 'name': 'Court 1', 'surface': 'Hard'},
-        {'id': 'court-2', 'name': 'Court 2', 'surface': 'Clay'},
-        {'id': 'court-3', 'name': 'Court 3', 'surface': 'Grass'}
-    ]
+    catalog = court_catalog.get(mongo.db)
+    courts_list = catalog.active()
 
     # Handle booking submission
     if request.method == 'POST':
@@ -1679,7 +1696,16 @@ def courts():
             
             if not all([court_id, time_slot]):
                 return jsonify({'error': 'Missing required fields'}), 400
-                
+
+            court = catalog.get(court_id)
+            try:
+                bookable = court is not None and catalog.is_open(court_id, datetime.strptime(date_str, '%Y-%m-%d'),
+                                                                 time_slot)
+            except (TypeError, ValueError):
+                bookable = False
+            if not bookable:
+                return jsonify({'error': 'That court is not open at this time'}), 400
+
             # Check if slot is already booked
             existing = mongo.db.court_bookings.find_one({
                 'date': date_str,
@@ -1696,7 +1722,7 @@ def courts():
                 'court_id': court_id,
                 'time_slot': time_slot,
                 'date': date_str,
-                'price': 15.00  # $15 per hour
+                'price': court['price'] / 100  # per hour
             })
         
         # Handle regular form submission (shouldn't happen with new JS flow)
@@ -1711,12 +1737,13 @@ def courts():
         flash('Please use the new booking system', 'error')
         return redirect(url_for('courts', date=date_str))
 
-    # Build availability for the selected date (09:00–21:00)
-    hours = list(range(9, 21))
-    time_slots = [f"{h:02d}:00 - {h+1:02d}:00" for h in hours]
+    # Rows are every hour any court opens; each court's own hours for this weekday are open_map
+    time_slots = catalog.slot_labels()
+    open_map = {c['id']: set(catalog.open_labels(c['id'], selected_weekday)) for c in courts_list}
 
-    # Load bookings for the selected date
-    bookings = list(mongo.db.court_bookings.find({'date': selected_date_str}))
+    # Bookings of the listed courts on the selected date (date_court_time index)
+    bookings = mongo.db.court_bookings.find({'date': selected_date_str, 'court_id': {'$in': catalog.ids()}},
+                                            {'court_id': 1, 'time': 1})
     booked_map = {}
     for b in bookings:
         booked_map[(b['court_id'], b['time'])] = b
@@ -1726,10 +1753,176 @@ def courts():
         courts=courts_list,
         date_str=selected_date_str,
         time_slots=time_slots,
-    booked_map=booked_map,
-    stripe_public_key=stripe_public_key
+        open_map=open_map,
+        booked_map=booked_map,
+        stripe_public_key=stripe_public_key
     )
 
+@app.route('/next-available')
+def next_available():
+    """JSON: the first open lesson or court slots from today on.
+
+    ?kind=lesson&lesson_type=group or ?kind=court[&court_id=court-2], plus
+    optional weekday (repeatable, 0=Mon), hour_from/hour_to (start hours),
+    limit (default 5) and days (horizon, up to 90).
+    """
+    kind = request.args.get('kind', 'lesson')
+    weekdays = {int(w) for w in request.args.getlist('weekday') if w.isdigit() and int(w) < 7} or None
+    hour_from = request.args.get('hour_from', type=int)
+    hour_to = request.args.get('hour_to', type=int)
+    hours = None
+    if hour_from is not None or hour_to is not None:
+        hours = set(range(hour_from if hour_from is not None else 0, (hour_to if hour_to is not None else 23) + 1))
+    limit = max(1, min(request.args.get('limit', 5, type=int), slot_search.MAX_RESULTS))
+    days = max(1, min(request.args.get('days', slot_search.MAX_DAYS, type=int), slot_search.MAX_DAYS))
+    now = datetime.now(ZoneInfo(os.getenv('APP_TIMEZONE', 'America/New_York'))).replace(tzinfo=None)
+
+    if kind == 'lesson':
+        lesson_type = request.args.get('lesson_type', 'group')
+        if lesson_type not in ('group', 'private'):
+            return jsonify({'error': 'lesson_type must be "group" or "private"'}), 400
+        slots = slot_search.next_lesson_slots(mongo.db, lesson_type, now, days=days, limit=limit,
+                                              weekdays=weekdays, hours=hours, now=now)
+        for slot in slots:
+            y, m, d = (int(x) for x in slot['date'].split('-'))
+            slot['url'] = url_for('lessons', year=y, month=m, day=d - 1)
+    elif kind == 'court':
+        catalog = court_catalog.get(mongo.db)
+        court_ids = catalog.ids()
+        if request.args.get('court_id'):
+            if request.args['court_id'] not in court_ids:
+                return jsonify({'error': 'Unknown court_id'}), 400
+            court_ids = [request.args['court_id']]
+        slots = slot_search.next_court_slots(mongo.db, court_ids, now, days=days, limit=limit,
+                                             weekdays=weekdays, hours=hours, now=now,
+                                             open_hours=catalog.open_hours)
+        for slot in slots:
+            slot['url'] = url_for('courts', date=slot['date'])
+    else:
+        return jsonify({'error': 'kind must be "lesson" or "court"'}), 400
+    return jsonify({'slots': slots})
+
+
+def _not_modified(tag, cache_control):
+    resp = Response(status=304)
+    resp.set_etag(tag)
+    resp.headers['Cache-Control'] = cache_control
+    return resp
+
+
+@app.route('/api/courts/availability')
+def api_courts_availability():
+    """JSON: which court slots are booked on ?date=YYYY-MM-DD (default today).
+
+    Strong ETag from the date's availability version; a matching
+    If-None-Match gets a 304 without reading court_bookings.
+    """
+    date_str = request.args.get('date') or datetime.now().strftime('%Y-%m-%d')
+    try:
+        weekday = datetime.strptime(date_str, '%Y-%m-%d').weekday()
+    except ValueError:
+        return jsonify({'error': 'date must be YYYY-MM-DD'}), 400
+    cache_control = 'no-cache'
+    catalog = court_catalog.get(mongo.db)
+    # Catalog edits (hours, prices, courts) change the response as much as bookings do
+    tag = availability.etag(mongo.db, 'courts', [date_str], catalog.version)
+    if request.if_none_match.contains_weak(tag):
+        return _not_modified(tag, cache_control)
+
+    booked = set()
+    for b in mongo.db.court_bookings.find({'date': date_str, 'court_id': {'$in': catalog.ids()},
+                                           'status': {'$ne': 'cancelled'}}, {'court_id': 1, 'time': 1}):
+        booked.add((b.get('court_id'), b.get('time')))
+    courts_out = []
+    for c in catalog.active():
+        open_labels = catalog.open_labels(c['id'], weekday)
+        courts_out.append({'id': c['id'], 'name': c['name'], 'surface': c['surface'], 'price': c['price'] / 100,
+                           'open': open_labels, 'booked': [t for t in open_labels if (c['id'], t) in booked]})
+    resp = jsonify({'date': date_str, 'slots': catalog.slot_labels(), 'courts': courts_out})
+    resp.set_etag(tag)
+    resp.headers['Cache-Control'] = cache_control
+    return resp
+
+
+@app.route('/api/lessons/availability')
+@login_required
+def api_lessons_availability():
+    """JSON: day status for a lessons month (?month=YYYY-MM) and, with ?day=D, that day's slot occupancy.
+
+    Counts only, no rosters. Strong ETag from the month's availability
+    versions plus the current local hour (today's slots turn past on the
+    hour); a matching If-None-Match gets a 304 without reading any bookings.
+    """
+    now_local = datetime.now(ZoneInfo(os.getenv('APP_TIMEZONE', 'America/New_York')))
+    try:
+        month_start = datetime.strptime(request.args['month'], '%Y-%m') if request.args.get('month') else now_local
+    except ValueError:
+        return jsonify({'error': 'month must be YYYY-MM'}), 400
+    lesson_days = generate_month_slots(month_start.year, month_start.month)
+    day = request.args.get('day', type=int)
+    if day is not None and not 1 <= day <= len(lesson_days):
+        return jsonify({'error': 'day is out of range for this month'}), 400
+
+    cache_control = 'private, no-cache'
+    dates_ = [d['date'] for d in lesson_days]
+    tag = availability.etag(mongo.db, 'lessons', dates_, now_local.strftime('%Y-%m-%d %H'), day or '')
+    if request.if_none_match.contains_weak(tag):
+        return _not_modified(tag, cache_control)
+
+    schedule_settings, day_stats, pending = _lesson_month_status(lesson_days, now_local)
+    payload = {
+        'month': f'{month_start.year:04d}-{month_start.month:02d}',
+        'days': [{'date': d['date'], 'no_classes': d['no_classes'], 'open_slots': d['open_slots'], 'full': d['full']}
+                 for d in lesson_days],
+    }
+    if day is not None:
+        selected = lesson_days[day - 1]
+        custom_ranges = rollups.custom_ranges(schedule_settings.get(selected['date'], {}))
+        payload['slots'] = []
+        for slot in selected['slots']:
+            private, group = _lesson_slot_counts(day_stats, pending, selected['date'], slot['time'])
+            payload['slots'].append({
+                'time': slot['time'],
+                'offered': not custom_ranges or rollups.parse_range_minutes(slot['time']) in custom_ranges,
+                'past': _lesson_slot_is_past(selected['date'], slot['time'], now_local),
+                'private': bool(private),
+                'group': group,
+            })
+    resp = jsonify(payload)
+    resp.set_etag(tag)
+    resp.headers['Cache-Control'] = cache_control
+    return resp
+
+
+@app.route('/lessons/day/<date_str>')
+@login_required
+def lessons_day(date_str):
+    """HTML fragment: slot table and booking form of one day, loaded by the /lessons month grid on demand.
+
+    Strong ETag from the day's availability version (see _lesson_day_etag); a
+    matching If-None-Match gets a 304, otherwise the rendered fragment comes
+    from the per-worker cache when another request already built it.
+    """
+    try:
+        date_dt = datetime.strptime(date_str, '%Y-%m-%d')
+    except ValueError:
+        abort(404)
+    now_local = datetime.now(ZoneInfo(os.getenv('APP_TIMEZONE', 'America/New_York')))
+    cache_control = 'private, no-cache'
+    tag = _lesson_day_etag(date_str, now_local)
+    if request.if_none_match.contains_weak(tag):
+        return _not_modified(tag, cache_control)
+
+    day = generate_month_slots(date_dt.year, date_dt.month)[date_dt.day - 1]
+    setting = mongo.db.schedule_settings.find_one({'date': date_str}) or {}
+    day['no_classes'] = setting.get('no_classes', False)
+    day['no_classes_reason'] = setting.get('reason', '')
+    resp = Response(_lesson_day_html(day, date_dt.day - 1, setting, now_local, tag), mimetype='text/html')
+    resp.set_etag(tag)
+    resp.headers['Cache-Control'] = cache_control
+    return resp
+
+
 @app.route('/membership', methods=['GET', 'POST'])
 @login_required
 def membership():
@@ -1874,9 +2067,15 @@ def profile():
             if plan_id and plan_id in MEMBERSHIP_PLANS:
                 plan_name = MEMBERSHIP_PLANS[plan_id].get('name', 'Unknown Plan')
 
+    # Recurring lesson series that still have lessons ahead
+    series = list(mongo.db.lesson_series.find(
+        {'user_id': str(user['_id']), 'end_date': {'$gte': datetime.now().strftime('%Y-%m-%d')}},
+        {'lesson_type': 1, 'time': 1, 'weeks': 1, 'start_date': 1, 'status': 1}).sort('end_date', 1))
+
     return render_template(
         'profile.html',
         user=user,
+        series=series,
         member_since=(lambda u: (
             (u.strftime('%B %d, %Y') if isinstance(u, datetime) else
              (datetime.fromisoformat(u.replace('Z', '+00:00')).strftime('%B %d, %Y') if isinstance(u, str) else 'N/A'))
@@ -1888,7 +2087,37 @@ def profile():
     )
 
 
+@app.route('/lesson-series/<series_id>/cancel', methods=['POST'])
+@login_required
+def cancel_lesson_series(series_id):
+    """Cancel the rest of a recurring lesson series (its owner or an admin)."""
+    try:
+        series = mongo.db.lesson_series.find_one({'_id': ObjectId(series_id)})
+    except Exception:
+        series = None
+    if not series or (series.get('user_id') != str(session['user_id']) and not session.get('is_admin')):
+        flash('Lesson series not found.', 'error')
+        return redirect(url_for('profile'))
+
+    cancelled = lesson_series.cancel(mongo.db, series['_id'])
+
+    # Stop the weekly charges of a subscription-paid series
+    sub_id = (series.get('booking_fields') or {}).get('stripe_subscription_id')
+    if sub_id:
+        try:
+            stripe.Subscription.delete(sub_id)
+        except Exception as e:
+            log.warning('Could not cancel subscription %s: %s', sub_id, e)
+
+    details = f"<p>Your recurring {series.get('lesson_type', '')} lessons at {series.get('time')} have been cancelled.</p>"
+    send_booking_confirmation_email('Lesson Series Cancelled', series.get('name', ''), series.get('email', ''),
+                                    series.get('start_date'), series.get('time', ''), details)
+    flash(f'Recurring lessons cancelled ({len(cancelled)} upcoming booking(s) released).', 'success')
+    return redirect(url_for('profile'))
+
+
 @app.route('/coaches')
+@page_cache.page(['coaches'])
 def coaches():
     """Public page listing all active coaches."""
     # Find users with role 'coach'. Accept documents where `is_active` is True
@@ -1899,6 +2128,7 @@ def coaches():
 
 
 @app.route('/coaches/<coach_id>')
+@page_cache.page(lambda coach_id: ['coaches', f'coach:{coach_id}'])
 def coach_profile(coach_id):
     """Show a coach's profile, availability and upcoming bookings."""
     try:
@@ -1959,7 +2189,7 @@ def coach_profile(coach_id):
 
         return render_template('coach_profile.html', coach=coach, weekdays=weekdays, upcoming=upcoming)
     except Exception as e:
-        print(f"Error loading coach profile: {e}")
+        log.exception('Error loading coach profile')
         flash('Error loading coach profile.', 'error')
         return redirect(url_for('coaches'))
 
@@ -1988,27 +2218,75 @@ def admin_pricing():
     
     return render_template('admin_pricing.html', prices=prices_dollars)
 
+@app.route('/admin/court-catalog', methods=['GET', 'POST'])
+@admin_required
+def admin_court_catalog():
+    """Add courts and edit their surface, price, weekly opening hours and active flag."""
+    if request.method == 'POST':
+        try:
+            court = court_catalog.from_form(request.form)
+            court_catalog.save(mongo.db, court)
+        except court_catalog.CatalogError as e:
+            flash(str(e), 'error')
+        except Exception:
+            log.exception('Error saving court')
+            flash('Failed to save the court. Please try again.', 'error')
+        else:
+            flash(f"{court['name']} saved.", 'success')
+        return redirect(url_for('admin_court_catalog'))
+
+    return render_template('admin_court_catalog.html', courts=court_catalog.get(mongo.db).courts,
+                           weekdays=court_catalog.WEEKDAYS)
+
+def _role_query(selected_role):
+    """Users query for a role filter value (admin|coach|user|member|all)."""
+    if not selected_role or selected_role == 'all':
+        return {}
+    # UI uses 'user' label, but DB stores 'member' role for regular users.
+    # Also include legacy user documents that may not have a `role` field set
+    # (a None match covers documents without the field).
+    if selected_role == 'user':
+        return {'role': {'$in': ['member', None]}}
+    return {'role': selected_role}
+
+
 @app.route('/admin/users')
 @admin_required
 def admin_users():
     """Admin view for managing users"""
     # Allow filtering by role via query param: ?role=admin|coach|member|all
     selected_role = request.args.get('role', 'all')
-    query = {}
-    if selected_role and selected_role != 'all':
-        # UI uses 'user' label, but DB stores 'member' role for regular users.
-        # Also include legacy user documents that may not have a `role` field set.
-        if selected_role == 'user':
-            query = {'$or': [
-                {'role': 'member'},
-                {'role': {'$exists': False}},
-                {'role': None}
-            ]}
-        else:
-            query = {'role': selected_role}
+    query = _role_query(selected_role)
 
-    users = list(mongo.db.users.find(query, {'password': 0}))  # Exclude passwords
-    return render_template('admin_users.html', users=users, selected_role=selected_role)
+    # Optional name/email prefix search (indexed, see user_search.py)
+    q = request.args.get('q', '').strip()
+    search_query = user_search.prefix_query(q)
+    if search_query:
+        query = {'$and': [query, search_query]} if query else search_query
+
+    # Newest first, one page at a time (ObjectIds are creation-ordered)
+    per_page = pagination.page_size(request.args.get('per_page'))
+    users, next_cursor, prev_cursor = pagination.keyset_page(
+        mongo.db.users, query, [('_id', -1)], per_page,
+        after=request.args.get('after'), before=request.args.get('before'),
+        projection={'password': 0})  # Exclude passwords
+    return render_template('admin_users.html', users=users, selected_role=selected_role, q=q,
+                           pager=_pager_links(next_cursor, prev_cursor))
+
+
+@app.route('/admin/users/search')
+@admin_required
+def admin_user_search():
+    """As-you-type JSON lookup by name or email prefix: ?q=&role=&limit="""
+    users = user_search.search(mongo.db, request.args.get('q', ''), _role_query(request.args.get('role', 'all')),
+                               limit=request.args.get('limit', 10, type=int))
+    return jsonify({'results': [{
+        'id': str(u['_id']),
+        'name': u.get('name', ''),
+        'email': u.get('email', ''),
+        'role': u.get('role') or 'member',
+        'is_active': u.get('is_active', True),
+    } for u in users]})
 
 @app.route('/admin')
 @admin_required
@@ -2129,25 +2407,45 @@ def admin_dashboard():
 @app.route('/admin/courts')
 @admin_required
 def admin_courts():
-    from datetime import datetime
-    # Get all court bookings ordered by date,time
-    bookings = list(mongo.db.court_bookings.find().sort([('date', 1), ('time', 1)]))
-    # Ensure user names are present
+    # Filters are pushed into the query; the page is a keyset range over (date, time, _id)
+    date_from = request.args.get('date_from', '').strip()
+    date_to = request.args.get('date_to', '').strip()
+    court_id = request.args.get('court_id', '').strip()
+    conditions = []
+    date_filter = dates.range_filter('date', date_from, date_to)
+    if date_filter:
+        conditions.append(date_filter)
+    if court_id:
+        conditions.append({'court_id': court_id})
+    query = {'$and': conditions} if len(conditions) > 1 else (conditions[0] if conditions else {})
+
+    per_page = pagination.page_size(request.args.get('per_page'))
+    bookings, next_cursor, prev_cursor = pagination.keyset_page(
+        mongo.db.court_bookings, query, [('date', 1), ('time', 1), ('_id', 1)], per_page,
+        after=request.args.get('after'), before=request.args.get('before'))
+
+    # Ensure user names are present (one lookup for the whole page)
+    missing = {}
     for b in bookings:
         if 'user_name' not in b and 'user_id' in b:
             try:
                 uid = b['user_id']
-                if isinstance(uid, str):
-                    uid = ObjectId(uid)
-                user = mongo.db.users.find_one({'_id': uid}, {'name': 1, 'email': 1})
-                if user:
-                    b['user_name'] = user.get('name', '')
-                    b['user_email'] = user.get('email', '')
+                missing[b['_id']] = ObjectId(uid) if isinstance(uid, str) else uid
             except Exception:
                 b['user_name'] = ''
                 b['user_email'] = ''
+    if missing:
+        users = {u['_id']: u for u in mongo.db.users.find({'_id': {'$in': list(set(missing.values()))}},
+                                                         {'name': 1, 'email': 1})}
+        for b in bookings:
+            user = users.get(missing.get(b['_id']))
+            if user:
+                b['user_name'] = user.get('name', '')
+                b['user_email'] = user.get('email', '')
 
-    return render_template('admin_courts.html', bookings=bookings)
+    return render_template('admin_courts.html', bookings=bookings, courts=court_catalog.get(mongo.db).courts,
+                           date_from=date_from, date_to=date_to, court_id=court_id,
+                           pager=_pager_links(next_cursor, prev_cursor))
 
 
 @app.route('/admin/lessons-today')
@@ -2185,6 +2483,121 @@ def admin_lessons_today():
 
     return render_template('admin_lessons_today.html', bookings=todays, today=today_str)
 
+
+@app.route('/admin/export/<kind>.csv')
+@admin_required
+def admin_export(kind):
+    """Stream bookings, court_bookings or users as CSV.
+
+    Query args: date_from/date_to (YYYY-MM-DD, booking date or user signup
+    date), type (lesson type, court id or role) and gzip=1.
+    """
+    if kind not in exports.COLUMNS:
+        abort(404)
+    date_from = request.args.get('date_from', '').strip()
+    date_to = request.args.get('date_to', '').strip()
+    kind_type = request.args.get('type', '').strip()
+
+    conditions = []
+    date_filter = dates.range_filter('created_at' if kind == 'users' else 'date', date_from, date_to)
+    if date_filter is None and (date_from or date_to):
+        # An unparseable date must not silently turn into a full export
+        abort(400, description='date_from and date_to must be YYYY-MM-DD dates.')
+    if date_filter:
+        conditions.append(date_filter)
+    if kind_type:
+        if kind == 'bookings':
+            conditions.append({'lesson_type': kind_type})
+        elif kind == 'court_bookings':
+            conditions.append({'court_id': kind_type})
+        else:
+            conditions.append(_role_query(kind_type))
+    query = {'$and': conditions} if len(conditions) > 1 else (conditions[0] if conditions else {})
+
+    compress = request.args.get('gzip') == '1'
+    filename = f"{kind}-{date_from or 'start'}-to-{date_to or 'now'}.csv" + ('.gz' if compress else '')
+    cursor = exports.find_cursor(mongo.db, kind, query)
+    log.info('Admin export started', extra={'kind': kind, 'query': str(query), 'gzip': compress})
+    return Response(exports.csv_chunks(cursor, exports.COLUMNS[kind], compress),
+                    mimetype='application/gzip' if compress else 'text/csv',
+                    headers={'Content-Disposition': f'attachment; filename="{filename}"'})
+
+@app.route('/admin/analytics')
+@admin_required
+def admin_analytics():
+    """Court utilization, lesson fill rate and revenue over a date range, read from the daily_stats rollups."""
+    today = datetime.now()
+    date_to = request.args.get('date_to') or today.strftime('%Y-%m-%d')
+    date_from = request.args.get('date_from') or (today - timedelta(days=30)).strftime('%Y-%m-%d')
+    try:
+        if datetime.strptime(date_from, '%Y-%m-%d') > datetime.strptime(date_to, '%Y-%m-%d'):
+            date_from, date_to = date_to, date_from
+    except ValueError:
+        flash('Invalid date range.', 'error')
+        return redirect(url_for('admin_analytics'))
+
+    # Optional slice, e.g. Tuesdays 17:00-20:00
+    weekdays = {int(w) for w in request.args.getlist('weekday') if w.isdigit() and int(w) < 7} or None
+    hour_from = request.args.get('hour_from', type=int)
+    hour_to = request.args.get('hour_to', type=int)
+    hours = None
+    if hour_from is not None or hour_to is not None:
+        hours = set(range(hour_from if hour_from is not None else 0, (hour_to if hour_to is not None else 23) + 1))
+
+    # Lesson slots actually offered on days with schedule overrides
+    overrides = {}
+    for st in mongo.db.schedule_settings.find({'date': {'$gte': date_from, '$lte': date_to}},
+                                              {'date': 1, 'no_classes': 1, 'custom_time_slots': 1}):
+        if st.get('no_classes') or st.get('custom_time_slots'):
+            overrides[st['date']] = {h for h in range(9, 22)
+                                     if rollups.lesson_offered(st, slot_search.lesson_label(h))}
+
+    catalog = court_catalog.get(mongo.db)
+    stats = rollups.summarize(
+        rollups.load(mongo.db, date_from, date_to), date_from, date_to,
+        court_ids=catalog.ids(), court_hours=catalog.hours(), lesson_hours=range(9, 22),
+        weekdays=weekdays, hours=hours, lesson_overrides=overrides,
+        court_open=lambda court_id, wd, h: h in catalog.open_hours(court_id, wd))
+    return render_template('admin_analytics.html', stats=stats, date_from=date_from, date_to=date_to,
+                           weekdays=weekdays or set(), hour_from=hour_from, hour_to=hour_to,
+                           weekday_names=['Mon', 'Tue', 'Wed', 'Thu', 'Fri', 'Sat', 'Sun'])
+
+
+@app.route('/admin/profiles')
+@admin_required
+def admin_profiles():
+    """Slowest requests profiled with ?_profile=1, newest-slowest first."""
+    import profiling
+    entries = profiling.profiles.slowest()
+    selected = profiling.profiles.get(request.args.get('id', '')) if request.args.get('id') else None
+    top = profiling.top_frames(selected) if selected else []
+    return render_template('admin_profiles.html', profiles=entries, selected=selected, top_frames=top)
+
+
+@app.route('/admin/profiles/<profile_id>.folded')
+@admin_required
+def admin_profile_folded(profile_id):
+    """Download a profile as collapsed stacks for flamegraph.pl / speedscope."""
+    import profiling
+    profile = profiling.profiles.get(profile_id)
+    if not profile:
+        flash('Profile not found (it may have been evicted).', 'error')
+        return redirect(url_for('admin_profiles'))
+    return app.response_class(
+        profiling.folded_report(profile),
+        mimetype='text/plain',
+        headers={'Content-Disposition': f'attachment; filename=profile-{profile_id}.folded'}
+    )
+
+
+@app.route('/admin/profiles/clear', methods=['POST'])
+@admin_required
+def admin_profiles_clear():
+    import profiling
+    profiling.profiles.clear()
+    flash('Profile buffer cleared.', 'success')
+    return redirect(url_for('admin_profiles'))
+
 # ... (rest of the code remains the same)
     # Demote an admin to regular user
     from bson import ObjectId
@@ -2242,6 +2655,7 @@ def promote_to_coach(user_id):
             }},
             upsert=False
         )
+        page_cache.invalidate(mongo.db, 'coaches')
         flash('User promoted to coach successfully.', 'success')
     except Exception as e:
         flash('Error promoting user to coach. Please try again.', 'error')
@@ -2270,9 +2684,11 @@ def admin_disable_user(user_id):
             try:
                 stripe.Subscription.delete(stripe_sub)
             except Exception as e:
-                print(f"Warning: could not cancel subscription {stripe_sub}: {e}")
+                log.warning('Could not cancel subscription %s: %s', stripe_sub, e)
 
         mongo.db.users.update_one({'_id': ObjectId(user_id)}, {'$set': {'is_active': False, 'disabled_at': datetime.utcnow()}})
+        if user.get('role') == 'coach':
+            page_cache.invalidate(mongo.db, 'coaches')
         flash('User disabled and membership cancelled where possible.', 'success')
 
         # Send notification email to the user about the disable action
@@ -2291,9 +2707,9 @@ def admin_disable_user(user_id):
                 text_content = f"Hi {user.get('name','')},\n\nYour PrimeCourt account has been disabled by an administrator. While disabled you will not be able to sign in or access member features. We attempted to cancel any active membership subscription. If you need help, contact support.\n\nBest regards,\nPrimeCourt Arena Team"
                 send_email_async(subject, recipient, html_content, text_content)
         except Exception as e:
-            print(f"Error sending disable notification email: {e}")
+            log.exception('Error sending disable notification email')
     except Exception as e:
-        print(f"Error disabling user: {e}")
+        log.exception('Error disabling user')
         flash('Error disabling user. Check logs.', 'error')
     return redirect(request.referrer or url_for('admin_users'))
 
@@ -2304,6 +2720,7 @@ def admin_enable_user(user_id):
     from bson import ObjectId
     try:
         mongo.db.users.update_one({'_id': ObjectId(user_id)}, {'$set': {'is_active': True}, '$unset': {'disabled_at': ''}})
+        page_cache.invalidate(mongo.db, 'coaches')
         flash('User account enabled.', 'success')
         # Send notification email to the user about the enable action
         try:
@@ -2322,9 +2739,9 @@ def admin_enable_user(user_id):
                 text_content = f"Hi {user.get('name','')},\n\nYour PrimeCourt account has been re-enabled by an administrator. You can now sign in and access member features again. If you need help restoring a membership, contact support.\n\nBest regards,\nPrimeCourt Arena Team"
                 send_email_async(subject, recipient, html_content, text_content)
         except Exception as e:
-            print(f"Error sending enable notification email: {e}")
+            log.exception('Error sending enable notification email')
     except Exception as e:
-        print(f"Error enabling user: {e}")
+        log.exception('Error enabling user')
         flash('Error enabling user. Check logs.', 'error')
     return redirect(request.referrer or url_for('admin_users'))
 
@@ -2345,9 +2762,10 @@ def demote_user(user_id):
             {'$set': {'is_admin': False, 'role': 'member', 'demoted_at': datetime.now()}},
             upsert=False
         )
+        page_cache.invalidate(mongo.db, 'coaches')
         flash('User demoted from admin successfully.', 'success')
     except Exception as e:
-        print(f"Error demoting user: {e}")
+        log.exception('Error demoting user')
         flash('Error demoting user. Please try again.', 'error')
     return redirect(request.referrer or url_for('admin_users'))
 
@@ -2365,105 +2783,87 @@ def format_datetime(value, format='%Y-%m-%d %H:%M'):
 # Register the filter
 app.jinja_env.filters['format_datetime'] = format_datetime
 
+def _schedule_dates(form):
+    """Days a schedule action applies to: one `date`, or `date_from`..`date_to` limited to the checked `weekdays`."""
+    if form.get('date_from') or form.get('date_to'):
+        weekdays = {int(w) for w in form.getlist('weekdays') if w.isdigit() and int(w) < 7}
+        return dates.days_between(form.get('date_from') or form.get('date_to'),
+                                  form.get('date_to') or form.get('date_from'), weekdays)
+    date = form.get('date')
+    datetime.strptime(date or '', '%Y-%m-%d')
+    return [date]
+
+
+def _schedule_update(action, form, now):
+    """The update document for one day of a schedule action, or None for an unknown action."""
+    if action == 'set_no_classes':
+        return {'$set': {'no_classes': True, 'reason': form.get('reason') or 'Holiday', 'updated_at': now}}
+    if action == 'remove_no_classes':
+        return {'$set': {'no_classes': False, 'updated_at': now}}
+    if action == 'set_time_slots':
+        # Reset no_classes when setting time slots
+        return {'$set': {'custom_time_slots': form.getlist('available_slots'), 'no_classes': False,
+                         'updated_at': now}}
+    if action == 'reset_time_slots':
+        return {'$unset': {'custom_time_slots': ''}, '$set': {'updated_at': now}}
+    return None
+
+
 @app.route('/admin/schedule', methods=['GET', 'POST'])
 @admin_required
 def admin_schedule():
-    # Ensure the schedule_settings collection exists
-    if 'schedule_settings' not in mongo.db.list_collection_names():
-        mongo.db.create_collection('schedule_settings')
-
+    # schedule_settings itself is created with its index at startup (db_indexes)
     if request.method == 'POST':
         action = request.form.get('action')
-        
-        if action == 'set_no_classes':
-            date = request.form.get('date')
-            reason = request.form.get('reason', 'Holiday')
-            
-            # Set this date as no classes
-            mongo.db.schedule_settings.update_one(
-                {'date': date},
-                {'$set': {
-                    'no_classes': True,
-                    'reason': reason,
-                    'updated_at': dt.datetime.now(),
-                    'date': date  # Ensure date is set in case this is a new document
-                }},
-                upsert=True
-            )
-            flash(f'Set {date} as no classes: {reason}', 'success')
-            return redirect(url_for('admin_schedule'))
-            
-        elif action == 'remove_no_classes':
-            date = request.form.get('date')
-            
-            # Remove no classes setting for this date
-            mongo.db.schedule_settings.update_one(
-                {'date': date},
-                {'$set': {
-                    'no_classes': False,
-                    'updated_at': dt.datetime.now(),
-                    'date': date  # Ensure date is set in case this is a new document
-                }},
-                upsert=True
-            )
-            flash(f'Removed no classes setting for {date}', 'success')
+        update = _schedule_update(action, request.form, dt.datetime.now())
+        try:
+            days = _schedule_dates(request.form)
+        except ValueError as e:
+            flash(f'Invalid dates: {e}', 'error')
             return redirect(url_for('admin_schedule'))
-            
-        elif action == 'set_time_slots':
-            date = request.form.get('date')
-            available_slots = request.form.getlist('available_slots')
-            
-            # Update time slot availability for this date
-            mongo.db.schedule_settings.update_one(
-                {'date': date},
-                {'$set': {
-                    'custom_time_slots': available_slots,
-                    'updated_at': dt.datetime.now(),
-                    'date': date,  # Ensure date is set in case this is a new document
-                    'no_classes': False  # Reset no_classes when setting time slots
-                }},
-                upsert=True
-            )
-            flash(f'Updated time slots for {date}', 'success')
+        if update is None or not days:
+            flash('Nothing to update.', 'warning')
             return redirect(url_for('admin_schedule'))
-            
-        elif action == 'reset_time_slots':
-            date = request.form.get('date')
-            
-            # Reset to default time slots for this date
-            mongo.db.schedule_settings.update_one(
-                {'date': date},
-                {
-                    '$unset': {'custom_time_slots': ""},
-                    '$set': {
-                        'updated_at': dt.datetime.now(),
-                        'date': date  # Ensure date is set in case this is a new document
-                    }
-                },
-                upsert=True
-            )
-            flash(f'Reset time slots to default for {date}', 'success')
+
+        # One upsert per day, sent as a single batch
+        ops = [UpdateOne({'date': day}, update, upsert=True) for day in days]
+        try:
+            mongo.db.schedule_settings.bulk_write(ops, ordered=False)
+            availability.bump(mongo.db, 'lessons', *days)
+        except Exception as e:
+            log.error('schedule bulk update failed (%s, %d days): %s', action, len(days), e)
+            flash('Could not update the schedule. Please try again.', 'error')
             return redirect(url_for('admin_schedule'))
-    
-    # Get current schedule settings and prepare for template
+
+        when = days[0] if len(days) == 1 else f'{len(days)} days from {days[0]} to {days[-1]}'
+        messages = {
+            'set_no_classes': f"Set {when} as no classes: {request.form.get('reason') or 'Holiday'}",
+            'remove_no_classes': f'Removed no classes setting for {when}',
+            'set_time_slots': f'Updated time slots for {when}',
+            'reset_time_slots': f'Reset time slots to default for {when}',
+        }
+        flash(messages[action], 'success')
+        return redirect(url_for('admin_schedule'))
+
+    today = datetime.now()
+    today_str = today.strftime('%Y-%m-%d')
+
+    # Upcoming settings only, a page at a time
+    docs, next_cursor, prev_cursor = pagination.keyset_page(
+        mongo.db.schedule_settings, {'date': {'$gte': today_str}}, [('date', 1), ('_id', 1)],
+        limit=pagination.page_size(request.args.get('per_page')),
+        after=request.args.get('after'), before=request.args.get('before'))
     schedule_settings = []
-    for setting in mongo.db.schedule_settings.find().sort('date', 1):
-        # Convert ObjectId to string and ensure all required fields exist
+    for setting in docs:
         setting['_id'] = str(setting.get('_id', ''))
-        setting['date'] = setting.get('date', '')
         setting['no_classes'] = setting.get('no_classes', False)
         setting['reason'] = setting.get('reason', '')
         setting['custom_time_slots'] = setting.get('custom_time_slots', [])
-        
-        # Convert updated_at to string if it exists
-        if 'updated_at' in setting and isinstance(setting['updated_at'], dt.datetime):
+        if isinstance(setting.get('updated_at'), dt.datetime):
             setting['updated_at'] = setting['updated_at'].strftime('%Y-%m-%d %H:%M')
-            
         schedule_settings.append(setting)
-    
-    # Get next 30 days for easy selection
-    from datetime import datetime, timedelta
-    today = datetime.now()
+
+    # Next 30 days for easy selection, marking the ones without classes
     future_dates = []
     for i in range(30):
         date = today + timedelta(days=i)
@@ -2472,21 +2872,23 @@ def admin_schedule():
             'day_name': date.strftime('%A'),
             'formatted': date.strftime('%B %d, %Y')
         })
-    
-    # Process schedule settings to ensure all have required fields
-    processed_settings = []
-    for setting in schedule_settings:
-        if '_id' in setting and not isinstance(setting['_id'], str):
-            setting['_id'] = str(setting['_id'])
-        if 'no_classes' not in setting:
-            setting['no_classes'] = False
-        if 'custom_time_slots' not in setting:
-            setting['custom_time_slots'] = []
-        processed_settings.append(setting)
-    
+    closed = {s['date'] for s in mongo.db.schedule_settings.find(
+        {'date': {'$gte': today_str, '$lte': future_dates[-1]['date']}, 'no_classes': True}, {'date': 1})}
+
+    # Upcoming days that can be reopened / reset from the single-day forms
+    upcoming = list(mongo.db.schedule_settings.find(
+        {'date': {'$gte': today_str},
+         '$or': [{'no_classes': True}, {'custom_time_slots': {'$exists': True}}]},
+        {'date': 1, 'no_classes': 1, 'reason': 1, 'custom_time_slots': 1}).sort('date', 1).limit(200))
+
     return render_template('admin_schedule.html',
-                         schedule_settings=processed_settings,
-                         future_dates=future_dates)
+                           schedule_settings=schedule_settings,
+                           future_dates=future_dates,
+                           closed_dates=closed,
+                           no_class_days=[s for s in upcoming if s.get('no_classes')],
+                           custom_slot_days=[s for s in upcoming if s.get('custom_time_slots') is not None],
+                           pager=_pager_links(next_cursor, prev_cursor))
+
 
 @app.route('/send-reminders')
 def send_reminders():
@@ -0,0 +1,141 @@
+"""Forward search for the next open lesson or court slots.
+
+Scans day windows of CHUNK_DAYS forward from a start date with one indexed
+date-range query per window (bookings or court_bookings, plus the window's
+schedule_settings and pending lesson series for lessons) and stops as soon as
+enough open slots are found, so the common "something this week" search reads
+one small window and a miss over the whole 90-day horizon is still a handful
+of range scans.
+
+Lesson slots are open by `rollups.lesson_open`, the rule the booking flows
+check through lesson_series.unavailable_reason; a court slot is open with no
+booking on that court.
+"""
+from datetime import datetime, timedelta
+
+import lesson_series
+import rollups
+from dates import day_key, range_filter
+
+LESSON_HOURS = range(9, 22)
+COURT_HOURS = range(9, 21)
+GROUP_CAPACITY = rollups.GROUP_CAPACITY
+CHUNK_DAYS = 14
+MAX_DAYS = 90
+MAX_RESULTS = 20
+
+
+def lesson_label(hour):
+    """'6:00 PM - 7:00 PM' style label of the lesson slot starting at `hour`."""
+    def fmt(h):
+        return f"{h - 12 if h > 12 else h}:00 {'AM' if h < 12 else 'PM'}"
+    return f'{fmt(hour)} - {fmt(hour + 1)}'
+
+
+def court_label(hour):
+    """'18:00 - 19:00' style label of the court slot starting at `hour`."""
+    return f'{hour:02d}:00 - {hour + 1:02d}:00'
+
+
+def _windows(start, days):
+    end = start + timedelta(days=days)
+    while start < end:
+        stop = min(start + timedelta(days=CHUNK_DAYS), end)
+        yield start, stop
+        start = stop
+
+
+def _candidates(day, hours_range, weekdays, hours, now):
+    """Start hours of `day` that pass the weekday/hour filters and have not ended yet."""
+    if weekdays and day.weekday() not in weekdays:
+        return []
+    out = []
+    for h in hours_range:
+        if hours is not None and h not in hours:
+            continue
+        if now is not None and day.date() == now.date() and now.hour >= h + 1:
+            continue
+        out.append(h)
+    return out
+
+
+def _live(query):
+    return {'$and': [query, {'status': {'$ne': 'cancelled'}}]}
+
+
+def next_lesson_slots(db, lesson_type, start, days=MAX_DAYS, limit=5, weekdays=None, hours=None, now=None):
+    """First `limit` open lesson slots for `lesson_type` from `start` (a date or datetime) on.
+
+    `weekdays` (0=Mon) and `hours` (start hours) are optional filters; `now`
+    (naive local time) drops today's slots that have already ended.
+    """
+    start = datetime(start.year, start.month, start.day)
+    found = []
+    for win_from, win_to in _windows(start, min(days, MAX_DAYS)):
+        last = (win_to - timedelta(days=1)).strftime('%Y-%m-%d')
+        first = win_from.strftime('%Y-%m-%d')
+        settings = {s['date']: s for s in db.schedule_settings.find(
+            {'date': {'$gte': first, '$lte': last}}, {'date': 1, 'no_classes': 1, 'custom_time_slots': 1})}
+        taken = {}
+        for b in db.bookings.find(_live(range_filter('date', first, last)), {'date': 1, 'time': 1, 'lesson_type': 1}):
+            key = (day_key(b.get('date')), rollups.slot_key(b.get('time')))
+            counts = taken.setdefault(key, {'private': 0, 'group': 0})
+            if b.get('lesson_type') in counts:
+                counts[b['lesson_type']] += 1
+        # Recurring series occurrences not written as bookings yet
+        for key, pending in lesson_series.expand_counts(db, first, last).items():
+            counts = taken.setdefault(key, {'private': 0, 'group': 0})
+            counts['private'] += pending['private']
+            counts['group'] += pending['group']
+
+        day = win_from
+        while day < win_to:
+            date_str = day.strftime('%Y-%m-%d')
+            setting = settings.get(date_str, {})
+            for h in [] if setting.get('no_classes') else _candidates(day, LESSON_HOURS, weekdays, hours, now):
+                slot = f'{h:02d}:00'
+                if not rollups.lesson_offered(setting, lesson_label(h)):
+                    continue
+                counts = taken.get((date_str, slot), {'private': 0, 'group': 0})
+                if not rollups.lesson_open(counts['private'], counts['group'], lesson_type):
+                    continue
+                seats = 1 if lesson_type == 'private' else GROUP_CAPACITY - counts['group']
+                found.append({'date': date_str, 'time': lesson_label(h), 'weekday': day.weekday(),
+                              'lesson_type': lesson_type, 'seats_left': seats})
+                if len(found) >= limit:
+                    return found
+            day += timedelta(days=1)
+    return found
+
+
+def next_court_slots(db, court_ids, start, days=MAX_DAYS, limit=5, weekdays=None, hours=None, now=None,
+                     open_hours=None):
+    """First `limit` open (court, hour) slots on any of `court_ids` from `start` on, earliest first.
+
+    `open_hours(court_id, weekday)` gives each court's bookable start hours
+    (court_catalog.Catalog.open_hours); without it every court uses COURT_HOURS.
+    """
+    start = datetime(start.year, start.month, start.day)
+    found = []
+    for win_from, win_to in _windows(start, min(days, MAX_DAYS)):
+        first = win_from.strftime('%Y-%m-%d')
+        last = (win_to - timedelta(days=1)).strftime('%Y-%m-%d')
+        query = range_filter('date', first, last)
+        query = {'$and': [query, {'court_id': {'$in': list(court_ids)}}]}
+        booked = {(day_key(b.get('date')), b.get('court_id'), b.get('time'))
+                  for b in db.court_bookings.find(_live(query), {'date': 1, 'court_id': 1, 'time': 1})}
+
+        day = win_from
+        while day < win_to:
+            date_str = day.strftime('%Y-%m-%d')
+            day_hours = {c: COURT_HOURS if open_hours is None else open_hours(c, day.weekday()) for c in court_ids}
+            for h in _candidates(day, sorted({h for r in day_hours.values() for h in r}), weekdays, hours, now):
+                label = court_label(h)
+                for court_id in court_ids:
+                    if h not in day_hours[court_id] or (date_str, court_id, label) in booked:
+                        continue
+                    found.append({'date': date_str, 'time': label, 'weekday': day.weekday(), 'court_id': court_id})
+                    if len(found) >= limit:
+                        return found
+            day += timedelta(days=1)
+    return found
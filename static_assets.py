@@ -0,0 +1,179 @@
+"""Fingerprinted, precompressed static assets.
+
+`flask --app app build-static` (run at deploy) copies every file under
+static/ (except user uploads) to static/build/ under a content-hashed name,
+minifying CSS on the way, writes `.gz` (and `.br`, when the optional `brotli`
+package is installed) siblings next to each text asset, and records the
+mapping in static/build/manifest.json:
+
+    style.css -> build/style.3f2a9c41d0b7.css
+
+`url_for('static', filename='style.css')` then points at the hashed file, which
+is served with `Cache-Control: immutable` and the precompressed body matching
+the request's Accept-Encoding. A changed file gets a new name, so browsers
+never need a hard refresh and repeat visits send no static bytes at all.
+
+Without a build (or with app.debug on) URLs get a `?v=<hash>` of the current
+file instead, which still busts caches on every change.
+"""
+import gzip
+import hashlib
+import json
+import logging
+import mimetypes
+import os
+import re
+import shutil
+
+log = logging.getLogger(__name__)
+
+try:
+    import brotli
+except ImportError:  # optional; .br files are skipped without it
+    brotli = None
+
+BUILD_DIR = 'build'
+MANIFEST = 'manifest.json'
+SKIP_DIRS = {BUILD_DIR, 'uploads'}
+COMPRESS_TYPES = {'.css', '.js', '.svg', '.html', '.txt', '.json', '.map'}
+MIN_COMPRESS_BYTES = 512
+IMMUTABLE = 'public, max-age=31536000, immutable'
+
+
+def minify_css(css):
+    """Strip comments and redundant whitespace (a conservative minifier: no rule merging or renaming)."""
+    css = re.sub(r'/\*.*?\*/', '', css, flags=re.S)
+    css = re.sub(r'\s+', ' ', css)
+    css = re.sub(r'\s*([{};,>])\s*', r'\1', css)
+    css = re.sub(r':\s+', ':', css)
+    css = css.replace(';}', '}')
+    return css.strip()
+
+
+def _content_hash(data):
+    return hashlib.sha256(data).hexdigest()[:12]
+
+
+def _sources(static_folder):
+    for root, dirs, files in os.walk(static_folder):
+        rel_root = os.path.relpath(root, static_folder)
+        if rel_root == '.':
+            dirs[:] = [d for d in dirs if d not in SKIP_DIRS]
+        for name in files:
+            if name.startswith('.') or name.endswith(('.gz', '.br')):
+                continue
+            rel = os.path.normpath(os.path.join(rel_root, name)).replace(os.sep, '/')
+            yield rel
+
+
+def build(static_folder):
+    """Write hashed (and precompressed) copies of the static files; returns the manifest."""
+    out_dir = os.path.join(static_folder, BUILD_DIR)
+    # Start from a clean directory so old hashes do not pile up across deploys
+    shutil.rmtree(out_dir, ignore_errors=True)
+    os.makedirs(out_dir)
+    manifest = {}
+    for rel in sorted(_sources(static_folder)):
+        with open(os.path.join(static_folder, rel), 'rb') as f:
+            data = f.read()
+        stem, ext = os.path.splitext(rel)
+        if ext == '.css':
+            data = minify_css(data.decode('utf-8')).encode('utf-8')
+        hashed = f'{stem}.{_content_hash(data)}{ext}'
+        target = os.path.join(out_dir, hashed)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        with open(target, 'wb') as f:
+            f.write(data)
+        if ext in COMPRESS_TYPES and len(data) >= MIN_COMPRESS_BYTES:
+            with open(target + '.gz', 'wb') as f:
+                f.write(gzip.compress(data, compresslevel=9, mtime=0))
+            if brotli is not None:
+                with open(target + '.br', 'wb') as f:
+                    f.write(brotli.compress(data, quality=11))
+        manifest[rel] = f'{BUILD_DIR}/{hashed}'
+    with open(os.path.join(out_dir, MANIFEST), 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    return manifest
+
+
+def load_manifest(static_folder):
+    try:
+        with open(os.path.join(static_folder, BUILD_DIR, MANIFEST)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _accepts(header, coding):
+    for part in (header or '').split(','):
+        name, _, params = part.strip().partition(';')
+        if name.strip() == coding:
+            return params.replace(' ', '') not in ('q=0', 'q=0.0')
+    return False
+
+
+def init_app(app):
+    """Rewrite static URLs to fingerprinted files and serve those precompressed and immutable."""
+    from flask import request, send_from_directory
+    from werkzeug.security import safe_join
+
+    static_folder = app.static_folder
+    manifest = {} if app.debug else load_manifest(static_folder)
+    try:
+        built_at = os.path.getmtime(os.path.join(static_folder, BUILD_DIR, MANIFEST))
+    except OSError:
+        built_at = 0
+    versions = {}  # filename -> (mtime, hash) for the ?v= fallback
+    if manifest:
+        log.info('serving %d fingerprinted static assets', len(manifest))
+
+    @app.cli.command('build-static')
+    def build_static_command():
+        """Fingerprint, minify and precompress the files under static/."""
+        built = build(static_folder)
+        print(f"Built {len(built)} static asset(s){'' if brotli else ' (install brotli for .br files)'}.")
+
+    @app.url_defaults
+    def _fingerprint(endpoint, values):
+        if endpoint != 'static' or not values.get('filename'):
+            return
+        filename = values['filename']
+        if filename.split('/', 1)[0] in SKIP_DIRS:
+            return
+        try:
+            mtime = os.path.getmtime(os.path.join(static_folder, filename))
+        except OSError:
+            return
+        # A file edited after the last build falls back to ?v= until the next build
+        if filename in manifest and mtime <= built_at:
+            values['filename'] = manifest[filename]
+            return
+        cached = versions.get(filename)
+        if not cached or cached[0] != mtime:
+            with open(os.path.join(static_folder, filename), 'rb') as f:
+                cached = versions[filename] = (mtime, _content_hash(f.read()))
+        values.setdefault('v', cached[1])
+
+    default_static = app.view_functions['static']
+
+    def static(filename):
+        if not filename.startswith(BUILD_DIR + '/') or filename.endswith(MANIFEST):
+            return default_static(filename=filename)
+        directory = os.path.join(static_folder, BUILD_DIR)
+        name = filename[len(BUILD_DIR) + 1:]
+        accept = request.headers.get('Accept-Encoding')
+        encoding = None
+        for coding, suffix in (('br', '.br'), ('gzip', '.gz')):
+            candidate = safe_join(directory, name + suffix)
+            if _accepts(accept, coding) and candidate and os.path.isfile(candidate):
+                encoding, name = coding, name + suffix
+                break
+        mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+        resp = send_from_directory(directory, name, mimetype=mimetype, max_age=31536000)
+        resp.headers['Cache-Control'] = IMMUTABLE
+        resp.headers['Vary'] = 'Accept-Encoding'
+        if encoding:
+            resp.headers['Content-Encoding'] = encoding
+        return resp
+
+    app.view_functions['static'] = static
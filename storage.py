@@ -0,0 +1,246 @@
+"""Blob storage for user uploads, so every app node sees the same files.
+
+Uploads are stored under keys such as 'coach_photos/3b1f.../original.jpg'
+and referenced from documents as 'uploads/<key>' (the path they always had
+under static/), so existing pictures keep working. Two backends:
+
+- `LocalStorage` (default) writes under UPLOAD_ROOT (static/uploads). Point it
+  at a shared mount for more than one node. Files are served from
+  /uploads/<key>; with UPLOAD_OFFLOAD=x-accel-redirect (nginx) or x-sendfile
+  (Apache/lighttpd) the view only sends a header and the web server streams
+  the file, so no Python worker is tied up serving images.
+- `S3Storage` (UPLOAD_STORAGE=s3) writes to an S3-compatible bucket
+  (S3_ENDPOINT_URL for MinIO and friends; needs the optional `boto3`). URLs
+  are UPLOAD_PUBLIC_URL + key when the bucket or a CDN is public, otherwise
+  /uploads/<key> redirects to a short-lived presigned URL.
+
+Templates call `upload_url(path)` instead of url_for('static', ...) for
+anything that may be an upload.
+"""
+import logging
+import mimetypes
+import os
+import shutil
+import tempfile
+from urllib.parse import quote
+
+log = logging.getLogger(__name__)
+
+try:
+    import boto3
+except ImportError:  # optional; only the S3 backend needs it
+    boto3 = None
+
+PATH_PREFIX = 'uploads/'
+CHUNK = 64 * 1024
+PRESIGNED_SECONDS = 3600
+OFFLOAD_HEADERS = {'x-accel-redirect': 'X-Accel-Redirect', 'x-sendfile': 'X-Sendfile'}
+
+# mkstemp creates files 0600; stored files get the mode a plain open() would
+# give them, so a front web server running as another user can read them
+# (UPLOAD_OFFLOAD). Read once at import: os.umask() can only be read by setting it.
+_UMASK = os.umask(0o022)
+os.umask(_UMASK)
+FILE_MODE = 0o666 & ~_UMASK
+
+_backend = None
+
+
+def key_for(path):
+    """Storage key of a stored 'uploads/...' path, or None for other static files."""
+    if path and path.startswith(PATH_PREFIX):
+        return path[len(PATH_PREFIX):]
+    return None
+
+
+def path_for(key):
+    """The 'uploads/<key>' path documents store for a key."""
+    return PATH_PREFIX + key
+
+
+def _clean(key):
+    parts = [p for p in key.replace('\\', '/').split('/') if p]
+    if not parts or any(p in ('.', '..') for p in parts):
+        raise ValueError(f'invalid storage key {key!r}')
+    return '/'.join(parts)
+
+
+class LocalStorage:
+    """Files under a directory on this host (or a shared mount)."""
+
+    def __init__(self, root, public_url=None):
+        self.root = root
+        self.public_url = public_url
+
+    def path(self, key):
+        return os.path.join(self.root, *_clean(key).split('/'))
+
+    def save(self, key, stream, content_type=None, cache_control=None):
+        """Stream `stream` to `key`; readers never see a partly written file."""
+        target = self.path(key)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(target), prefix='.upload-')
+        try:
+            with os.fdopen(fd, 'wb') as tmp:
+                shutil.copyfileobj(stream, tmp, CHUNK)
+            os.chmod(tmp_path, FILE_MODE)
+            os.replace(tmp_path, target)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def open(self, key):
+        return open(self.path(key), 'rb')
+
+    def exists(self, key):
+        return os.path.isfile(self.path(key))
+
+    def delete(self, key):
+        try:
+            os.remove(self.path(key))
+        except FileNotFoundError:
+            pass
+
+    def keys(self, prefix=''):
+        """Every stored key under `prefix` ('coach_photos/'), recursively."""
+        base = os.path.join(self.root, *[p for p in prefix.split('/') if p])
+        for root, _dirs, files in os.walk(base):
+            for name in files:
+                if name.startswith('.'):
+                    continue
+                full = os.path.join(root, name)
+                yield os.path.relpath(full, self.root).replace(os.sep, '/')
+
+    def url(self, key):
+        return self.public_url + quote(_clean(key)) if self.public_url else None
+
+
+class S3Storage:
+    """Objects in an S3-compatible bucket."""
+
+    def __init__(self, bucket, prefix='', endpoint_url=None, region=None, public_url=None, client=None):
+        if client is None:
+            if boto3 is None:
+                raise RuntimeError('UPLOAD_STORAGE=s3 needs the boto3 package')
+            client = boto3.client('s3', endpoint_url=endpoint_url or None, region_name=region or None)
+        self.client = client
+        self.bucket = bucket
+        self.prefix = prefix.strip('/') + '/' if prefix.strip('/') else ''
+        self.public_url = public_url
+
+    def _name(self, key):
+        return self.prefix + _clean(key)
+
+    @staticmethod
+    def _missing(e):
+        code = str(getattr(e, 'response', {}).get('Error', {}).get('Code', ''))
+        return code in ('404', 'NoSuchKey', 'NotFound')
+
+    def path(self, key):
+        return None
+
+    def save(self, key, stream, content_type=None, cache_control=None):
+        """Stream `stream` to `key` (boto3 switches to a multipart upload for large files)."""
+        extra = {'ContentType': content_type or mimetypes.guess_type(key)[0] or 'application/octet-stream'}
+        if cache_control:
+            extra['CacheControl'] = cache_control
+        self.client.upload_fileobj(stream, self.bucket, self._name(key), ExtraArgs=extra)
+
+    def open(self, key):
+        """A seekable local copy of the object (Pillow needs to seek)."""
+        try:
+            body = self.client.get_object(Bucket=self.bucket, Key=self._name(key))['Body']
+        except Exception as e:
+            if self._missing(e):
+                raise FileNotFoundError(key) from e
+            raise
+        spool = tempfile.SpooledTemporaryFile(max_size=8 * 1024 * 1024)
+        shutil.copyfileobj(body, spool, CHUNK)
+        spool.seek(0)
+        return spool
+
+    def exists(self, key):
+        try:
+            self.client.head_object(Bucket=self.bucket, Key=self._name(key))
+            return True
+        except Exception as e:
+            if self._missing(e):
+                return False
+            raise
+
+    def delete(self, key):
+        self.client.delete_object(Bucket=self.bucket, Key=self._name(key))
+
+    def keys(self, prefix=''):
+        paginator = self.client.get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=self.prefix + prefix):
+            for obj in page.get('Contents', []):
+                yield obj['Key'][len(self.prefix):]
+
+    def url(self, key):
+        return self.public_url + quote(_clean(key)) if self.public_url else None
+
+    def presigned_url(self, key):
+        return self.client.generate_presigned_url('get_object', Params={'Bucket': self.bucket, 'Key': self._name(key)},
+                                                  ExpiresIn=PRESIGNED_SECONDS)
+
+
+def from_env(static_folder):
+    """The backend configured by UPLOAD_STORAGE and friends."""
+    public_url = os.getenv('UPLOAD_PUBLIC_URL') or None
+    if public_url and not public_url.endswith('/'):
+        public_url += '/'
+    if os.getenv('UPLOAD_STORAGE', 'local').lower() == 's3':
+        return S3Storage(os.environ['S3_BUCKET'], prefix=os.getenv('S3_PREFIX', ''),
+                         endpoint_url=os.getenv('S3_ENDPOINT_URL'), region=os.getenv('S3_REGION'),
+                         public_url=public_url)
+    return LocalStorage(os.getenv('UPLOAD_ROOT') or os.path.join(static_folder, 'uploads'), public_url=public_url)
+
+
+def get():
+    """The app's storage backend (set by init_app)."""
+    return _backend
+
+
+def init_app(app, backend=None):
+    """Pick the storage backend and register /uploads/<key> and the `upload_url` template global."""
+    from flask import Response, abort, redirect, send_file, url_for
+
+    global _backend
+    _backend = backend or from_env(app.static_folder)
+    offload = os.getenv('UPLOAD_OFFLOAD', '').lower()
+    if offload and offload not in OFFLOAD_HEADERS:
+        log.warning('ignoring unknown UPLOAD_OFFLOAD=%s', offload)
+        offload = ''
+    # nginx: `location /protected-uploads/ { internal; alias <UPLOAD_ROOT>/; }`
+    accel_prefix = os.getenv('UPLOAD_ACCEL_PREFIX', '/protected-uploads/')
+    log.info('upload storage: %s%s', type(_backend).__name__, f' ({offload})' if offload else '')
+
+    @app.template_global('upload_url')
+    def upload_url(path):
+        key = key_for(path)
+        if key is None:
+            return url_for('static', filename=path)
+        return _backend.url(key) or url_for('uploaded_file', key=key)
+
+    @app.route('/uploads/<path:key>')
+    def uploaded_file(key):
+        try:
+            key = _clean(key)
+        except ValueError:
+            abort(404)
+        if isinstance(_backend, S3Storage):
+            if not _backend.exists(key):
+                abort(404)
+            return redirect(_backend.presigned_url(key))
+        path = _backend.path(key)
+        if not os.path.isfile(path):
+            abort(404)
+        mimetype = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+        if offload:
+            resp = Response(mimetype=mimetype)
+            resp.headers[OFFLOAD_HEADERS[offload]] = (accel_prefix + quote(key) if offload == 'x-accel-redirect'
+                                                      else os.path.abspath(path))
+            return resp
+        return send_file(path, mimetype=mimetype, conditional=True)
@@ -0,0 +1,110 @@
+"""Jinja setup for production: shared bytecode cache, eager compilation, no auto-reload.
+
+By default every worker parses and compiles each template the first time it
+is rendered, and with auto-reload on it stats the file again on every render.
+Unless FLASK_DEBUG is set (the `run` script), `init_app` instead
+
+- stores compiled templates in a `FileSystemBytecodeCache` (TEMPLATE_CACHE_DIR,
+  default a per-user directory under the system temp dir), so only the first
+  worker on a host compiles a template and the others load its bytecode;
+  entries are keyed by a checksum of the source, so a deploy never serves
+  stale bytecode
+- turns `TEMPLATES_AUTO_RELOAD` off, as templates only change on deploy
+
+`preload(app)` (called once routes have registered their filters) compiles
+every templates/*.html at boot, so no request pays for it.
+`flask --app app check-templates` compiles them all without the cache and exits
+non-zero on syntax errors or unknown filters; run it in CI or before a deploy.
+
+Render time of every render_template() call is recorded per template in
+/metrics.
+"""
+import logging
+import os
+import time
+
+from jinja2 import FileSystemBytecodeCache, TemplateError
+
+import metrics
+
+log = logging.getLogger(__name__)
+
+
+def production_mode():
+    from flask.helpers import get_debug_flag
+    return os.getenv('TEMPLATE_PRODUCTION', '0' if get_debug_flag() else '1') == '1'
+
+
+def template_names(env):
+    """Every page template the loader can find (templates/*.html, partials included)."""
+    return sorted(env.list_templates(filter_func=lambda name: name.endswith('.html')))
+
+
+def preload(app):
+    """Compile (or load from the bytecode cache) every template; returns the names that failed."""
+    env = app.jinja_env
+    started = time.perf_counter()
+    failed = []
+    for name in template_names(env):
+        try:
+            env.get_template(name)
+        except TemplateError as e:
+            # A broken template must not keep the other pages down; check-templates fails the deploy instead
+            log.error('template %s does not compile: %s', name, e)
+            failed.append(name)
+    log.info('preloaded %d template(s) in %.0f ms', len(template_names(env)) - len(failed),
+             (time.perf_counter() - started) * 1000)
+    return failed
+
+
+def check(env):
+    """(name, line, message) for every template that fails to compile, bypassing any cache."""
+    errors = []
+    for name in template_names(env):
+        source, filename, _uptodate = env.loader.get_source(env, name)
+        try:
+            env.compile(source, name, filename)
+        except TemplateError as e:
+            errors.append((name, getattr(e, 'lineno', None), e.message or str(e)))
+    return errors
+
+
+def _render_started(sender, template, context, **extra):
+    from flask import g
+    g.setdefault('_template_timings', []).append(time.perf_counter())
+
+
+def _render_finished(sender, template, context, **extra):
+    from flask import g
+    stack = g.get('_template_timings')
+    if stack:
+        metrics.template_render_duration.observe(time.perf_counter() - stack.pop(), template.name or '-')
+
+
+def init_app(app):
+    """Configure the Jinja environment for production and time template renders."""
+    import click
+    from flask import before_render_template, template_rendered
+
+    before_render_template.connect(_render_started, app)
+    template_rendered.connect(_render_finished, app)
+
+    @app.cli.command('check-templates')
+    def check_templates():
+        """Compile every template and exit non-zero on errors."""
+        errors = check(app.jinja_env)
+        for name, lineno, message in errors:
+            click.echo(f'templates/{name}:{lineno or "?"}: {message}', err=True)
+        if errors:
+            raise SystemExit(1)
+        print(f'{len(template_names(app.jinja_env))} template(s) OK.')
+
+    if not production_mode():
+        return
+    app.config['TEMPLATES_AUTO_RELOAD'] = False
+    app.jinja_env.auto_reload = False
+    if os.getenv('TEMPLATE_BYTECODE_CACHE', '1') != '0':
+        directory = os.getenv('TEMPLATE_CACHE_DIR') or None
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        app.jinja_env.bytecode_cache = FileSystemBytecodeCache(directory, pattern='primecourt-%s.cache')
@@ -0,0 +1,414 @@
+"""Lightweight per-request span tracing written to a rotating JSONL file.
+
+Every request gets a correlation id (taken from an incoming X-Request-ID header
+or generated) and a root span. Mongo commands, Stripe API calls, email
+enqueues, template renders and anything wrapped with `span()` / `@traced`
+become nested child spans. Finished spans are handed to a QueueHandler so the
+request thread never touches the disk; a QueueListener thread writes them as
+one JSON object per line to TRACE_FILE, rotated by size.
+
+Tracing is off unless TRACE_FILE is set. TRACE_SAMPLE_RATE (0..1) traces only
+a fraction of requests.
+
+Inspect the output with:
+
+    python tracing.py slowest traces.jsonl -n 10
+"""
+import argparse
+import contextvars
+import functools
+import glob
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+import time
+import uuid
+
+from metrics import stripe_path_label
+
+TRACE_FILE = os.getenv('TRACE_FILE')
+TRACE_SAMPLE_RATE = float(os.getenv('TRACE_SAMPLE_RATE', 1.0))
+TRACE_MAX_BYTES = int(os.getenv('TRACE_MAX_BYTES', 20 * 1024 * 1024))
+TRACE_BACKUP_COUNT = int(os.getenv('TRACE_BACKUP_COUNT', 5))
+
+# The span currently open in this thread/context (None when not tracing)
+_current_span = contextvars.ContextVar('primecourt_current_span', default=None)
+
+_trace_logger = logging.getLogger('primecourt.trace')
+_trace_logger.propagate = False
+_listener = None
+
+
+class Span:
+    __slots__ = ('trace_id', 'span_id', 'parent', 'name', 'attrs', 'start', '_t0')
+
+    def __init__(self, trace_id, name, parent=None, attrs=None):
+        self.trace_id = trace_id
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent = parent
+        self.name = name
+        self.attrs = attrs or {}
+        self.start = time.time()
+        self._t0 = time.perf_counter()
+
+    def finish(self, error=None):
+        duration = time.perf_counter() - self._t0
+        if error is not None:
+            self.attrs['error'] = str(error)
+        parent_id = self.parent.span_id if self.parent else None
+        _emit(self.trace_id, self.span_id, parent_id, self.name, self.start, duration, self.attrs)
+
+
+def _emit(trace_id, span_id, parent_id, name, start, duration, attrs):
+    _trace_logger.info(json.dumps({
+        'trace_id': trace_id,
+        'span_id': span_id,
+        'parent_id': parent_id,
+        'name': name,
+        'start': round(start, 6),
+        'duration_ms': round(duration * 1000, 3),
+        'attrs': attrs,
+    }, default=str))
+
+
+def current_trace_id():
+    span = _current_span.get()
+    return span.trace_id if span else None
+
+
+def start_span(name, **attrs):
+    """Open a child of the current span; returns None when the request is not traced."""
+    parent = _current_span.get()
+    if parent is None:
+        return None
+    span = Span(parent.trace_id, name, parent, attrs)
+    _current_span.set(span)
+    return span
+
+
+def finish_span(span, error=None):
+    if span is None:
+        return
+    _current_span.set(span.parent)
+    span.finish(error)
+
+
+class span:
+    """Context manager for a nested timed span: `with tracing.span('stripe.refund'):`."""
+
+    def __init__(self, name, **attrs):
+        self.name = name
+        self.attrs = attrs
+        self._span = None
+
+    def __enter__(self):
+        self._span = start_span(self.name, **self.attrs)
+        return self._span
+
+    def __exit__(self, exc_type, exc, tb):
+        finish_span(self._span, exc)
+        return False
+
+
+def traced(name=None):
+    """Decorator that wraps a function call in a span."""
+    def decorator(fn):
+        span_name = name or fn.__name__
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if _current_span.get() is None:
+                return fn(*args, **kwargs)
+            with span(span_name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def record_span(name, duration, **attrs):
+    """Record an already-finished child span (used by callback-style instrumentation)."""
+    parent = _current_span.get()
+    if parent is None:
+        return
+    _emit(parent.trace_id, uuid.uuid4().hex[:16], parent.span_id, name,
+          time.time() - duration, duration, attrs)
+
+
+# --- Mongo, Stripe and template instrumentation -----------------------------
+
+try:
+    from pymongo import monitoring as _pymongo_monitoring
+
+    class MongoTraceListener(_pymongo_monitoring.CommandListener):
+        """Turns each Mongo command issued on a traced thread into a span."""
+
+        def __init__(self):
+            self._pending = {}
+
+        def started(self, event):
+            if _current_span.get() is None:
+                return
+            target = event.command.get(event.command_name)
+            collection = target if isinstance(target, str) else event.command.get('collection', '-')
+            self._pending[(event.request_id, event.connection_id)] = collection
+
+        def _finish(self, event, error=None):
+            collection = self._pending.pop((event.request_id, event.connection_id), None)
+            if collection is None:
+                return
+            attrs = {'collection': collection}
+            if error:
+                attrs['error'] = error
+            record_span(f'mongo.{event.command_name}', event.duration_micros / 1e6, **attrs)
+
+        def succeeded(self, event):
+            self._finish(event)
+
+        def failed(self, event):
+            self._finish(event, str(event.failure))
+except ImportError:
+    _pymongo_monitoring = None
+    MongoTraceListener = None
+
+
+class TracedStripeClient:
+    """Wraps a stripe HTTP client so every API call becomes a `stripe` span."""
+
+    def __init__(self, client):
+        self._client = client
+
+    def __getattr__(self, name):
+        return getattr(self._client, name)
+
+    def request_with_retries(self, method, url, *args, **kwargs):
+        with span('stripe', method=method.upper(), path=stripe_path_label(url)):
+            return self._client.request_with_retries(method, url, *args, **kwargs)
+
+    def request_stream_with_retries(self, method, url, *args, **kwargs):
+        with span('stripe', method=method.upper(), path=stripe_path_label(url), stream=True):
+            return self._client.request_stream_with_retries(method, url, *args, **kwargs)
+
+
+def _template_started(sender, template, context, **extra):
+    start_span('render_template', template=template.name)
+
+
+def _template_finished(sender, template, context, **extra):
+    current = _current_span.get()
+    if current is not None and current.name == 'render_template':
+        finish_span(current)
+
+
+def _unwind(root, error=None):
+    """Finish spans left open above `root` and make it current again.
+
+    Signal-based spans (render_template) get no finished signal when the
+    template raises; without this, error handler spans would nest under them.
+    """
+    current = _current_span.get()
+    while current is not None and current is not root:
+        finish_span(current, error)
+        current = _current_span.get()
+    _current_span.set(root)
+
+
+def _request_failed(sender, exception, **extra):
+    # Sent before the 500 handler runs, so its spans hang off the request root
+    from flask import g
+    root = g.get('_trace_root')
+    if root is not None:
+        _unwind(root, exception)
+
+
+def _start_listener():
+    global _listener
+    if _listener is not None:
+        return
+    directory = os.path.dirname(os.path.abspath(TRACE_FILE))
+    os.makedirs(directory, exist_ok=True)
+    file_handler = logging.handlers.RotatingFileHandler(
+        TRACE_FILE, maxBytes=TRACE_MAX_BYTES, backupCount=TRACE_BACKUP_COUNT, encoding='utf-8')
+    file_handler.setFormatter(logging.Formatter('%(message)s'))
+    span_queue = queue.SimpleQueue()
+    for h in list(_trace_logger.handlers):
+        if isinstance(h, logging.handlers.QueueHandler):
+            _trace_logger.removeHandler(h)
+    _trace_logger.addHandler(logging.handlers.QueueHandler(span_queue))
+    _trace_logger.setLevel(logging.INFO)
+    _listener = logging.handlers.QueueListener(span_queue, file_handler)
+    _listener.start()
+
+
+def _restart_listener():
+    # A listener thread started before gunicorn --preload forks does not exist
+    # in the workers; give each child its own queue, file handler and thread.
+    global _listener
+    _listener = None
+    _start_listener()
+
+
+_mongo_listener_installed = False
+
+
+def install_mongo_listener():
+    """Register the span listener globally; call before creating MongoClients."""
+    global _mongo_listener_installed
+    if not TRACE_FILE or _mongo_listener_installed or MongoTraceListener is None:
+        return
+    _pymongo_monitoring.register(MongoTraceListener())
+    _mongo_listener_installed = True
+
+
+def install_stripe_client(stripe_module):
+    """Wrap stripe's HTTP client (after metrics.install_stripe_client) with spans."""
+    if not TRACE_FILE:
+        return
+    client = getattr(stripe_module, 'default_http_client', None)
+    if client is None:
+        client = stripe_module.new_default_http_client()
+    if not isinstance(client, TracedStripeClient):
+        stripe_module.default_http_client = TracedStripeClient(client)
+
+
+def init_app(app):
+    """Enable per-request tracing on `app` when TRACE_FILE is configured."""
+    if not TRACE_FILE:
+        return False
+
+    from flask import before_render_template, g, got_request_exception, request, template_rendered
+
+    _start_listener()
+    if hasattr(os, 'register_at_fork'):
+        os.register_at_fork(after_in_child=_restart_listener)
+    before_render_template.connect(_template_started, app)
+    template_rendered.connect(_template_finished, app)
+    got_request_exception.connect(_request_failed, app)
+
+    @app.before_request
+    def _trace_start():
+        if TRACE_SAMPLE_RATE < 1.0 and random.random() >= TRACE_SAMPLE_RATE:
+            return
+        trace_id = (request.headers.get('X-Request-ID') or '')[:64] or uuid.uuid4().hex
+        root = Span(trace_id, 'request', attrs={'method': request.method, 'path': request.path})
+        _current_span.set(root)
+        g._trace_root = root
+
+    @app.after_request
+    def _trace_finish(response):
+        root = g.pop('_trace_root', None)
+        if root is not None:
+            _unwind(root)
+            root.attrs['endpoint'] = request.endpoint
+            root.attrs['status'] = response.status_code
+            response.headers['X-Request-ID'] = root.trace_id
+            _current_span.set(None)
+            root.finish()
+        return response
+
+    @app.teardown_request
+    def _trace_teardown(exc):
+        # after_request did not run (the exception propagated): close the trace here
+        root = g.pop('_trace_root', None)
+        if root is not None:
+            _unwind(root, exc)
+            root.attrs['endpoint'] = request.endpoint
+            root.attrs['status'] = 500
+            root.finish(exc)
+        _current_span.set(None)
+
+    return True
+
+
+# --- CLI: slowest traces and their critical path ----------------------------
+
+def load_traces(paths):
+    """Group span lines from the given JSONL files (and their rotations) by trace id."""
+    traces = {}
+    for pattern in paths:
+        for path in sorted(glob.glob(pattern) + glob.glob(pattern + '.[0-9]*')):
+            with open(path, encoding='utf-8') as fh:
+                for line in fh:
+                    try:
+                        sp = json.loads(line)
+                    except ValueError:
+                        continue
+                    traces.setdefault(sp['trace_id'], []).append(sp)
+    return traces
+
+
+def critical_path(spans):
+    """Spans that determine the root's end time, found by walking back from the end.
+
+    Starting at the root's end, repeatedly pick the child that finished last
+    before the cursor, descend into it, then continue from that child's start.
+    Whatever is not covered by children is the parent's own (self) time.
+    """
+    children = {}
+    root = None
+    for sp in spans:
+        sp['end'] = sp['start'] + sp['duration_ms'] / 1000
+        if sp.get('parent_id'):
+            children.setdefault(sp['parent_id'], []).append(sp)
+        elif root is None or sp['name'] == 'request':
+            root = sp
+    if root is None:
+        return None, []
+
+    path = []
+
+    def walk(node, depth):
+        path.append((depth, node))
+        cursor = node['end']
+        kids = sorted(children.get(node['span_id'], []), key=lambda s: s['end'], reverse=True)
+        chosen = []
+        for kid in kids:
+            if kid['end'] <= cursor + 1e-6:
+                chosen.append(kid)
+                cursor = kid['start']
+        for kid in reversed(chosen):
+            walk(kid, depth + 1)
+
+    walk(root, 0)
+    return root, path
+
+
+def _cmd_slowest(args):
+    traces = load_traces(args.files)
+    rows = []
+    for trace_id, spans in traces.items():
+        root, path = critical_path(spans)
+        if root is not None:
+            rows.append((root['duration_ms'], trace_id, root, path, len(spans)))
+    rows.sort(key=lambda r: r[0], reverse=True)
+    if not rows:
+        print('No traces found.')
+        return 1
+    for duration, trace_id, root, path, count in rows[:args.n]:
+        attrs = root.get('attrs', {})
+        print(f"{duration:9.1f} ms  {attrs.get('method', '')} {attrs.get('path', '')} "
+              f"[{attrs.get('status', '')}] trace={trace_id} spans={count}")
+        for depth, sp in path[1:]:
+            pct = 100.0 * sp['duration_ms'] / duration if duration else 0
+            detail = ' '.join(f'{k}={v}' for k, v in sp.get('attrs', {}).items())
+            print(f"    {'  ' * depth}{sp['duration_ms']:8.1f} ms {pct:5.1f}%  {sp['name']} {detail}".rstrip())
+        print()
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Inspect PrimeCourt request traces.')
+    sub = parser.add_subparsers(dest='command', required=True)
+    p = sub.add_parser('slowest', help='print the slowest traces and their critical path')
+    p.add_argument('files', nargs='*', default=[TRACE_FILE or 'traces.jsonl'])
+    p.add_argument('-n', type=int, default=10, help='number of traces to show')
+    p.set_defaults(func=_cmd_slowest)
+    args = parser.parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,109 @@
+"""Indexed user lookup for the admin screens.
+
+Every user document carries `name_lc` and `email_lc`: the name and email
+normalized (case-folded, whitespace collapsed) by `search_fields()`. An
+anchored, case-sensitive regex on those fields ('^smi') becomes a tight range
+scan on their indexes, so prefix search stays in the low milliseconds however
+many users there are.
+
+With USER_TEXT_SEARCH=1 a text index over name and email is also built and
+used to top up short prefix results with whole-word matches (e.g. a surname).
+
+`backfill()` fills the fields on documents written before they existed; it runs
+after the startup index build (see db_indexes.init_app).
+"""
+import logging
+import os
+import re
+
+from pymongo import ASCENDING, UpdateOne
+from pymongo.errors import OperationFailure
+
+log = logging.getLogger(__name__)
+
+USER_TEXT_SEARCH = os.getenv('USER_TEXT_SEARCH', '0') == '1'
+MAX_RESULTS = 20
+PROJECTION = {'name': 1, 'email': 1, 'role': 1, 'is_active': 1}
+
+
+def normalize(text):
+    return ' '.join(str(text or '').split()).casefold()
+
+
+def search_fields(name, email):
+    """The normalized fields to store alongside a user's name and email."""
+    return {'name_lc': normalize(name), 'email_lc': normalize(email)}
+
+
+def prefix_query(q):
+    """Query matching users whose name or email starts with `q`, or None for an empty query."""
+    q = normalize(q)
+    if not q:
+        return None
+    pattern = '^' + re.escape(q)
+    return {'$or': [{'email_lc': {'$regex': pattern}}, {'name_lc': {'$regex': pattern}}]}
+
+
+def _prefix_matches(db, field, pattern, role_query, limit):
+    query = {field: {'$regex': pattern}}
+    if role_query:
+        query = {'$and': [role_query, query]}
+    cursor = db.users.find(query, PROJECTION).sort(field, 1).limit(limit)
+    try:
+        # The field's own index returns matches in sort order, so the scan stops after `limit`
+        return list(cursor.hint([(field, ASCENDING)]))
+    except OperationFailure as e:
+        # Index not built yet
+        log.warning('user search without the %s index: %s', field, e)
+        return list(db.users.find(query, PROJECTION).sort(field, 1).limit(limit))
+
+
+def search(db, q, role_query=None, limit=10):
+    """Up to `limit` users matching `q`, as projected documents (prefix matches first).
+
+    Email and name prefixes are two separately limited queries, merged here:
+    an $or sorted on one field cannot use the other field's index for the
+    order and would fetch and sort every match of a short prefix.
+    """
+    limit = max(1, min(int(limit), MAX_RESULTS))
+    q = normalize(q)
+    if not q:
+        return []
+    pattern = '^' + re.escape(q)
+    results, seen = [], set()
+    for field in ('email_lc', 'name_lc'):
+        for user in _prefix_matches(db, field, pattern, role_query, limit):
+            if user['_id'] not in seen:
+                seen.add(user['_id'])
+                results.append(user)
+    results = results[:limit]
+
+    if USER_TEXT_SEARCH and len(results) < limit and len(q) >= 3:
+        text_query = {'$text': {'$search': q}, '_id': {'$nin': list(seen)}}
+        if role_query:
+            text_query = {'$and': [role_query, text_query]}
+        try:
+            results += list(db.users.find(text_query, dict(PROJECTION, score={'$meta': 'textScore'}))
+                            .sort([('score', {'$meta': 'textScore'})]).limit(limit - len(results)))
+        except Exception as e:
+            # Text index not built yet
+            log.warning('user text search unavailable: %s', e)
+    return results
+
+
+def backfill(db, batch=1000):
+    """Set name_lc/email_lc on users that do not have them yet; returns the count."""
+    updated = 0
+    ops = []
+    cursor = db.users.find({'$or': [{'email_lc': {'$exists': False}}, {'name_lc': {'$exists': False}}]},
+                           {'name': 1, 'email': 1})
+    for user in cursor:
+        ops.append(UpdateOne({'_id': user['_id']}, {'$set': search_fields(user.get('name'), user.get('email'))}))
+        if len(ops) >= batch:
+            updated += db.users.bulk_write(ops, ordered=False).modified_count
+            ops = []
+    if ops:
+        updated += db.users.bulk_write(ops, ordered=False).modified_count
+    if updated:
+        log.info('backfilled search fields on %d users', updated)
+    return updated